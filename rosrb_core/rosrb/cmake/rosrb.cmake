@@ -3,6 +3,14 @@
 
 rosbuild_find_ros_package(rosrb)
 
+# Set ROSRB_PACKED_ARRAYS before rosbuild_init() to generate numeric array
+# fields as ROS::PackedArray (or Numo::NArray).
+if(ROSRB_PACKED_ARRAYS)
+  set(_rosrb_gen_flags --packed-arrays)
+else(ROSRB_PACKED_ARRAYS)
+  set(_rosrb_gen_flags "")
+endif(ROSRB_PACKED_ARRAYS)
+
 # Message-generation support.
 macro(genmsg_rb)
   rosbuild_get_msgs(_msglist)
@@ -23,7 +31,7 @@ macro(genmsg_rb)
   
     # Add the rule to build the .rb from the .msg.
     add_custom_command(OUTPUT ${_output_rb} 
-                       COMMAND ${genmsg_rb_exe} ${_input}
+                       COMMAND ${genmsg_rb_exe} ${_rosrb_gen_flags} ${_input}
                        DEPENDS ${_input} ${genmsg_rb_exe} ${gendeps_exe} ${${PROJECT_NAME}_${_msg}_GENDEPS} ${ROS_MANIFEST_LIST})
     list(APPEND _autogen ${_output_rb})
   endforeach(_msg)
@@ -78,7 +86,7 @@ macro(gensrv_rb)
   
     # Add the rule to build the .rb from the .srv
     add_custom_command(OUTPUT ${_output_rb} 
-                       COMMAND ${gensrv_rb_exe} ${_input}
+                       COMMAND ${gensrv_rb_exe} ${_rosrb_gen_flags} ${_input}
                        DEPENDS ${_input} ${gensrv_rb_exe} ${gendeps_exe} ${${PROJECT_NAME}_${_srv}_GENDEPS} ${ROS_MANIFEST_LIST})
     list(APPEND _autogen ${_output_rb})
   endforeach(_srv)
@@ -17,6 +17,9 @@ def mkdir_p(path):
         else: raise
 
 args = sys.argv[1:]
+# --packed-arrays is passed to the generators
+gen_flags = [arg for arg in args if arg == "--packed-arrays"]
+args = [arg for arg in args if arg != "--packed-arrays"]
 for arg in args:
     home = os.environ['HOME']
     output_path = os.path.join(home, '.ros', 'rosrb_gen')
@@ -33,7 +36,7 @@ for arg in args:
             msgs = glob.glob(os.path.join(msg_dir, "*.msg"))
             if msgs:
                 cmd = ["rosrun", "rosrb", "genmsg_rb.py",
-                       "--output-dir", output_path]
+                       "--output-dir", output_path] + gen_flags
                 cmd.extend(msgs)
                 subprocess.call(cmd)
                 cmd = ["rosrun", "rosrb", "genmsg_rb.py",
@@ -52,7 +55,7 @@ for arg in args:
             srvs = glob.glob(os.path.join(srv_dir, "*.srv"))
             if srvs:
                 cmd = ["rosrun", "rosrb", "gensrv_rb.py",
-                       "--output-dir", output_path]
+                       "--output-dir", output_path] + gen_flags
                 cmd.extend(srvs)
                 subprocess.call(cmd)
                 cmd = ["rosrun", "rosrb", "gensrv_rb.py",
@@ -53,9 +53,29 @@ except:
 
 #-- msg ------------------------------------------------------
 
+# numeric arrays are ROS::PackedArray (or Numo::NArray) with --packed-arrays
+packed_arrays = False
+
+PACKED_TYPES = {'int8': 1, 'char': 1, 'uint8': 1, 'byte': 1,
+                'int16': 2, 'uint16': 2, 'int32': 4, 'uint32': 4,
+                'int64': 8, 'uint64': 8, 'float32': 4, 'float64': 8}
+
+def is_packed(elem_type):
+    return packed_arrays and elem_type in PACKED_TYPES
+
+# nested messages are written with serialize_into/deserialize_from of their
+# classes, or expanded into the outer methods with --inline-nested. every
+# class has the methods in both modes, so classes of either mode nest.
+inline_nested = False
+
+def ruby_class_name(spec):
+    return "%s::Msg::%s" % (snake_to_camel(spec.package), spec.short_name)
+
 def ruby_default_value(type):
     base_type, is_array, array_len = roslib.msgs.parse_type(type)
-    if is_array:
+    if is_array and is_packed(base_type):
+        return "ROS::PackedArray.wrap('%s', String.new)" % base_type
+    elif is_array:
         return "[]"
     elif roslib.msgs.is_builtin(base_type):
         if type in ['byte', 'int8', 'int16', 'int32', 'int64',
@@ -68,9 +88,9 @@ def ruby_default_value(type):
         elif type == 'string':
             return '""'
         elif type == 'time':
-            return 'ROS::Time.new(0, 0)'
+            return 'ROS::Time::ZERO'
         elif type == 'duration':
-            return 'ROS::Duration.new(0, 0)'
+            return 'ROS::Duration::ZERO'
         else:
             raise Exception
     elif roslib.msgs.is_header_type(base_type):
@@ -98,6 +118,11 @@ def write_common_requires(s, spec):
 
 def write_requires(s, spec, written_packages):
     for field in spec.parsed_fields():
+        # only messages with packed fields load Numo
+        if field.is_array and is_packed(field.base_type):
+            if 'ros/packed_array' not in written_packages:
+                written_packages.add('ros/packed_array')
+                s.write("require 'ros/packed_array'\n")
         if not field.is_builtin:
             if field.is_header:
                 if 'std_msgs' not in written_packages:
@@ -198,6 +223,17 @@ def write_constants(s, spec):
 def write_initialize_method(s, spec):
     s.write("      ")
     s.write("def initialize(*args)\n")
+    # fast path of new() without arguments, used for default values of
+    # nested messages. it skips kwargs handling and class checks.
+    s.write("        ")
+    s.write("if args.empty?\n")
+    for field in spec.parsed_fields():
+        s.write("          ")
+        s.write("@%s = %s\n" % (field.name, ruby_default_value(field.type)))
+    s.write("          ")
+    s.write("return\n")
+    s.write("        ")
+    s.write("end\n")
     s.write("        ")
     s.write("kwargs = (::Hash === args.last ? args.pop : {})\n")
     for field in spec.parsed_fields():
@@ -206,7 +242,9 @@ def write_initialize_method(s, spec):
     for field in spec.parsed_fields():
         s.write("        ")
         s.write("value = kwargs[:%s]\n" % field.name)
-        if field.is_array:
+        if field.is_array and is_packed(field.base_type):
+            cond = "ROS::PackedArray.array?(value)"
+        elif field.is_array:
             cond = "::Array === value"
         elif field.is_builtin:
             if field.type in ('byte', 'int8', 'int16', 'int32', 'int64',
@@ -245,6 +283,16 @@ def write_accessor(s, spec):
         s.write("attr_accessor :%s\n" % name)
     s.write("\n")
 
+# packed array is written as it is
+def write_serialize_packed_array(s, name, elem_type, depth):
+    indent = "  " * depth
+    s.write(indent)
+    s.write("data = ROS::PackedArray.dump('%s', %s)\n" % (elem_type, name))
+    s.write(indent)
+    s.write("buffer.write([data.bytesize / %d].pack('V'))\n" % PACKED_TYPES[elem_type])
+    s.write(indent)
+    s.write("buffer.write(data)\n")
+
 def write_serialize_array(s, name, elem_type, depth):
     indent = "  " * depth
     s.write(indent)
@@ -257,10 +305,10 @@ def write_serialize_array(s, name, elem_type, depth):
     elif roslib.msgs.is_builtin(elem_type):
         write_serialize_builtin(s, 'elem', elem_type, depth + 1)
     elif roslib.msgs.is_header_type(elem_type):
-        write_serialize_header(s, 'elem', elem_type, depth + 1)
+        write_serialize_header(s, 'elem', depth + 1)
     elif roslib.msgs.is_registered(elem_type):
         elem_spec = roslib.msgs.get_registered(elem_type)
-        write_serialize_complex(s, 'elem', elem_spec, depth + 1)
+        write_serialize_nested(s, 'elem', elem_spec, depth + 1)
     else:
         raise Exception
     s.write(indent)
@@ -324,9 +372,12 @@ def write_serialize_builtin(s, name, type, depth):
         s.write("buffer.write([%s.bytesize].pack('V'))\n" % name)
         s.write(indent)
         s.write("buffer.write(%s)\n" % name)
-    elif type == 'time' or type == 'duration':
+    elif type == 'time':
         s.write(indent)
         s.write("buffer.write([%s.secs, %s.nsecs].pack('VV'))\n" % (name, name))
+    elif type == 'duration':
+        s.write(indent)
+        s.write("buffer.write([%s.secs, %s.nsecs].pack('l<l<'))\n" % (name, name))
     else:
         raise Exception("%s is not a builtin type!" % type)
 
@@ -343,7 +394,9 @@ def write_serialize_header(s, name, depth):
 def write_serialize_complex(s, name, spec, depth):
     indent = "  " * depth
     for field in spec.parsed_fields():
-        if field.is_array:
+        if field.is_array and is_packed(field.base_type):
+            write_serialize_packed_array(s, "%s.%s" % (name, field.name), field.base_type, depth)
+        elif field.is_array:
             write_serialize_array(s, "%s.%s" % (name, field.name), field.base_type, depth)
         elif field.is_builtin:
             write_serialize_builtin(s, "%s.%s" % (name, field.name), field.type, depth)
@@ -351,12 +404,20 @@ def write_serialize_complex(s, name, spec, depth):
             write_serialize_header(s, "%s.%s" % (name, field.name), depth)
         else:
             subspec = roslib.msgs.get_registered(field.type)
-            write_serialize_complex(s, "%s.%s" % (name, field.name), subspec, depth)
+            write_serialize_nested(s, "%s.%s" % (name, field.name), subspec, depth)
+
+def write_serialize_nested(s, name, spec, depth):
+    if inline_nested:
+        write_serialize_complex(s, name, spec, depth)
+    else:
+        s.write("  " * depth)
+        s.write("%s.serialize_into(buffer, %s)\n" % (ruby_class_name(spec), name))
 
 def write_serialize_method(s, spec):
     s.write("      ")
     s.write("def serialize(buffer)\n")
-    write_serialize_complex(s, "self", spec, 4)
+    s.write("        ")
+    s.write("%s.serialize_into(buffer, self)\n" % spec.short_name)
 #    s.write("    ")    
 #    s.write("rescue\n")
 #    s.write("      ")    
@@ -364,6 +425,24 @@ def write_serialize_method(s, spec):
     s.write("      ")
     s.write("end\n")
     s.write("\n")
+    s.write("      ")
+    s.write("def self.serialize_into(buffer, msg)\n")
+    write_serialize_complex(s, "msg", spec, 4)
+    s.write("      ")
+    s.write("end\n")
+    s.write("\n")
+
+# packed array wraps the bytes of the elements
+def write_deserialize_packed_array(s, name, elem_type, depth):
+    indent = "  " * depth
+    s.write(indent)
+    s.write("length = str.byteslice(head, 4).unpack('V')[0] * %d\n" % PACKED_TYPES[elem_type])
+    s.write(indent)
+    s.write("head += 4\n")
+    s.write(indent)
+    s.write("%s = ROS::PackedArray.wrap('%s', str.byteslice(head, length))\n" % (name, elem_type))
+    s.write(indent)
+    s.write("head += length\n")
 
 def write_deserialize_array(s, name, elem_type, depth):
     indent = "  " * depth
@@ -382,14 +461,14 @@ def write_deserialize_array(s, name, elem_type, depth):
         write_deserialize_builtin(s, "%s[i]" % name, elem_type, depth + 1)
     elif roslib.msgs.is_header_type(elem_type):
         s.write(indent + "  ")
-        s.write("%s[i] = StdMsgs::Msg::Header.new()\n" % name)
-        write_deserialize_header(s, "%s[i]" % name, elem_type, depth + 1)
+        s.write("%s[i] = StdMsgs::Msg::Header.allocate\n" % name)
+        write_deserialize_header(s, "%s[i]" % name, depth + 1)
     elif roslib.msgs.is_registered(elem_type):
         elem_spec = roslib.msgs.get_registered(elem_type)
         s.write(indent + "  ")
         vars = (name, snake_to_camel(elem_spec.package), elem_spec.short_name)
-        s.write("%s[i] = %s::Msg::%s.new()\n" % vars)
-        write_deserialize_complex(s, "%s[i]" % name, elem_spec, depth + 1)
+        s.write("%s[i] = %s::Msg::%s.allocate\n" % vars)
+        write_deserialize_nested(s, "%s[i]" % name, elem_spec, depth + 1)
     else:
         raise Exception
     s.write(indent)
@@ -479,9 +558,14 @@ def write_deserialize_builtin(s, name, type, depth):
         s.write("%s = str.byteslice(head, length)\n" % name)
         s.write(indent)
         s.write("head += length\n")
-    elif type == 'time' or type == 'duration':
+    elif type == 'time':
         s.write(indent)
-        s.write("%s.secs, %s.nsecs = str.byteslice(head, 8).unpack('VV')\n" % (name, name))
+        s.write("%s = ROS::Time.new(*str.byteslice(head, 8).unpack('VV'))\n" % name)
+        s.write(indent)
+        s.write("head += 8\n")
+    elif type == 'duration':
+        s.write(indent)
+        s.write("%s = ROS::Duration.new(*str.byteslice(head, 8).unpack('l<l<'))\n" % name)
         s.write(indent)
         s.write("head += 8\n")
     else:
@@ -490,7 +574,9 @@ def write_deserialize_builtin(s, name, type, depth):
 def write_deserialize_header(s, name, depth):
     indent = "  " * depth
     s.write(indent)
-    s.write("%(name)s.seq, %(name)s.stamp.secs, %(name)s.stamp.nsecs = str.byteslice(head, 12).unpack('VVV')\n" % {'name': name})
+    s.write("%(name)s.seq, secs, nsecs = str.byteslice(head, 12).unpack('VVV')\n" % {'name': name})
+    s.write(indent)
+    s.write("%s.stamp = ROS::Time.new(secs, nsecs)\n" % name)
     s.write(indent)
     s.write("head += 12\n")
     s.write(indent)
@@ -502,37 +588,56 @@ def write_deserialize_header(s, name, depth):
     s.write(indent)
     s.write("head += length\n")
 
+# Nested messages are created with allocate. deserialize assigns every
+# field, so running initialize for them would only make garbage.
 def write_deserialize_complex(s, name, spec, depth):
     indent = "  " * depth
     for field in spec.parsed_fields():
-        if field.is_array:
+        if field.is_array and is_packed(field.base_type):
+            write_deserialize_packed_array(s, "%s.%s" % (name, field.name), field.base_type, depth)
+        elif field.is_array:
             write_deserialize_array(s, "%s.%s" % (name, field.name), field.base_type, depth)
         elif field.is_builtin:
             write_deserialize_builtin(s, "%s.%s" % (name, field.name), field.type, depth)
         elif field.is_header:
             s.write(indent)
-            s.write("%(name)s = StdMsgs::Msg::Header.new() if %(name)s == nil\n" % {'name': name + "." + field.name})
+            s.write("%(name)s = StdMsgs::Msg::Header.allocate if %(name)s == nil\n" % {'name': name + "." + field.name})
             write_deserialize_header(s, "%s.%s" % (name, field.name), depth)
         else:
             subspec = roslib.msgs.get_registered(field.type)
             s.write(indent)
             vars = {'name': name + "." + field.name, 'pkg': snake_to_camel(subspec.package), 'msg': subspec.short_name}
-            s.write("%(name)s = %(pkg)s::Msg::%(msg)s.new() if %(name)s == nil\n" % vars)
-            write_deserialize_complex(s, "%s.%s" % (name, field.name), subspec, depth)
+            s.write("%(name)s = %(pkg)s::Msg::%(msg)s.allocate if %(name)s == nil\n" % vars)
+            write_deserialize_nested(s, "%s.%s" % (name, field.name), subspec, depth)
+
+def write_deserialize_nested(s, name, spec, depth):
+    if inline_nested:
+        write_deserialize_complex(s, name, spec, depth)
+    else:
+        s.write("  " * depth)
+        s.write("head = %s.deserialize_from(str, head, %s)\n" % (ruby_class_name(spec), name))
 
 
 def write_deserialize_method(s, spec):
     s.write("      ")
     s.write("def deserialize(str)\n")
     s.write("        ")
-    s.write("head = 0\n")
-    write_deserialize_complex(s, "self", spec, 4)
+    s.write("%s.deserialize_from(str, 0, self)\n" % spec.short_name)
 #    s.write("    ")    
 #    s.write("rescue\n")
 #    s.write("      ")    
 #    s.write("raise Exception\n");
     s.write("      ")
     s.write("end\n")
+    # returns the offset after the message
+    s.write("\n")
+    s.write("      ")
+    s.write("def self.deserialize_from(str, head, msg)\n")
+    write_deserialize_complex(s, "msg", spec, 4)
+    s.write("        ")
+    s.write("head\n")
+    s.write("      ")
+    s.write("end\n")
 
 def write_service_definition(s, spec):
     s.write("    ")
@@ -587,7 +692,12 @@ def genmsg_command(args):
     parser.add_option("--generate-root", action="store_true",
                       dest="generate_root")
     parser.add_option("--output-dir", action="store", type="string", dest="output_dir")
+    parser.add_option("--packed-arrays", action="store_true", dest="packed_arrays")
+    parser.add_option("--inline-nested", action="store_true", dest="inline_nested")
     options, args = parser.parse_args(args)
+    global packed_arrays, inline_nested
+    packed_arrays = options.packed_arrays or False
+    inline_nested = options.inline_nested or False
     if options.generate_root:
         pkg_dir, pkg_name = roslib.packages.get_dir_pkg(args[0])
         if options.output_dir:
@@ -662,7 +772,12 @@ def gensrv_command(args):
     parser.add_option("--generate-root", action="store_true",
                       dest="generate_root")
     parser.add_option("--output-dir", action="store", type="string", dest="output_dir")
+    parser.add_option("--packed-arrays", action="store_true", dest="packed_arrays")
+    parser.add_option("--inline-nested", action="store_true", dest="inline_nested")
     options, args = parser.parse_args(args)
+    global packed_arrays, inline_nested
+    packed_arrays = options.packed_arrays or False
+    inline_nested = options.inline_nested or False
     if options.generate_root:
         pkg_dir, pkg_name = roslib.packages.get_dir_pkg(args[0])
         if options.output_dir:
@@ -65,6 +65,22 @@ module ROS
     @@default_node.ok?
   end
 
+  #
+  # @param [String] topic topic name
+  # @param [ROS::Message] msg_type message class object
+  # @param [Hash] options
+  #   :latching     send the last message to new subscribers
+  #   :max_outbound bytes buffered in the socket of a subscriber before
+  #                 messages are queued (default 1MB, nil for no limit)
+  #   :queue_size   messages queued per subscriber (default 100)
+  #   :overflow     on a full queue :drop_oldest (default), :drop_newest or
+  #                 :disconnect the subscriber
+  #
+  #   With the defaults, messages to a subscriber that stays more than
+  #   1MB + 100 messages behind are dropped. Earlier versions buffered
+  #   everything for slow subscribers; pass :max_outbound => nil to keep
+  #   that behavior.
+  # @return [ROS::Publisher] ROS topic publisher
   def self.advertise(topic, msg_type, options={})
     @@default_node.advertise(topic, msg_type, options)
   end
@@ -72,7 +88,12 @@ module ROS
   # 
   # @param [String] topic topic name
   # @param [ROS::Message] msg_type message class object
-  # @param [Hash] options 
+  # @param [Hash] options
+  #   :inline invoke the callback at the event thread instead of spin
+  #   :pool   recycle up to this number of message instances. The callback
+  #           must not keep the message after returning.
+  #   :raw    pass the serialized message to the callback as a String
+  #           instead of deserializing it
   # @param [Proc] block message callback
   # @return [ROS::Subscriber] ROS topic subscriber
   def self.subscribe(topic, msg_type, options={}, &block)
@@ -99,6 +120,18 @@ module ROS
     @@default_node.rate(hz)
   end
 
+  # @param [Numeric, ROS::Duration] period timer period in seconds
+  # @param [Hash] options :oneshot, :catch_up
+  # @param [Proc] block timer callback invoked with ROS::TimeEvent
+  # @return [ROS::Timer] started timer
+  def self.create_timer(period, options={}, &block)
+    @@default_node.create_timer(period, options, block)
+  end
+
+  def self.sleep(duration)
+    @@default_node.sleep(duration)
+  end
+
   def self.get_param(name)
     @@default_node.get_param(name)
   end
@@ -3,6 +3,7 @@ require 'thread'
 require 'logger'
 require 'eventmachine'
 require 'ros/time'
+require 'ros/trace'
 
 module ROS
 
@@ -31,6 +32,13 @@ module ROS
               Signal.trap(sig, sig_handler)
             end
 
+            # dump latency histograms (mutexes are not allowed in trap context)
+            if Trace::ENABLED
+              Signal.trap(:USR1) do
+                Thread.new { Trace.dump }
+              end
+            end
+
             # register exit handler
             at_exit do
               Diag.log("at_exit called.")
@@ -39,7 +47,7 @@ module ROS
             @@running = true
             @thread = Thread.new do
               EM.error_handler do |e|
-                Diag.log(e)
+                Diag.log { e }
                 @@mutex.synchronize do
                   @@running = false
                   @node_map.each do |name, node|
@@ -56,7 +64,7 @@ module ROS
                 EM.run
                 Diag.log("Event loop stopped.")
               rescue => e
-                Diag.log("Event loop stopped with #{e}")
+                Diag.log { "Event loop stopped with #{e}" }
                 @@mutex.synchronize do
                   @@running = false
                   @node_map.each do |name, node|
@@ -101,11 +109,19 @@ module ROS
     end
   end
 
+  # Internal diagnostic log.
+  # Enabled by setting ROSRB_DEBUG environment variable. Pass a block to
+  # defer building the message until it is actually logged:
+  #
+  #   Diag.log { "received #{data.bytesize} bytes" }
   module Diag
+    ENABLED = ENV.has_key?('ROSRB_DEBUG')
+
     @@logger = Logger.new(STDOUT)
-    @@logger.level = Logger::FATAL
-    def self.log(msg)
-      @@logger.debug(msg)
+    @@logger.level = ENABLED ? Logger::DEBUG : Logger::FATAL
+    def self.log(msg=nil)
+      return unless ENABLED
+      @@logger.debug(block_given? ? yield : msg)
     end
   end
 end
@@ -264,9 +264,9 @@ module ROS
         when 'string'
           return '""'
         when 'time'
-          return '::ROS::Time.new(0, 0)'
+          return '::ROS::Time::ZERO'
         when 'duration'
-          return '::ROS::Duration.new(0, 0)'
+          return '::ROS::Duration::ZERO'
         else
           raise ROSError.new("")
         end
@@ -284,6 +284,12 @@ module ROS
     def define_initialize(cls)
       io = StringIO.new
       io.write "def initialize(*args)\n"
+      io.write "  if args.empty?\n"
+      for field in spec.fields
+        io.write "    @#{field.name} = #{default_value(field.type)}\n"
+      end
+      io.write "    return\n"
+      io.write "  end\n"
       io.write "  kwargs = (::Hash === args.last ? args.pop : {})\n"
       for field in spec.fields
         io.write "  kwargs[#{field.name}] = args.shift unless args.empty?\n"
@@ -340,9 +346,14 @@ module ROS
       [1].pack('s')[0] == "\x01"
     end
 
+    # serialize_into/deserialize_from as classes of msg_gen.py, which outer
+    # classes call for nested messages
     def write_serialize(io, spec)
       io.write("def serialize(o)\n")
-      write_serialize_complex(io, "self", spec, 1)
+      io.write("  self.class.serialize_into(o, self)\n")
+      io.write("end\n")
+      io.write("def self.serialize_into(o, msg)\n")
+      write_serialize_complex(io, "msg", spec, 1)
       io.write("end\n")
     end
 
@@ -403,8 +414,10 @@ module ROS
       when 'string'
         io.write("#{indent}o.write([#{name}.bytesize].pack('V')))\n")
         io.write("#{indent}o.write(#{name})\n")
-      when 'time', 'duration'
-        io.write("#{indent}o.write([#{name}.secs, #{name}.nescs].pack('VV')))\n")
+      when 'time'
+        io.write("#{indent}o.write([#{name}.secs, #{name}.nsecs].pack('VV'))\n")
+      when 'duration'
+        io.write("#{indent}o.write([#{name}.secs, #{name}.nsecs].pack('l<l<'))\n")
       else
         raise ROSerializationError.new("Unkown field type #{type}.")
       end
@@ -439,7 +452,11 @@ module ROS
 
     def write_deserialize(io, spec)
       io.write "def deserialize(str)\n"
-      write_deserialize_complex(io, "self", spec, 1)
+      io.write "  self.class.deserialize_from(str, 0, self)\n"
+      io.write "end\n"
+      io.write "def self.deserialize_from(str, head, msg)\n"
+      write_deserialize_complex(io, "msg", spec, 1)
+      io.write "  head\n"
       io.write "end\n"
     end
 
@@ -451,14 +468,14 @@ module ROS
         elsif field.type.builtin?
           write_deserialize_builtin(io, "#{name}.#{field.name}", field.type, depth)
         elsif field.type.header?
-          io.write "#{indent}#{name}.#{field.name} = StdMsgs::Msg::Header.new() if #{name}.#{field.name}.nil?\n"
+          io.write "#{indent}#{name}.#{field.name} = StdMsgs::Msg::Header.allocate if #{name}.#{field.name}.nil?\n"
           write_deserialize_header(io, "#{name}.#{field.name}", depth)
         else
           subspec = MessageSpec.get_registered(field.type.fullname)
           target = "#{name}.#{field.name}"
           pkg = field.type.package.split('_').each { |w| w.capitalize }.join
           msg = field.type.base_type.split('_').each { |w| w.capitalize }.join
-          io.write "#{indent}#{target} = #{pkg}::Msg::#{msg}.new() if #{target}.nil?\n"
+          io.write "#{indent}#{target} = #{pkg}::Msg::#{msg}.allocate if #{target}.nil?\n"
           write_deserialize_complex(io, target, subspec, depth)
         end
       end
@@ -476,13 +493,13 @@ module ROS
       elsif elem_type.builtin?
         write_deserialize_builtin(io, "#{name}[i]", elem_type, depth + 1)
       elsif elem_type.header?
-        io.write "#{indent}#{name}[i] = StdMsgs::Msg::Header.new()\n"
+        io.write "#{indent}#{name}[i] = StdMsgs::Msg::Header.allocate\n"
         write_deserialize_header(io, "#{name}[i]", depth + 1)
       elsif elem_type.registered?
         elem_spec = MessageSpec.get_registered(elem_type.fullname)
         pkg = field.type.package.split('_').each { |w| w.capitalize }.join
         msg = field.type.base_type.split('_').each { |w| w.capitalize }.join
-        io.write "#{indent}#{name}[i] = #{pkg}::Msg::#{msg}.new()\n"
+        io.write "#{indent}#{name}[i] = #{pkg}::Msg::#{msg}.allocate\n"
         write_deserialize_complex(io, "#{name}[i]", elem_spec, depth + 1)
       else
         raise ROSError.new("")
@@ -547,8 +564,11 @@ module ROS
         io.write "#{indent}head += 4\n"
         io.write "#{indent}#{name} = str.byteslice(head, length)\n"
         io.write "#{indent}head += lenght\n"
-      when 'time', 'duration'
-        io.write "#{indent}#{name}.secs, #{name}.nsecs = str.byteslice(head, 8).unpack('VV')\n"
+      when 'time'
+        io.write "#{indent}#{name} = ::ROS::Time.new(*str.byteslice(head, 8).unpack('VV'))\n"
+        io.write "#{indent}head += 8\n"
+      when 'duration'
+        io.write "#{indent}#{name} = ::ROS::Duration.new(*str.byteslice(head, 8).unpack('l<l<'))\n"
         io.write "#{indent}head += 8\n"
       else
         raise ROSError.new("")
@@ -557,7 +577,8 @@ module ROS
 
     def write_deserialize_header(io, name, depth)
       indent = "  " * depth
-      io.write "#{indent}#{name}.seq, #{name}.stamp.secs, #{name}.stamp.nsecs = str.byteslice(head, 12).unpack('VVV')\n"
+      io.write "#{indent}#{name}.seq, secs, nsecs = str.byteslice(head, 12).unpack('VVV')\n"
+      io.write "#{indent}#{name}.stamp = ::ROS::Time.new(secs, nsecs)\n"
       io.write "#{indent}head += 12\n"
       io.write "#{indent}length = str.byteslice(head, 4).unpack('V')[0]\n"
       io.write "#{indent}head += 4"
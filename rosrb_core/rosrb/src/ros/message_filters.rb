@@ -0,0 +1,301 @@
+require 'thread'
+require 'ros/exceptions'
+require 'ros/time'
+
+module ROS
+  # Time-ordered ring of the last messages of a topic, indexed by
+  # header.stamp.
+  #
+  # Messages are kept serialized. The stamp is read from the header bytes
+  # and a message is deserialized only when a query returns it.
+  #
+  # Lookups are binary searches, O(log n). Adding a message is O(1) when
+  # messages arrive in stamp order; a message older than the latest one
+  # shifts the newer ones, O(n).
+  #
+  #   cache = ROS::Cache.new(Sensor::Msg::Scan, 100)
+  #   cache.connect(ROS, "/scan")
+  #   cache.get_interval(t - ROS::Duration.from_sec(0.1), t)
+  class Cache
+    # @param [Class] msg_type message class with a header
+    # @param [Integer] size max number of messages kept
+    def initialize(msg_type, size)
+      raise ROSError.new("#{msg_type::TYPE} has no header.") unless msg_type::HAS_HEADER
+      raise ArgumentError.new("Cache size must be positive.") unless size > 0
+      @msg_type = msg_type
+      @size = size
+      @ring = Array.new(size)
+      @head = 0
+      @length = 0
+      @mutex = Mutex.new
+    end
+
+    attr_reader :msg_type, :size
+
+    # Header starts with uint32 seq followed by the stamp (uint32 secs,
+    # uint32 nsecs).
+    # @param [String] data serialized message with a header
+    # @return [Integer] header.stamp in nsec
+    def self.header_stamp(data)
+      secs, nsecs = data.unpack('@4VV')
+      secs * 1000000000 + nsecs
+    end
+
+    # Subscribe to a topic and add its messages.
+    # @param [ROS::Node] node node (or ROS for the default node)
+    # @return [ROS::Subscriber]
+    def connect(node, topic, options={})
+      node.subscribe(topic, @msg_type, options.merge(:raw => true)) { |data| add(data) }
+    end
+
+    # Add a serialized message. When the cache is full the oldest message is
+    # dropped, or the new one if it is older than all kept messages.
+    # O(1) in stamp order, O(n) for an out of order message.
+    # @param [String] data serialized message
+    # @return [Array] [stamp, data, msg] entry, or nil if dropped
+    def add(data)
+      entry = [Cache.header_stamp(data), data, nil]
+      @mutex.synchronize do
+        if @length == @size
+          return nil if entry[0] < at(0)[0]
+          drop_first
+        end
+        # after messages of the same stamp, usually at the end
+        pos = upper_bound(entry[0])
+        @length.downto(pos + 1) { |i| @ring[index(i)] = at(i - 1) }
+        @ring[index(pos)] = entry
+        @length += 1
+      end
+      entry
+    end
+
+    # @return [Integer] number of messages
+    def length
+      @mutex.synchronize { @length }
+    end
+
+    # @return [ROS::Time] stamp of the oldest message, or nil if empty
+    def get_oldest_time
+      @mutex.synchronize { @length > 0 ? ROS::Time.from_nsec(at(0)[0]) : nil }
+    end
+
+    # @return [ROS::Time] stamp of the latest message, or nil if empty
+    def get_latest_time
+      @mutex.synchronize { @length > 0 ? ROS::Time.from_nsec(at(@length - 1)[0]) : nil }
+    end
+
+    # @return [ROS::Message] oldest message stamped at or after time, or nil
+    def get_elem_after_time(time)
+      entry = @mutex.synchronize do
+        pos = lower_bound(time.to_nsec)
+        pos < @length ? at(pos) : nil
+      end
+      entry && message(entry)
+    end
+
+    # @return [ROS::Message] latest message stamped at or before time, or nil
+    def get_elem_before_time(time)
+      entry = @mutex.synchronize do
+        pos = upper_bound(time.to_nsec)
+        pos > 0 ? at(pos - 1) : nil
+      end
+      entry && message(entry)
+    end
+
+    # @return [Array] messages stamped in [start, stop], oldest first
+    def get_interval(start, stop)
+      entries = @mutex.synchronize do
+        slice(lower_bound(start.to_nsec), upper_bound(stop.to_nsec))
+      end
+      entries.map { |entry| message(entry) }
+    end
+
+    # Messages of the interval and the messages just outside of it, so that
+    # the result covers [start, stop] when the cache does.
+    # @return [Array] messages, oldest first
+    def get_surrounding_interval(start, stop)
+      entries = @mutex.synchronize do
+        first = upper_bound(start.to_nsec)
+        first -= 1 if first > 0
+        last = lower_bound(stop.to_nsec)
+        last += 1 if last < @length
+        slice(first, last)
+      end
+      entries.map { |entry| message(entry) }
+    end
+
+    # @return [Array] entry stamped at stamp (nsec), or nil
+    def find_entry(stamp)
+      @mutex.synchronize do
+        pos = lower_bound(stamp)
+        (pos < @length and at(pos)[0] == stamp) ? at(pos) : nil
+      end
+    end
+
+    # @return [Array] entries stamped in [start, stop] (nsec), oldest first
+    def entries_in(start, stop)
+      @mutex.synchronize { slice(lower_bound(start), upper_bound(stop)) }
+    end
+
+    # Drop messages stamped at or before stamp (nsec).
+    def drop_until(stamp)
+      @mutex.synchronize do
+        drop_first while @length > 0 and at(0)[0] <= stamp
+      end
+    end
+
+    # @param [Array] entry entry of this cache
+    # @return [ROS::Message] message of the entry, deserialized once
+    def message(entry)
+      entry[2] ||= begin
+                     msg = @msg_type.new
+                     msg.deserialize(entry[1])
+                     msg
+                   end
+    end
+
+    private
+
+    def index(i)
+      (@head + i) % @size
+    end
+
+    def at(i)
+      @ring[index(i)]
+    end
+
+    def drop_first
+      @ring[@head] = nil
+      @head = index(1)
+      @length -= 1
+    end
+
+    def slice(first, last)
+      (first...last).map { |i| at(i) }
+    end
+
+    # @return [Integer] first position stamped at or after stamp
+    def lower_bound(stamp)
+      lo, hi = 0, @length
+      while lo < hi
+        mid = (lo + hi) / 2
+        if at(mid)[0] < stamp then lo = mid + 1 else hi = mid end
+      end
+      lo
+    end
+
+    # @return [Integer] first position stamped after stamp
+    def upper_bound(stamp)
+      lo, hi = 0, @length
+      while lo < hi
+        mid = (lo + hi) / 2
+        if at(mid)[0] <= stamp then lo = mid + 1 else hi = mid end
+      end
+      lo
+    end
+  end
+
+  # Policy of TimeSynchronizer: messages of a set have the same stamp.
+  class ExactTime
+    # @return [Array] entry of each cache, or nil if there is no match
+    def match(caches, index, entry)
+      stamp = entry[0]
+      caches.each_with_index.map do |cache, i|
+        next entry if i == index
+        cache.find_entry(stamp) or return nil
+      end
+    end
+  end
+
+  # Policy of TimeSynchronizer: the stamps of a set differ by at most slop,
+  # as in rospy. The newly arrived message is matched with a message of
+  # each other topic in a window of slop that contains its stamp, nearest
+  # to it in each topic. Windows closer to the new stamp are tried first.
+  class ApproximateTime
+    # @param [Float, ROS::Duration] slop max stamp difference (sec)
+    def initialize(slop)
+      @slop = slop.respond_to?(:to_nsec) ? slop.to_nsec : (slop * 1e9).to_i
+    end
+
+    # @return [Integer] slop in nsec
+    attr_reader :slop
+
+    # @return [Array] entry of each cache, or nil if there is no match
+    def match(caches, index, entry)
+      stamp = entry[0]
+      candidates = caches.each_with_index.map do |cache, i|
+        next [entry] if i == index
+        entries = cache.entries_in(stamp - @slop, stamp + @slop)
+        return nil if entries.empty?
+        entries
+      end
+      # the oldest stamp of a set starts its window
+      starts = candidates.flatten(1).map { |e| e[0] }.select { |t| t <= stamp }.uniq
+      starts.sort.reverse_each do |start|
+        stop = start + @slop
+        set = candidates.map do |entries|
+          in_window = entries.select { |e| start <= e[0] and e[0] <= stop }
+          break nil if in_window.empty?
+          in_window.min_by { |e| (e[0] - stamp).abs }
+        end
+        return set if set
+      end
+      nil
+    end
+  end
+
+  # Synchronize N topics by header.stamp and call back with a set of
+  # messages, one of each topic.
+  #
+  # Each topic has a Cache of queue_size messages. When a set matches, its
+  # messages and older ones are dropped. Messages not in a set are never
+  # deserialized.
+  #
+  #   sync = ROS::TimeSynchronizer.new([Image, CameraInfo], 10) do |image, info|
+  #     ...
+  #   end
+  #   sync.connect(ROS, ["/camera/image", "/camera/info"])
+  class TimeSynchronizer
+    # @param [Array] msg_types message class of each topic
+    # @param [Integer] queue_size messages kept per topic
+    # @param [ExactTime, ApproximateTime] policy
+    # @param [Proc] block called with the messages of a set
+    def initialize(msg_types, queue_size, policy=ExactTime.new, &block)
+      @caches = msg_types.map { |msg_type| Cache.new(msg_type, queue_size) }
+      @policy = policy
+      @callback = block
+      @mutex = Mutex.new
+    end
+
+    attr_reader :caches, :policy
+
+    # Subscribe to a topic of each input.
+    # @param [ROS::Node] node node (or ROS for the default node)
+    # @param [Array] topics topic name of each input
+    # @return [Array] ROS::Subscriber of each topic
+    def connect(node, topics, options={})
+      if topics.length != @caches.length
+        raise ArgumentError.new("#{@caches.length} topics expected.")
+      end
+      topics.each_with_index.map do |topic, i|
+        node.subscribe(topic, @caches[i].msg_type, options.merge(:raw => true)) do |data|
+          add(i, data)
+        end
+      end
+    end
+
+    # Add a serialized message of an input.
+    # @param [Integer] index input index
+    # @param [String] data serialized message
+    def add(index, data)
+      entries = @mutex.synchronize do
+        entry = @caches[index].add(data)
+        matched = entry && @policy.match(@caches, index, entry)
+        matched.each_with_index { |e, i| @caches[i].drop_until(e[0]) } if matched
+        matched
+      end
+      return unless entries
+      @callback.call(*entries.each_with_index.map { |e, i| @caches[i].message(e) })
+    end
+  end
+end
@@ -0,0 +1,48 @@
+require 'thread'
+
+module ROS
+  # Free list of message instances reused for deserialization.
+  #
+  # deserialize assigns every field of a message and reuses nested message
+  # instances, so a recycled message costs no allocation but its strings
+  # and arrays. Callbacks of a pooled subscription must not keep the
+  # message (or its nested messages) after returning; copy what is needed.
+  class MessagePool
+    # @param [Class] msg_type message class
+    # @param [Integer] size max number of free instances kept
+    def initialize(msg_type, size)
+      @msg_type = msg_type
+      @size = size
+      @free = []
+      @mutex = Mutex.new
+    end
+
+    attr_reader :msg_type, :size
+
+    # @return [ROS::Message] a free instance, or a new one if the pool is empty
+    def acquire
+      msg = @mutex.synchronize { @free.pop }
+      msg or @msg_type.new
+    end
+
+    # Return an instance to the pool.
+    def release(msg)
+      @mutex.synchronize do
+        @free.push(msg) if @free.length < @size
+      end
+    end
+
+    # @return [Integer] number of free instances
+    def available
+      @mutex.synchronize { @free.length }
+    end
+
+    # Deserialize data into a pooled instance.
+    # @return [ROS::Message]
+    def deserialize(data)
+      msg = acquire
+      msg.deserialize(data)
+      msg
+    end
+  end
+end
@@ -1,3 +1,4 @@
+
 module ROS
   class Message
     def initialize(*args)
@@ -30,16 +31,16 @@ module ROS
       kwargs[:seq] = args.shift unless args.empty?
       kwargs[:stamp] = args.shift unless args.empty?
       @seq = Integer === kwargs[:seq] ? kwargs[:seq] : 0
-      @stamp = ROS::Time === kwargs[:stamp] ? kwargs[:stamp] : ROS::Time.new
+      @stamp = ROS::Time === kwargs[:stamp] ? kwargs[:stamp] : ROS::Time::ZERO
     end
 
     def serialize(buff)
-      buff.write([@seq, @stamp.sec, @stamp.nsec].pack("VVV"))
+      buff.write([@seq, @stamp.secs, @stamp.nsecs].pack("VVV"))
     end
 
     def deserialize(str)
-      @stamp = ROS::Time.new unless @stamp
-      @seq, @stamp.sec, @stamp.nsec = str[0 .. 12].unpack('VVV')
+      @seq, secs, nsecs = str.byteslice(0, 12).unpack('VVV')
+      @stamp = ROS::Time.new(secs, nsecs)
     end
 
     def to_s
@@ -4,11 +4,13 @@ require 'ros/package'
 require 'ros/pubsub'
 require 'ros/service'
 require 'ros/slave'
+require 'ros/shared_server'
 require 'ros/master'
 require 'ros/msg'
 require 'ros/srv'
 require 'ros/event_loop'
 require 'ros/log'
+require 'ros/timer'
 
 require 'rosgraph_msgs/msg'
 
@@ -19,6 +21,9 @@ module ROS
   class Node
     # @param [Resolver] resolver  name resolver
     # @param [Hash]     options   node options (Anonymous options must be passed to the resolver )
+    #   :log_level      minimum level of log messages
+    #   :shared_servers share slave, topic and service listeners and the
+    #                   master connection with other nodes of the process
     # @return [Nil]
     def initialize(resolver, options) 
       @resolver = resolver
@@ -26,7 +31,11 @@ module ROS
         raise ROSError.new("Invalid ROS Master URI.")
       end
       @pid = $$
-      @master_proxy = MasterProxy.new(@resolver.master)
+      if options[:shared_servers]
+        @master_proxy = MasterProxy.shared(@resolver.master)
+      else
+        @master_proxy = MasterProxy.new(@resolver.master)
+      end
 
       EventLoop.instance.start()
 
@@ -36,12 +45,14 @@ module ROS
       @logger.info("Node(#{@resolver.node_name} => #{@resolver.qualified_node_name}) pid=#{@pid} start")
       @logger.info("ROS_MASTER_URI = #{@resolver.master}")
 
-      @topic_manager = TopicManager.new(self)
-      @service_manager = ServiceManager.new(self)
-      @slave_server = SlaveServer.new(self, @topic_manager, @service_manager)
+      shared_server = options[:shared_servers] ? SharedServer.instance(@resolver.ip) : nil
+      @topic_manager = TopicManager.new(self, shared_server)
+      @service_manager = ServiceManager.new(self, shared_server)
+      @slave_server = SlaveServer.new(self, @topic_manager, @service_manager, shared_server)
       @slave_server.start
 
-      @node_uri = URI::HTTP.build(:host => @resolver.ip, :port => @slave_server.port).to_s
+      @node_uri = URI::HTTP.build(:host => @resolver.ip, :port => @slave_server.port,
+                                  :path => @slave_server.path).to_s
       @logger.info("ROS Slave Server start at URI #{@node_uri}")
       @topic_manager.start
       @logger.info("TCPROS PubSub Server start at port #{@topic_manager.port}")
@@ -55,9 +66,16 @@ module ROS
       else
         @use_simtime = false
       end
+      @timer_scheduler = TimerScheduler.new(self)
       if @use_simtime
-        callback = proc { |msg| @simtime = msg.clock }
-        @clock_sub = @topic_manager.create_subscriber("/clock", RosgraphMsgs::Msg::Clock, {}, callback)
+        # /clock drives timers, so it is handled at the event thread
+        # without waiting for spin.
+        callback = proc do |msg|
+          @simtime = msg.clock
+          @timer_scheduler.clock_updated
+        end
+        @clock_sub = @topic_manager.create_subscriber("/clock", RosgraphMsgs::Msg::Clock,
+                                                      {:inline => true}, callback)
       end
 
       # set private paramters
@@ -86,11 +104,12 @@ module ROS
       @service_manager.invoke_callbacks
     end
 
+    # Callbacks are polled with wall time, as /clock itself may not be
+    # published yet with sim time.
     def spin
-      rate = rate(100)
       while ok?
         spin_once
-        rate.sleep
+        ROS.wall_sleep(0.01)
       end
     end
 
@@ -111,6 +130,7 @@ module ROS
             puts e
           end
         end
+        @timer_scheduler.shutdown
         @slave_server.shutdown
         @topic_manager.shutdown
         @service_manager.shutdown
@@ -118,8 +138,7 @@ module ROS
     end
 
     # Get a time in the ROS computation graph.
-    # @return [ROS::Time] current time
-    # @note Currently only walltime is supported.
+    # @return [ROS::Time] current time, nil until /clock is received with sim time
     def get_rostime
       if @use_simtime
         @simtime
@@ -128,6 +147,10 @@ module ROS
       end
     end
 
+    def use_simtime?
+      @use_simtime
+    end
+
     def advertise(topic, msg_type, options)
       @topic_manager.create_publisher(topic, msg_type, options)
     end
@@ -153,7 +176,7 @@ module ROS
         code, status, result = client.call("lookupService", @resolver.qualified_node_name,
                                            resolved_service)
         break if code == 1
-        sleep(0.1)
+        ROS.wall_sleep(0.1)
       end
       @logger.debug("service '#{resolved_service}' found!")
     end
@@ -162,8 +185,14 @@ module ROS
       Rate.new(self, hz)
     end
 
+    # @param [Numeric, ROS::Duration] period period in seconds
+    # @param [Hash] options timer options (see Timer)
+    # @param [Proc] block timer callback
+    # @return [Timer] started timer
     def create_timer(period, options, block)
-      Timer.new(period, options, block)
+      timer = Timer.new(@timer_scheduler, period, options, block)
+      timer.start(@timer_scheduler.now_nsec || 0)
+      timer
     end
 
     # Parameter API
@@ -237,6 +266,11 @@ module ROS
       @resolver.master
     end
 
+    # @return [MasterProxy] master API client of this node
+    def master_proxy
+      @master_proxy
+    end
+
     def get_ip
       @resolver.ip
     end
@@ -249,10 +283,20 @@ module ROS
       @resolver.resolve_name(name)
     end
 
-    # Only supports wall time
+    # Sleep in ROS time.
+    # @param [Numeric, ROS::Duration] duration
     def sleep(duration)
-      secs = duration.to_sec if duration === Duration
-      wall_sleep(secs) unless secs < 0
+      nsecs = Duration === duration ? duration.to_nsec : (duration * 1e9).round
+      now = get_rostime
+      sleep_until((now ? now.to_nsec : 0) + nsecs) unless nsecs < 0
+    end
+
+    # Sleep until ROS time reaches time.
+    # @param [Integer, ROS::Time] time
+    # @return [Boolean] false if the node is shut down while sleeping
+    def sleep_until(time)
+      time = time.to_nsec if ROS::Time === time
+      @timer_scheduler.wait_until(time)
     end
 
   end
@@ -1,70 +1,198 @@
 require 'rexml/document'
+require 'ros/exceptions'
 
 module ROS
-  # Load package file and add paths to depending packages.
-  # This method should be called before creating any node.
-  def self.load_manifest(package_name, use_rospack_cache=true)
-    cache_found = false
-    if use_rospack_cache and ENV.has_key?('ROS_ROOT')
-      cache_path = File.join(ENV['ROS_ROOT'], ".rospack_cache")
-      if File.exist?(cache_path) and File.file?(cache_path)
-        cache_file = File.new(cache_path, 'r')
-        cache_file.each_line do |line|
-          pkg_name = File.basename(line)
-          @@ROS_PACKAGE_PATH[pkg_name] = line
-        end
-        cache_found = true
+  # Persistent index of packages under ROS_ROOT and ROS_PACKAGE_PATH.
+  #
+  # The index remembers every directory crawled with its mtime and
+  # subdirectories, and every package with its manifest mtime, depends and
+  # ruby exports. Validating the index only stats directories; entries are
+  # re-read only for directories whose mtime changed, and manifests are
+  # re-parsed only when they changed. Resolved load paths are cached until
+  # any manifest changes.
+  class PackageIndex
+    VERSION = 1
+    MANIFEST = 'manifest.xml'
+
+    # @param [Array<String>] roots package search paths in precedence order
+    # @param [String] cache_path index file, nil to disable persistence
+    def initialize(roots, cache_path=nil)
+      @roots = roots
+      @cache_path = cache_path
+      @dirs = {}
+      @packages = {}
+      @load_paths = {}
+      @changed = false
+      load_cache if @cache_path
+      update
+    end
+
+    attr_reader :roots
+
+    # @return [String] package directory or nil
+    def find(package_name)
+      entry = @packages[package_name]
+      entry && entry[0]
+    end
+
+    # @return [Array<String>] load paths of a package and its dependencies
+    def load_paths(package_name)
+      cached = @load_paths[package_name]
+      return cached if cached
+      paths = []
+      visited = {}
+      depends = [package_name]
+      while depends.length > 0
+        pkg = depends.pop
+        next if visited[pkg]
+        visited[pkg] = true
+        entry = @packages[pkg]
+        raise ROSError.new("Package #{pkg} is not found.") unless entry
+        dir, mtime, pkg_depends, exports = entry
+        paths.push(File.join(dir, 'src'))
+        paths.push(File.join(dir, 'lib'))
+        exports.each { |path| paths.push(path.gsub("${prefix}", dir)) }
+        depends.concat(pkg_depends)
+      end
+      @load_paths[package_name] = paths
+      @changed = true
+      paths
+    end
+
+    # Write the index if anything changed.
+    def save
+      return unless @cache_path and @changed
+      data = Marshal.dump([VERSION, @roots, @dirs, @packages, @load_paths])
+      tmp_path = "#{@cache_path}.#{$$}"
+      begin
+        File.open(tmp_path, 'wb') { |f| f.write(data) }
+        File.rename(tmp_path, @cache_path)
+        @changed = false
+      rescue SystemCallError
+        File.delete(tmp_path) rescue nil
+      end
+    end
+
+    private
+
+    def load_cache
+      return unless File.file?(@cache_path)
+      version, roots, dirs, packages, load_paths = Marshal.load(File.binread(@cache_path))
+      return unless version == VERSION and roots == @roots
+      @dirs = dirs
+      @packages = packages
+      @load_paths = load_paths
+    rescue StandardError
+      # broken index is rebuilt
+    end
+
+    def update
+      found = {}
+      @roots.each { |root| crawl(root, found) }
+      (@packages.keys - found.keys).each do |name|
+        @packages.delete(name)
+        @load_paths.clear
+        @changed = true
       end
     end
-    if not cache_found
-      ros_pkg_path = ENV['ROS_PACKAGE_PATH'] or ""
-      search_paths = ros_pkg_path.split(":")
-      search_paths.unshift(ENV['ROS_ROOT']) if ENV.has_key?('ROS_ROOT')
-      while search_paths.length > 0
-        path = search_paths.pop
-        next unless File.exist?(path)
-        next unless File.directory?(path)
-        next if File.symlink?(path)
-        next if File.basename(path) == ".."
-        next if File.basename(path) == "."
 
-        entries = Dir.entries(path).map { |e| File.join(path, e) }
-        manifest = entries.any? do |e|
-          File.file?(e) and File.basename(e) == "manifest.xml"
+    def crawl(root, found)
+      stack = [File.expand_path(root)]
+      while stack.length > 0
+        dir = stack.pop
+        stat = File.stat(dir) rescue nil
+        next unless stat and stat.directory?
+        mtime = stat.mtime.to_f
+        entry = @dirs[dir]
+        unless entry and entry[0] == mtime
+          entry = read_dir(dir, mtime)
+          next unless entry
+          @dirs[dir] = entry
+          @changed = true
         end
-        if manifest
-          @@ROS_PACKAGE_CACHE[File.basename(path)] = File.absolute_path(path)
+        mtime, subdirs, package = entry
+        if package
+          add_package(dir, found)
         else
-          search_paths += entries
+          subdirs.reverse_each { |name| stack.push(File.join(dir, name)) }
+        end
+      end
+    end
+
+    def read_dir(dir, mtime)
+      names = Dir.entries(dir)
+      if names.include?(MANIFEST) and File.file?(File.join(dir, MANIFEST))
+        [mtime, [], true]
+      else
+        subdirs = names.select do |name|
+          path = File.join(dir, name)
+          name[0] != '.' and File.directory?(path) and not File.symlink?(path)
         end
+        [mtime, subdirs.sort, false]
       end
+    rescue SystemCallError
+      nil
+    end
+
+    # The first package found in search order wins.
+    def add_package(dir, found)
+      name = File.basename(dir)
+      return if found.has_key?(name)
+      found[name] = dir
+      manifest = File.join(dir, MANIFEST)
+      mtime = File.mtime(manifest).to_f
+      entry = @packages[name]
+      return if entry and entry[0] == dir and entry[1] == mtime
+      depends, exports = parse_manifest(manifest)
+      @packages[name] = [dir, mtime, depends, exports]
+      @load_paths.clear
+      @changed = true
     end
 
-    depends = [package_name]
-    while depends.length > 0
-      pkg = depends.pop
-      pkg_dir = @@ROS_PACKAGE_CACHE[pkg]
-      manifest = File.join(pkg_dir, 'manifest.xml')
-      $LOAD_PATH.unshift(File.join(pkg_dir, 'src'))
-      $LOAD_PATH.unshift(File.join(pkg_dir, 'lib'))
-      file = File.new(manifest, 'r')
-      dom = REXML::Document.new(file)
+    def parse_manifest(manifest)
+      depends = []
+      exports = []
+      dom = File.open(manifest, 'r') { |file| REXML::Document.new(file) }
       dom.root.elements.each("depend") do |depend|
-        depend_pkg = depend.attributes["package"]
-        depends.push(depend_pkg)
+        depends.push(depend.attributes["package"])
       end
       dom.root.elements.each("export") do |export|
         export.elements.each("ruby") do |ruby|
-          path = ruby.attributes["path"]
-          path.gsub!("${prefix}", @@ROS_PACKAGE_CACHE[pkg])
-          $LOAD_PATH.unshift(path)
+          exports.push(ruby.attributes["path"])
         end
       end
+      [depends, exports]
     end
-    $LOAD_PATH
   end
 
-  private
+  # Load package file and add paths to depending packages.
+  # This method should be called before creating any node.
+  # @param [String] package_name package name
+  # @param [Boolean] use_cache use the persistent package index in ROS_HOME
+  # @return [Array<String>] $LOAD_PATH
+  def self.load_manifest(package_name, use_cache=true)
+    roots = (ENV['ROS_PACKAGE_PATH'] or "").split(":").reject { |path| path.empty? }
+    roots.unshift(ENV['ROS_ROOT']) if ENV.has_key?('ROS_ROOT')
+    cache_path = package_index_path if use_cache
+    index = PackageIndex.new(roots, cache_path)
+    paths = index.load_paths(package_name)
+    index.save
+    paths.each do |path|
+      $LOAD_PATH.unshift(path) unless $LOAD_PATH.include?(path)
+    end
+    $LOAD_PATH
+  end
 
-  @@ROS_PACKAGE_CACHE = {}
+  # @return [String] path of the package index, nil if ROS_HOME is not available
+  def self.package_index_path
+    if ENV.has_key?('ROS_HOME')
+      ros_home = ENV['ROS_HOME']
+    elsif ENV.has_key?('HOME')
+      ros_home = File.join(ENV['HOME'], '.ros')
+    else
+      return nil
+    end
+    return nil unless File.directory?(ros_home)
+    File.join(ros_home, 'rosrb_package_index')
+  end
 end # module ROS
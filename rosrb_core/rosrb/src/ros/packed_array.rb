@@ -0,0 +1,140 @@
+begin
+  require 'numo/narray'
+rescue LoadError
+  # PackedArray is used instead
+end
+
+module ROS
+  # Numeric array stored as little endian bytes, as they are on the wire.
+  #
+  # Messages generated with --packed-arrays hold numeric array fields as
+  # Numo::NArray when it is installed, or as PackedArray otherwise.
+  # Deserialization wraps the received bytes and serialization writes them
+  # back without converting each element.
+  #
+  # Only generated files with packed fields require this file, so other
+  # processes do not load Numo.
+  class PackedArray
+    include Enumerable
+
+    # type => [pack directive, element size, Numo class name]
+    TYPES = {
+      'int8' => ['c', 1, 'Int8'], 'char' => ['c', 1, 'Int8'],
+      'uint8' => ['C', 1, 'UInt8'], 'byte' => ['C', 1, 'UInt8'],
+      'int16' => ['s<', 2, 'Int16'], 'uint16' => ['S<', 2, 'UInt16'],
+      'int32' => ['l<', 4, 'Int32'], 'uint32' => ['L<', 4, 'UInt32'],
+      'int64' => ['q<', 8, 'Int64'], 'uint64' => ['Q<', 8, 'UInt64'],
+      'float32' => ['e', 4, 'SFloat'], 'float64' => ['E', 8, 'DFloat'],
+    }
+
+    # Numo stores elements in host order
+    NUMO = (defined?(Numo::NArray) and [1].pack('S') == [1].pack('v')) ? true : false
+
+    # Wrap bytes of an array field.
+    # @param [String] type element type of the field ('float32', ...)
+    # @param [String] data little endian elements
+    # @return [Numo::NArray, PackedArray]
+    def self.wrap(type, data)
+      if NUMO
+        Numo.const_get(TYPES[type][2]).from_binary(data)
+      else
+        PackedArray.new(type, data)
+      end
+    end
+
+    # Elements of another type, as a Numo::DFloat assigned to a float32[]
+    # field, are converted to the type of the field.
+    # @param [String] type element type of the field
+    # @param [PackedArray, Numo::NArray, Array] value field value
+    # @return [String] little endian elements
+    def self.dump(type, value)
+      directive, size, numo_class = TYPES[type]
+      case value
+      when PackedArray
+        # char/int8 and byte/uint8 share their bytes
+        if TYPES[value.type][0] == directive
+          value.data
+        else
+          value.to_a.pack("#{directive}*")
+        end
+      when ::Array
+        value.pack("#{directive}*")
+      else
+        if NUMO and Numo::NArray === value
+          Numo.const_get(numo_class).cast(value).to_binary
+        elsif value.respond_to?(:to_a)
+          # Numo::NArray on a big endian host
+          value.to_a.pack("#{directive}*")
+        else
+          raise ArgumentError.new("#{value.class} is not an array of #{type}.")
+        end
+      end
+    end
+
+    # @return [Boolean] true if value can be a packed array field
+    def self.array?(value)
+      (::Array === value or PackedArray === value or (NUMO and Numo::NArray === value))
+    end
+
+    # @param [String] type element type
+    # @param [String] data little endian elements
+    def initialize(type, data=nil)
+      @type = type
+      @directive, @size = TYPES[type]
+      raise ArgumentError.new("#{type} is not a numeric type.") unless @directive
+      if data.nil?
+        @data = String.new
+      elsif data.encoding == Encoding::BINARY
+        @data = data
+      else
+        @data = data.dup.force_encoding(Encoding::BINARY)
+      end
+    end
+
+    attr_reader :type, :data
+
+    def length
+      @data.bytesize / @size
+    end
+
+    alias :size :length
+
+    def [](index)
+      index += length if index < 0
+      return nil if index < 0 or index >= length
+      @data.byteslice(index * @size, @size).unpack(@directive)[0]
+    end
+
+    def []=(index, value)
+      index += length if index < 0
+      raise IndexError.new("index #{index} out of array") if index < 0 or index >= length
+      @data = @data.dup if @data.frozen?
+      @data[index * @size, @size] = [value].pack(@directive)
+    end
+
+    def push(*values)
+      @data = @data.dup if @data.frozen?
+      @data << values.pack("#{@directive}*")
+      self
+    end
+
+    alias :<< :push
+
+    def each(&block)
+      to_a.each(&block)
+    end
+
+    def to_a
+      @data.unpack("#{@directive}*")
+    end
+
+    def ==(other)
+      (PackedArray === other and @type == other.type and @data == other.data) or
+        (::Array === other and to_a == other)
+    end
+
+    def inspect
+      "#<ROS::PackedArray #{@type} #{to_a.inspect}>"
+    end
+  end
+end
@@ -3,22 +3,41 @@ require 'eventmachine'
 require 'ros/utils'
 require 'ros/master'
 require 'ros/tcpros'
+require 'ros/trace'
+require 'ros/message_pool'
 
 module ROS
   # Managing Pub/Sub communication
   class TopicManager
+    DEFAULT_MAX_OUTBOUND = 1024 * 1024
+    DEFAULT_QUEUE_SIZE = 100
 
-    def initialize(node)
+    # @param [SharedServer] shared_server accept subscribers at the shared listener of the process
+    def initialize(node, shared_server=nil)
       @node = node
-      @master_proxy = MasterProxy.new(@node.get_master_uri)
+      @master_proxy = @node.master_proxy
+      @shared_server = shared_server
       @publications = {}
       @subscriptions = {}
       @port = nil
       @server = nil
+      # topics published by another node of the process at the shared listener
+      @private_topics = {}
+      @private_port = nil
+      @private_server = nil
     end
 
     attr_reader :port, :publications, :subscriptions
 
+    def caller_id
+      @node.get_name
+    end
+
+    # @return [Integer] port subscribers of the topic connect to
+    def port_for(topic_name)
+      @private_topics.has_key?(topic_name) ? @private_port : @port
+    end
+
     def invoke_callbacks
       @subscriptions.each_value do |topic|
         topic.invoke_callbacks
@@ -26,19 +45,21 @@ module ROS
     end
 
     def start
-      @port = ROS.get_local_port()
-      EM.next_tick do
-        @server = EM.start_server(@node.get_ip, @port, TCPROSPubSubInboundConnection,
-                                  @node.get_name, self)
-        Diag.log("TCPROSPubSubServer started.")
+      if @shared_server
+        @port = @shared_server.topic_port
+      else
+        @port = start_server
       end
     end
 
     def shutdown
-      @publications.each { |name, topic| topic.shutdown }
-      @subscriptions.each { |name, topic| topic.shutdown }
+      @publications.values.each { |topic| topic.shutdown }
+      @subscriptions.values.each { |topic| topic.shutdown }
+      # after the tick of start_server, which sets the servers
       EM.next_tick do
-        EM.stop_server(@server)
+        [@server, @private_server].compact.each { |server| EM.stop_server(server) }
+        @server = nil
+        @private_server = nil
         Diag.log("TCPROSPubSubServer stopped.")
       end
     end
@@ -49,6 +70,11 @@ module ROS
 
     def remove_publication(topic)
       @publications.delete(topic.name)
+      if @private_topics.delete(topic.name)
+        stop_private_server if @private_topics.empty?
+      elsif @shared_server
+        @shared_server.remove_publication(topic.name, self)
+      end
       num_unregistered = @master_proxy.unregister_publisher(@node.get_name,
                                                             topic.name,
                                                             @node.get_node_uri)
@@ -67,6 +93,13 @@ module ROS
 
     def create_publisher(topic, msg_type, options)
       latching = (options[:latching] or false)
+      max_outbound = options.has_key?(:max_outbound) ? options[:max_outbound] : DEFAULT_MAX_OUTBOUND
+      queue_size = (options[:queue_size] or DEFAULT_QUEUE_SIZE)
+      overflow = (options[:overflow] or :drop_oldest)
+      unless TCPROSPubSubInboundConnection::OVERFLOW_POLICIES.include?(overflow)
+        raise ArgumentError.new("Unknown overflow policy #{overflow}.")
+      end
+      raise ArgumentError.new("queue_size must be positive.") unless queue_size > 0
       resolved_topic = @node.resolve_name(topic)
       if @publications.has_key? resolved_topic
         pub = @publications[resolved_topic]
@@ -76,7 +109,13 @@ module ROS
           pub.shutdown
         end
       end
-      pub = PubTopic.new(self, resolved_topic, msg_type, latching)
+      pub = PubTopic.new(self, resolved_topic, msg_type, latching,
+                         max_outbound, queue_size, overflow)
+      if @shared_server and not @shared_server.add_publication(resolved_topic, self)
+        # the topic is taken by another node. serve it at a port of this node.
+        @private_port ||= start_server(true)
+        @private_topics[resolved_topic] = true
+      end
       sub_uris = @master_proxy.register_publisher(@node.get_name,
                                                   pub.name,
                                                   msg_type::TYPE,
@@ -95,12 +134,15 @@ module ROS
           sub.shutdown
         end
       end
-      sub = SubTopic.new(self, topic, msg_type, callback)
+      inline = (options[:inline] or false)
+      pool_size = (options[:pool] or 0)
+      raw = (options[:raw] or false)
+      sub = SubTopic.new(self, topic, msg_type, callback, inline, pool_size, raw)
       publishers = @master_proxy.register_subscriber(@node.get_name,
                                                      sub.name,
                                                      msg_type::TYPE,
                                                      @node.get_node_uri)
-      Diag.log(publishers)
+      Diag.log { publishers }
       @subscriptions[topic] = sub
       publishers.each { |pub_url| connect_to_publisher(sub, pub_url) }
       Subscriber.new(sub)
@@ -113,7 +155,7 @@ module ROS
       topic = @subscriptions[topic_name]
 
       new_pubs = publishers.select do |pub_url|
-        Diag.log("pub_url=#{pub_url}")
+        Diag.log { "pub_url=#{pub_url}" }
         ps = topic.connections.select { |conn| conn.peer == pub_url }
         ps.length ==  0
       end
@@ -134,22 +176,49 @@ module ROS
     end
     
     private
+
+    # @param [Boolean] private the listener of @private_topics
+    # @return [Integer] port of the server
+    def start_server(private=false)
+      port = ROS.get_local_port()
+      EM.next_tick do
+        server = EM.start_server(@node.get_ip, port, TCPROSPubSubInboundConnection, self)
+        if private
+          @private_server = server
+        else
+          @server = server
+        end
+        Diag.log("TCPROSPubSubServer started.")
+      end
+      port
+    end
+
+    # Stop the listener of @private_topics when none is left.
+    def stop_private_server
+      @private_port = nil
+      EM.next_tick do
+        EM.stop_server(@private_server) if @private_server
+        @private_server = nil
+      end
+    end
     
     def connect_to_publisher(topic, pub_url)
       uri = URI(pub_url)
       protocols = []
       protocols.push(["TCPROS"])
-      client = XMLRPC::Client.new(uri.host, "/", uri.port)
-      Diag.log("Call ROS master API requestTopic(#{@node.get_name}, #{topic.name}, #{protocols})")
+      # nodes at a shared listener are identified by the path
+      path = uri.path.empty? ? "/" : uri.path
+      client = XMLRPC::Client.new(uri.host, path, uri.port)
+      Diag.log { "Call ROS master API requestTopic(#{@node.get_name}, #{topic.name}, #{protocols})" }
       code, status_message, protocol = client.call("requestTopic",
                                                    @node.get_name,
                                                    topic.name,
                                                    protocols)
-      Diag.log("requestTopic => #{protocol}")
+      Diag.log { "requestTopic => #{protocol}" }
       if code == 1 and protocol.length > 0 and protocol[0] == "TCPROS"
         proto, host, port = protocol
         EM.next_tick do
-          Diag.log("Connecting #{host}:#{port}")
+          Diag.log { "Connecting #{host}:#{port}" }
           EM.connect(host, port, TCPROSPubSubOutboundConnection,
                      @node.get_name, topic, pub_url)
         end
@@ -158,7 +227,12 @@ module ROS
   end
 
   class PubTopic
-    def initialize(manager, topic, msg_type, latching)
+    # @param [Integer] max_outbound bytes in the socket buffer of a subscriber before queueing, nil for no limit
+    # @param [Integer] queue_size max number of messages queued per subscriber
+    # @param [Symbol] overflow policy on a full queue (:drop_newest, :drop_oldest or :disconnect)
+    def initialize(manager, topic, msg_type, latching,
+                   max_outbound=TopicManager::DEFAULT_MAX_OUTBOUND,
+                   queue_size=TopicManager::DEFAULT_QUEUE_SIZE, overflow=:drop_oldest)
       @manager = manager
       @name = topic 
       @msg_type = msg_type
@@ -167,10 +241,18 @@ module ROS
       @latching = latching
       @latched_msg = nil
       @valid = true
+      @max_outbound = max_outbound
+      @queue_size = queue_size
+      @overflow = overflow
+      @num_dropped_closed = 0
     end
 
     attr_accessor :name, :type, :msg_type, :latching
 
+    def caller_id
+      @manager.caller_id
+    end
+
     def type_match?(type_name, md5sum)
       type_name == @msg_type::TYPE and md5sum == @msg_type::MD5SUM
     end
@@ -182,28 +264,52 @@ module ROS
     end
 
     def add_connection(conn)
-      @connections.push(conn)
-      if @latching and @latched_msg
-        conn.send_data(data)
+      @mutex.synchronize do
+        conn.set_flow_control(@max_outbound, @queue_size, @overflow)
+        @connections.push(conn)
+        if @latching and @latched_msg
+          conn.send_message(@latched_msg)
+        end
       end
     end
 
     def remove_connection(conn)
       @mutex.synchronize do
-        @connections.delete(conn)
+        @num_dropped_closed += conn.num_dropped if @connections.delete(conn)
+      end
+    end
+
+    # @return [Array] [callerid, queue_depth, outbound_bytes, num_dropped] of each subscriber
+    def subscriber_stats
+      @mutex.synchronize do
+        @connections.map do |conn|
+          [conn.callerid, conn.queue_depth, conn.get_outbound_data_size, conn.num_dropped]
+        end
+      end
+    end
+
+    # @return [Integer] number of messages dropped for slow subscribers
+    def num_dropped
+      @mutex.synchronize do
+        @connections.inject(@num_dropped_closed) { |sum, conn| sum + conn.num_dropped }
       end
     end
 
     def publish(msg)
       @mutex.synchronize do
         raise ROSInvalidTopicError until @valid
+        start = Trace.now if Trace::ENABLED
         sio = StringIO.new
         msg.serialize(sio)
         data = sio.string
+        if Trace::ENABLED
+          serialized = Trace.now
+          Trace.record(:serialize, @name, start, serialized)
+        end
         @connections.each do |conn|
-          conn.send_data([data.bytesize].pack("V"))
-          conn.send_data(data)
+          conn.send_message(data)
         end
+        Trace.record(:send, @name, serialized) if Trace::ENABLED
         @latched_msg = data
       end
     end
@@ -241,6 +347,16 @@ module ROS
       @topic.num_subscribers
     end
 
+    # @return [Array] [callerid, queue_depth, outbound_bytes, num_dropped] of each subscriber
+    def subscriber_stats
+      @topic.subscriber_stats
+    end
+
+    # @return [Integer] number of messages dropped for slow subscribers
+    def num_dropped
+      @topic.num_dropped
+    end
+
     def publish(msg)
       @topic.publish(msg)
     end
@@ -251,7 +367,11 @@ module ROS
   end
 
   class SubTopic 
-    def initialize(manager, topic, msg_type, callback)
+    # @param [Boolean] inline invoke callbacks at the event thread instead of spin
+    # @param [Integer] pool_size recycle up to pool_size message instances
+    #   after callbacks return (0 to allocate a new message every time)
+    # @param [Boolean] raw pass serialized messages to callbacks as strings
+    def initialize(manager, topic, msg_type, callback, inline=false, pool_size=0, raw=false)
       @manager = manager
       @name = topic
       @msg_type = msg_type
@@ -262,9 +382,12 @@ module ROS
       @callbacks = [callback]
       @queue_mutex = Mutex.new
       @callback_queue = []
+      @inline = inline
+      @raw = raw
+      @pool = (pool_size > 0 and not raw) ? MessagePool.new(msg_type, pool_size) : nil
     end
 
-    attr_reader :name, :msg_type, :connections
+    attr_reader :name, :msg_type, :connections, :pool
 
     def type_match?(type_name, md5sum)
       type_name == @msg_type::TYPE and md5sum == @msg_type::MD5SUM
@@ -296,11 +419,19 @@ module ROS
 
     # Called at event thread
     def push_message(data)
+      if @inline
+        msg = new_message(data)
+        @callbacks.each { |callback| callback.call(msg) }
+        @pool.release(msg) if @pool
+        return
+      end
+      start = Trace.now if Trace::ENABLED
       @queue_mutex.synchronize do
         @callbacks.each do |callback|
-          @callback_queue.push([callback, data])
+          @callback_queue.push([callback, data, start])
         end
       end
+      Trace.record(:enqueue, @name, start) if Trace::ENABLED
     end
 
     # Called at main thread
@@ -311,10 +442,19 @@ module ROS
         @callback_queue = []
       end
       callbacks.each do |item|
-        callback, data = item
-        msg = @msg_type.new
-        msg.deserialize(data)
+        callback, data, enqueued = item
+        if Trace::ENABLED
+          dequeued = Trace.now
+          Trace.record(:dequeue, @name, enqueued, dequeued)
+        end
+        msg = new_message(data)
+        if Trace::ENABLED
+          deserialized = Trace.now
+          Trace.record(:deserialize, @name, dequeued, deserialized)
+        end
         callback.call(msg)
+        Trace.record(:callback, @name, deserialized) if Trace::ENABLED
+        @pool.release(msg) if @pool
       end
     end
 
@@ -332,6 +472,18 @@ module ROS
 
     private
 
+    def new_message(data)
+      if @raw
+        data
+      elsif @pool
+        @pool.deserialize(data)
+      else
+        msg = @msg_type.new
+        msg.deserialize(data)
+        msg
+      end
+    end
+
     def force_shutdown
       return unless @valid
       @connections.each do |conn|
@@ -1,5 +1,6 @@
 require 'ros/master'
 require 'ros/tcpros'
+require 'ros/trace'
 require 'socket'
 
 module ROS
@@ -10,27 +11,37 @@ module ROS
   # 
   class ServiceManager
 
-    def initialize(node)
+    # @param [SharedServer] shared_server accept clients at the shared listener of the process
+    def initialize(node, shared_server=nil)
       @node = node
       @endpoints = {}
       @port = nil
       @server = nil
-      @master_proxy = MasterProxy.new(@node.get_master_uri)
+      @shared_server = shared_server
+      @master_proxy = @node.master_proxy
     end
 
     attr_reader :endpoints, :port
 
+    def caller_id
+      @node.get_name
+    end
+
     def start
+      if @shared_server
+        @port = @shared_server.service_port
+        return
+      end
       @port = ROS.get_local_port()
       EM.next_tick do
-        @server = EM.start_server(@node.get_ip, @port, TCPROSServiceInboundConnection,
-                                  @node.get_name, self)
+        @server = EM.start_server(@node.get_ip, @port, TCPROSServiceInboundConnection, self)
         Diag.log("TCPROSServiceServer started.")
       end
     end
 
     def shutdown
-      @endpoints.each { |service, ep| ep.shutdown }
+      @endpoints.values.each { |ep| ep.shutdown }
+      return if @shared_server
       EM.next_tick do
         EM.stop_server(@server)
         Diag.log("TCPROSServiceServer stopped.")
@@ -49,6 +60,7 @@ module ROS
 
     def remove_endpoint(endpoint)
       @endpoints.delete(endpoint.name)
+      @shared_server.remove_endpoint(endpoint.name, self) if @shared_server
       service_api = "rosrpc://#{@node.get_ip}:#{@port}"
       @master_proxy.unregister_service(@node.get_name, endpoint.name, service_api)
     end
@@ -56,26 +68,25 @@ module ROS
     def create_endpoint(service, srv_type, options, block)
       resolved_service = @node.resolve_name(service)
       if @endpoints.has_key? resolved_service
-        service = @endpoints[service]
         # shutdown old service
-        service.shutdown
+        @endpoints[resolved_service].shutdown
       end
-      service = ServiceEndpoint.new(self, service, srv_type, block)
+      service = ServiceEndpoint.new(self, resolved_service, srv_type, block)
       service_api = "rosrpc://#{@node.get_ip}:#{@port}"
-      Diag.log(service_api)
+      Diag.log { service_api }
       @master_proxy.register_service(@node.get_name,
                                      resolved_service,
                                      service_api,
                                      @node.get_node_uri)
       @endpoints[resolved_service] = service
+      @shared_server.add_endpoint(resolved_service, self) if @shared_server
       service
     end
 
     def create_proxy(service, srv_type, options)
       persistent = (options[:persistent] or false)
       resolved_service = @node.resolve_name(service)
-      master = MasterProxy.new(@node.get_master_uri)
-      service_uri = master.lookup_service(@node.get_name, resolved_service)
+      service_uri = @master_proxy.lookup_service(@node.get_name, resolved_service)
       uri = URI(service_uri)
       TCPServiceProxy.new(uri.host, uri.port, @node.get_name,
                           service, srv_type, persistent)
@@ -97,24 +108,30 @@ module ROS
 
     attr_reader :name, :srv_type
 
+    def caller_id
+      @manager.caller_id
+    end
+
     def push_request(conn, request)
+      start = Trace.now if Trace::ENABLED
       @queue_mutex.synchronize do
-        @callback_queue.push([conn, @callback, request])
+        @callback_queue.push([conn, @callback, request, start])
       end
+      Trace.record(:enqueue, @name, start) if Trace::ENABLED
     end
 
     def remove_connection(conn)
-      Diag.log("remove_conection #{conn}`")
+      Diag.log { "remove_conection #{conn}`" }
       @connections.delete(conn)
     end
 
     def add_connection(conn)
-      Diag.log("add_conection #{conn}`")
+      Diag.log { "add_conection #{conn}`" }
       @connections.push(conn)
     end
 
     def type_match?(type_name, md5sum)
-      Diag.log("type_match? #{@srv_type::TYPE}=#{type_name} #{@srv_type::MD5SUM}=#{md5sum}")
+      Diag.log { "type_match? #{@srv_type::TYPE}=#{type_name} #{@srv_type::MD5SUM}=#{md5sum}" }
       # rospy doesn't send 'type' field.
       (md5sum == '*' or @srv_type::MD5SUM == md5sum)
     end
@@ -126,18 +143,35 @@ module ROS
         @callback_queue = []
       end
       callbacks.each do |item|
-        conn, callback, request = item
+        conn, callback, request, enqueued = item
         Diag.log("invoke_esrvice")
+        if Trace::ENABLED
+          dequeued = Trace.now
+          Trace.record(:dequeue, @name, enqueued, dequeued)
+        end
         req = @srv_type::Request.new
         req.deserialize(request)
-        Diag.log(req)
+        if Trace::ENABLED
+          deserialized = Trace.now
+          Trace.record(:deserialize, @name, dequeued, deserialized)
+        end
+        Diag.log { req }
         begin
           res = callback.call(req)
+          if Trace::ENABLED
+            called = Trace.now
+            Trace.record(:callback, @name, deserialized, called)
+          end
           sio = StringIO.new
           res.serialize(sio)
           data = sio.string
+          if Trace::ENABLED
+            serialized = Trace.now
+            Trace.record(:serialize, @name, called, serialized)
+          end
           conn.send_data([1, data.bytesize].pack("CV"))
           conn.send_data(data)
+          Trace.record(:send, @name, serialized) if Trace::ENABLED
         rescue
           error = "message call failed."
           conn.send_data([0, error.bytesize, error].pack("CVa"))
@@ -210,13 +244,13 @@ module ROS
 
     # Blocking service call
     def call(*args)
-      Diag.log("call #{args}")
+      Diag.log { "call #{args}" }
       @state_mutex.synchronize do
         if @state != :ready
           raise ROSServiceCallError.new()
         end
         req = @srv_type::Request.new(*args)
-        Diag.log(req)
+        Diag.log { req }
         sio = StringIO.new
         req.serialize(sio)
         data = sio.string
@@ -229,7 +263,7 @@ module ROS
         end
         result = @value
         @value = nil
-        Diag.log("@state=#{@state}")
+        Diag.log { "@state=#{@state}" }
         if @state == :success
           if @persistent
             @state = :ready
@@ -330,15 +364,14 @@ module ROS
       while not header.done
         Diag.log("1")
         data = @socket.recv(BUF_SIZE)
-        Diag.log("received=#{data.bytesize}")
+        Diag.log { "received=#{data.bytesize}" }
         raise ROSServiceCallError.new("EOF while parsing response header.") if data == 0
         buffer += data
         num_read = header.parse(buffer)
         buffer = buffer.byteslice(num_read, buffer.bytesize - num_read)
-        Diag.log("num_read=#{num_read}")
+        Diag.log { "num_read=#{num_read}" }
       end
-      Diag.log("resposne header received. #{header.fields}")
-
+      Diag.log { "resposne header received. #{header.fields}" }
       if header.fields.has_key? "error"
         raise ROSServiceCallError.new(header.fields["error"])
       elsif not header.fields.has_key? "callerid"
@@ -359,14 +392,13 @@ module ROS
       sio = StringIO.new
       req.serialize(sio)
       data = sio.string
-      Diag.log("data = #{data.bytesize}")
+      Diag.log { "data = #{data.bytesize}" }
       data = [data.bytesize].pack("V") + data
       num_sent = 0
       while num_sent < data.bytesize
         num_sent = @socket.write(data.byteslice(num_sent, data.bytesize))
       end
-      Diag.log("sent = #{num_sent}")
-
+      Diag.log { "sent = #{num_sent}" }
       # receive response 
       Diag.log("receive response")
       req = @srv_type::Request.new(*args)
@@ -0,0 +1,106 @@
+require 'thread'
+require 'eventmachine'
+require 'ros/utils'
+require 'ros/tcpros'
+require 'ros/slave'
+
+module ROS
+  # Listeners shared by the nodes of a process created with the
+  # :shared_servers option. There is one listener per protocol and IP.
+  #
+  # Slave API calls are routed by the path of the node URI
+  # (http://host:port/node_name), TCPROS topic connections by the topic
+  # and service connections by the service in the connection header.
+  class SharedServer
+    POOL_SIZE = 4
+
+    @@instances = {}
+    @@mutex = Mutex.new
+
+    # @return [SharedServer] started server of the process for ip
+    def self.instance(ip)
+      @@mutex.synchronize do
+        @@instances[ip] ||= SharedServer.new(ip).start
+      end
+    end
+
+    def initialize(ip)
+      @ip = ip
+      @mutex = Mutex.new
+      @slaves = {}
+      @publications = {}
+      @endpoints = {}
+      @slave_port = ROS.get_local_port()
+      @topic_port = ROS.get_local_port()
+      @service_port = ROS.get_local_port()
+      @pool = HandlerPool.new(POOL_SIZE)
+    end
+
+    attr_reader :slave_port, :topic_port, :service_port, :pool
+
+    def start
+      EM.next_tick do
+        EM.start_server(@ip, @slave_port, XMLRPCConnection, self)
+        EM.start_server(@ip, @topic_port, TCPROSPubSubInboundConnection, self)
+        EM.start_server(@ip, @service_port, TCPROSServiceInboundConnection, self)
+        Diag.log { "SharedServer started at ports #{@slave_port}, #{@topic_port}, #{@service_port}" }
+      end
+      self
+    end
+
+    def add_slave(path, slave)
+      @mutex.synchronize { @slaves[path] = slave }
+    end
+
+    def remove_slave(path)
+      @mutex.synchronize { @slaves.delete(path) }
+    end
+
+    # A request to "/" is accepted while only one node is running.
+    # @return [Array] [block, inline] or nil
+    def lookup_handler(path, name)
+      slave = @mutex.synchronize do
+        @slaves[path.chomp('/')] or (@slaves.length == 1 ? @slaves.values[0] : nil)
+      end
+      slave && slave.lookup_handler(path, name)
+    end
+
+    # Claim a topic for the topic manager of a node.
+    # @return [Boolean] false if another node of the process publishes the topic
+    def add_publication(name, topic_manager)
+      @mutex.synchronize do
+        owner = @publications[name]
+        return owner.equal?(topic_manager) if owner
+        @publications[name] = topic_manager
+        true
+      end
+    end
+
+    def remove_publication(name, topic_manager)
+      @mutex.synchronize do
+        @publications.delete(name) if @publications[name].equal?(topic_manager)
+      end
+    end
+
+    def lookup_publication(name)
+      topic_manager = @mutex.synchronize { @publications[name] }
+      topic_manager && topic_manager.lookup_publication(name)
+    end
+
+    # The last node advertising a service wins, as with the master.
+    def add_endpoint(name, service_manager)
+      @mutex.synchronize { @endpoints[name] = service_manager }
+    end
+
+    def remove_endpoint(name, service_manager)
+      @mutex.synchronize do
+        @endpoints.delete(name) if @endpoints[name].equal?(service_manager)
+      end
+    end
+
+    def lookup_endpoint(name)
+      service_manager = @mutex.synchronize { @endpoints[name] }
+      service_manager && service_manager.lookup_endpoint(name)
+    end
+  end
+end
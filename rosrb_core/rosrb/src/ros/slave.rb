@@ -1,214 +1,267 @@
-require 'webrick'
-require 'xmlrpc/server'
-require 'date'
 require 'eventmachine'
 require 'socket'
+require 'thread'
+require 'ros/utils'
+require 'ros/trace'
+require 'ros/xmlrpc_codec'
 
 module ROS
+  # HTTP connection of the slave API.
+  #
+  # Requests are parsed with XMLRPCCodec. Handlers marked inline run on the
+  # event thread; blocking ones run on the HandlerPool of the server.
+  # Connections are kept alive (HTTP/1.1, or HTTP/1.0 with keep-alive), and
+  # requests on a connection are handled one at a time, so responses keep
+  # the order of requests.
   class XMLRPCConnection < EM::Connection
+    SERVER_NAME = "rosrb/1.0"
+    CRLF = "\r\n"
+
     def initialize(*args)
-      @servlet = args.shift
+      @server = args.shift
       @buffer = ""
       @state = :header
+      @busy = false
+      @closed = false
+      @keep_alive = false
+      @proto = "HTTP/1.0"
+      @path = "/"
+      @content_length = 0
     end
 
-    class Request
-      def initialize(method, path, proto)
-        @request_method = method
-        @path = path
-        @proto = proto
-        @header = {}
-        @body = nil
-      end
-
-      def [](key)
-        @header[key.downcase]
-      end
-
-      def []=(key, value)
-        @header[key.downcase] = value.to_s
-      end
+    def receive_data(data)
+      @buffer << data
+      process
+    end
 
-      attr_reader :header
-      attr_accessor :request_method, :path, :proto, :peeraddr, :body
+    def unbind
+      @closed = true
     end
 
-    HTTP_PROTOCOL = "HTTP/1.0"
-    SERVER_NAME = "rosrb/1.0"
+    private
 
-    class Response
-      def initialize(status, status_message)
-        @status = status
-        @status_message = status_message
-        @header = {}
-        @body = nil
-        self['content-type'] = 'text/plain'
-        self['content-length'] = 0
-        self['server'] = "#{SERVER_NAME}"
-        self['connection'] = "close"
+    def process
+      until @busy or @closed
+        case @state
+        when :header
+          index = @buffer.index("\r\n\r\n")
+          return unless index
+          header = @buffer.byteslice(0, index)
+          @buffer = @buffer.byteslice(index + 4, @buffer.bytesize - index - 4)
+          fields = header.split(CRLF)
+          req_line = fields.shift
+          unless req_line =~ /^POST\s(\S+)\s(HTTP\/1\.[01])$/
+            @keep_alive = false
+            send_response(400, "Bad Request", "")
+            return
+          end
+          @path, @proto = $1, $2
+          headers = {}
+          fields.each do |field|
+            headers[$1.downcase] = $2.strip if field =~ /^([\w-]+):\s*(.*)$/
+          end
+          connection = (headers['connection'] or "").downcase
+          if @proto == "HTTP/1.1"
+            @keep_alive = (connection != "close")
+          else
+            @keep_alive = (connection == "keep-alive")
+          end
+          @content_length = headers['content-length'].to_i
+          @state = :body
+        when :body
+          return if @buffer.bytesize < @content_length
+          body = @buffer.byteslice(0, @content_length)
+          @buffer = @buffer.byteslice(@content_length, @buffer.bytesize - @content_length)
+          @state = :header
+          dispatch(body)
+        end
       end
+    end
 
-      def [](key)
-        @header[key.downcase]
+    def dispatch(body)
+      begin
+        method, params = XMLRPCCodec.parse_call(body)
+      rescue ROSError, ArgumentError => e
+        send_response(200, "OK", XMLRPCCodec.encode_fault(-32700, e.message))
+        return
       end
-
-      def []=(key, value)
-        @header[key.downcase] = value.to_s
+      Diag.log { "slave API #{method}#{params}" }
+      handler = @server.lookup_handler(@path, method)
+      if handler.nil?
+        send_response(200, "OK", XMLRPCCodec.encode_fault(-32601, "Method #{method} is not supported."))
+        return
       end
+      block, inline = handler
+      if inline
+        send_response(200, "OK", invoke(block, params))
+      else
+        @busy = true
+        @server.pool.post do
+          result = invoke(block, params)
+          EM.schedule do
+            @busy = false
+            unless @closed
+              send_response(200, "OK", result)
+              process
+            end
+          end
+        end
+      end
+    end
+
+    def invoke(block, params)
+      XMLRPCCodec.encode_response(block.call(*params))
+    rescue => e
+      XMLRPCCodec.encode_fault(-32500, "#{e.class}: #{e.message}")
+    end
+
+    def send_response(status, message, body)
+      data = "#{@proto} #{status} #{message}" << CRLF
+      data << "Server: #{SERVER_NAME}" << CRLF
+      data << "Content-Type: text/xml" << CRLF
+      data << "Content-Length: #{body.bytesize}" << CRLF
+      data << (@keep_alive ? "Connection: keep-alive" : "Connection: close") << CRLF
+      data << CRLF
+      send_data(data)
+      send_data(body)
+      close_connection_after_writing unless @keep_alive
+    end
+  end
 
-      def to_data
-        data = ""
-        data << "#{HTTP_PROTOCOL} #{@status} #{@status_message}" << CRLF
-        time = ::Time.now.gmtime.strftime("%a, %d %b %Y %H:%M:%S GMT")
-        data << "date: #{time}" << CRLF
-        @header.each do |k, v|
-          data << "#{k}: #{v}" << CRLF
+  # Threads running blocking slave API handlers.
+  # Separated from the EM.defer pool, so that slave calls do not wait
+  # behind other deferred work.
+  class HandlerPool
+    def initialize(size)
+      @size = size
+      @queue = Queue.new
+      @threads = []
+      @mutex = Mutex.new
+    end
+
+    def post(&job)
+      @mutex.synchronize do
+        if @threads.empty?
+          @size.times { @threads.push(Thread.new { run }) }
         end
-        data << CRLF
-        data << @body unless @body.nil?
-        data
       end
+      @queue.push(job)
+    end
 
-      attr_reader :header
-      attr_accessor :body, :status, :status_message
+    # Threads finish after queued jobs. This may be called from a job.
+    def shutdown
+      @mutex.synchronize do
+        @threads.each { @queue.push(nil) }
+        @threads = []
+      end
     end
 
-    CRLF = "\r\n"
+    private
 
-    def receive_data(data)
-      @buffer += data
-      loop do
-        case @state
-        when :header
-          if @buffer =~ /\r\n\r\n/
-            header, rest = @buffer.split("\r\n\r\n", 2)
-            fields = header.split("\r\n")
-            req_line = fields.shift
-            if req_line =~ /^(\S+)\s(\S+)\s(\S+)$/
-              method, path, proto = $1, $2, $3
-              if method != "POST"
-                res = Response.new(400, "Bad Request")
-                send_data(res.to_data)
-                return
-              end
-            else
-              res = Response.new(400, "Bad Request")
-              send_data(res.to_data)
-              return
-            end
-            @request = Request.new(method, path, proto)
-            port, ip = Socket.unpack_sockaddr_in(get_peername)
-            @request.peeraddr = Socket.getaddrinfo(ip, port)
-            for field in fields 
-              if field =~ /^([\w-]+):\s*(.*)$/
-                @request[$1] = $2.strip
-              end
-            end
-            @content_length = @request.header['content-length'].to_i
-            @buffer = rest
-            @state = :body
-          end
-        when :body
-          if @buffer.bytesize >= @content_length
-            @request.body = @buffer.byteslice(0, @content_length)
-            @buffer = @buffer.byteslice(@content_length, 
-                                        @buffer.bytesize - @content_length)
-            @state = :header
-
-            operation = proc do
-              response = Response.new(200, "OK")
-              begin
-                @servlet.service(@request, response)
-                response.to_data
-              rescue => e
-                response = Response.new(500, "Internal Server Error")
-                response.to_data
-              end
-            end
-            callback = proc do |res|
-              send_data(res)
-              close_connection_after_writing()
-            end
-            EM.defer(operation, callback)
-          end
-          return
+    def run
+      while job = @queue.pop
+        begin
+          job.call
+        rescue => e
+          $stderr.write("Exception in slave API handler: #{e}\n")
         end
       end
     end
   end
 
 
-  # Implement ROS XMLRPC slave API with a dedicated thread
+  # Implement ROS XMLRPC slave API on the event thread
   class SlaveServer
     IGNORED = 0
-    def initialize(node, topic_manager, service_manager)
+    POOL_SIZE = 2
+
+    # @param [SharedServer] shared_server serve at the shared listener of the process
+    def initialize(node, topic_manager, service_manager, shared_server=nil)
       @node = node
       @topic_manager = topic_manager
       @service_manager = service_manager
+      @shared_server = shared_server
       master_uri = @node.get_master_uri
-      @client = XMLRPC::Client.new(master_uri, "")
-      @port = ROS.get_local_port()
-
-      servlet = XMLRPC::WEBrickServlet.new
+      if @shared_server
+        @port = @shared_server.slave_port
+        @path = @node.get_name
+        @pool = @shared_server.pool
+      else
+        @port = ROS.get_local_port()
+        @path = ""
+        @pool = HandlerPool.new(POOL_SIZE)
+      end
+      @handlers = {}
 
-      servlet.add_handler("getBusStats") do |caller_id|
+      add_handler("getBusStats", true) do |caller_id|
         [0, "Not implemented", IGNORED]
       end
 
-      servlet.add_handler("getBusInfo") do |caller_id|
+      add_handler("getBusInfo", true) do |caller_id|
         [0, "Not implemented", IGNORED]
       end
 
-      servlet.add_handler("getMasterUri") do |caller_id|
+      # rosrb extension: latency histograms recorded with ROSRB_TRACE
+      add_handler("getLatencyStats", true) do |caller_id|
+        if Trace::ENABLED
+          [1, "", Trace.report]
+        else
+          [0, "Tracing is disabled. Set ROSRB_TRACE to enable it.", IGNORED]
+        end
+      end
+
+      add_handler("getMasterUri", true) do |caller_id|
         [1, "", master_uri]
       end
 
-      servlet.add_handler("shutdown") do |caller_id, msg|
-        Node.isntance.shutdown
+      # signal_shutdown runs shutdown hooks and calls the master
+      add_handler("shutdown", false) do |caller_id, msg|
+        @node.signal_shutdown
         [1, "", IGNORED]
       end
 
-      servlet.add_handler("getPid") do |caller_id|
-        [1, "", @pid]
+      add_handler("getPid", true) do |caller_id|
+        [1, "", Process.pid]
       end
 
-      servlet.add_handler("getSubscriptions") do |caller_id|
+      add_handler("getSubscriptions", true) do |caller_id|
         result = []
-        @topic_manager.subscriptions.each do |pub|
-          result.push([pub.name, pub.msg_type::TYPE])
+        @topic_manager.subscriptions.each_value do |sub|
+          result.push([sub.name, sub.msg_type::TYPE])
         end
         [1, "", result]
       end
 
-      servlet.add_handler("getPublications") do |caller_id|
+      add_handler("getPublications", true) do |caller_id|
         result = []
-        @topic_manager.publications.each do |pub|
+        @topic_manager.publications.each_value do |pub|
           result.push([pub.name, pub.msg_type::TYPE])
         end
         [1, "", result]
       end
 
-      servlet.add_handler("paramUpdate") do |caller_id, parameter_key, parameter_value|
+      add_handler("paramUpdate", true) do |caller_id, parameter_key, parameter_value|
         # Not implemented
         [1, "", IGNORED]
       end
 
-      servlet.add_handler("publisherUpdate") do |caller_id, topic, publishers|
-        Diag.log("Handle slave API publisherUpdate(#{caller_id}, #{topic}, #{publishers})")
+      # requestTopic is called on every new publisher
+      add_handler("publisherUpdate", false) do |caller_id, topic, publishers|
+        Diag.log { "Handle slave API publisherUpdate(#{caller_id}, #{topic}, #{publishers})" }
         @topic_manager.publisher_update(topic, publishers)
         [1, "", IGNORED]
       end
 
       # Currently only support TCPROS
-      servlet.add_handler("requestTopic") do |caller_id, topic, protocols|
-        Diag.log("Handle slave API requestTopic(#{caller_id}, #{topic}, #{protocols})")
+      add_handler("requestTopic", true) do |caller_id, topic, protocols|
+        Diag.log { "Handle slave API requestTopic(#{caller_id}, #{topic}, #{protocols})" }
         result = nil
         protocols.each do |protocol|
-          protocol_name = protocol.shift
+          protocol_name = protocol[0]
           pub = @topic_manager.lookup_publication(topic)
           if protocol_name == "TCPROS" and pub
-            result = [1, "Protocol matched.", ["TCPROS", @node.get_ip, @topic_manager.port]]
-            Diag.log("Protocol matched. #{result}")
+            result = [1, "Protocol matched.", ["TCPROS", @node.get_ip, @topic_manager.port_for(topic)]]
+            Diag.log { "Protocol matched. #{result}" }
           end
         end
         if result
@@ -217,37 +270,41 @@ module ROS
           [0, "Requested topic is not found.", IGNORED]
         end
       end
-
-      @servlet = servlet
-      # To prevent XMLRPC::Server from install its own signal handler, 
-      # We use WEBRick::HTTPServer.
-      #@server = WEBrick::HTTPServer.new(:Port => port, :BindAddress => @node.ip)
-      #@server.mount("/", servlet)
     end
 
-    attr_reader :port
+    # path of the node URI, empty unless the server is shared
+    attr_reader :port, :path, :pool
 
-    #def start
-    #  @thread = Thread.new do
-    #    #@server.start
-    #  end
-    #end
+    # @param [String] name slave API method name
+    # @param [Boolean] inline run at the event thread. Inline handlers must not block.
+    # @param [Proc] block handler returning [code, status, value]
+    def add_handler(name, inline, &block)
+      @handlers[name] = [block, inline]
+    end
+
+    # @param [String] path request path, not used unless the server is shared
+    # @return [Array] [block, inline] or nil
+    def lookup_handler(path, name)
+      @handlers[name]
+    end
 
-    #def shutdown
-    #  @server.shutdown
-    #  @thread.join
-    #  Diag.log("Slave server shutdown complete.")
-    #end
-    #
     def start
-      @port = ROS.get_local_port()
+      if @shared_server
+        @shared_server.add_slave(@path, self)
+        return
+      end
       EM.next_tick do
-        @server = EM.start_server(@node.get_ip, @port, XMLRPCConnection, @servlet)
-        Diag.log("SlaveServer started at port #{@port}")
+        @server = EM.start_server(@node.get_ip, @port, XMLRPCConnection, self)
+        Diag.log { "SlaveServer started at port #{@port}" }
       end
     end
 
     def shutdown
+      if @shared_server
+        @shared_server.remove_slave(@path)
+        return
+      end
+      @pool.shutdown
       EM.next_tick do
         EM.stop_server(@server)
         Diag.log("SlaveServer stopped.")
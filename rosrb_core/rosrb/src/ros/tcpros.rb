@@ -1,4 +1,6 @@
+require 'eventmachine'
 require 'ros/utils'
+require 'ros/trace'
 
 module ROS
 
@@ -15,31 +17,31 @@ module ROS
     attr_reader :size, :fields, :done
     
     def parse(data)
-      Diag.log("data.bytesize=#{data.bytesize}")
+      Diag.log { "data.bytesize=#{data.bytesize}" }
       num_read = 0
       while data.bytesize >= (num_read + @expected_size) and not @done
-        Diag.log("data.bytesize=#{data.bytesize}  (num_read + @expected_size)=#{num_read + @expected_size}")
+        Diag.log { "data.bytesize=#{data.bytesize}  (num_read + @expected_size)=#{num_read + @expected_size}" }
         case @state
         when :header_length
           @size = data.byteslice(num_read, 4).unpack("V")[0]
-          Diag.log("header size = #{@size}")
+          Diag.log { "header size = #{@size}" }
           num_read += 4
           @expected_size = 4
           @state = :header_field_length
         when :header_field_length
           @expected_size = data.byteslice(num_read, 4).unpack("V")[0]
-          Diag.log("field size =#{@expected_size}")
+          Diag.log { "field size =#{@expected_size}" }
           num_read += 4
           @header_read_size += 4
           @state = :header_field_body
         when :header_field_body
           field = data.byteslice(num_read, @expected_size)
-          Diag.log("field.bytesize =#{field.bytesize} field=#{field}")
+          Diag.log { "field.bytesize =#{field.bytesize} field=#{field}" }
           name, value = field.split("=")
           @fields[name] = value
           num_read += @expected_size
           @header_read_size += @expected_size
-          Diag.log("@header_read_size=#{@header_read_size}")
+          Diag.log { "@header_read_size=#{@header_read_size}" }
           if @header_read_size == @size
             @expected_size = 0
             @state = :end
@@ -55,7 +57,7 @@ module ROS
           end
         end
       end
-      Diag.log("num_read=#{num_read}")
+      Diag.log { "num_read=#{num_read}" }
       num_read
     end
 
@@ -64,9 +66,9 @@ module ROS
       fields.each do |k, v|
         headers << "#{k}=#{v}"
       end 
-      Diag.log(headers)
+      Diag.log { headers }
       sum = headers.reduce(0) { |memo, item| memo + item.bytesize + 4 }
-      Diag.log(sum)
+      Diag.log { sum }
       data = []
       format = []
       data.push(sum)
@@ -77,11 +79,11 @@ module ROS
         data.push(item)
         format.push("a#{item.bytesize}")
       end
-      Diag.log(data)
-      Diag.log(format.join)
+      Diag.log { data }
+      Diag.log { format.join }
       output = data.pack(format.join)
-      Diag.log(output.bytesize)
-      Diag.log(output.unpack(format.join))
+      Diag.log { output.bytesize }
+      Diag.log { output.unpack(format.join) }
       output
     end
   end
@@ -98,10 +100,10 @@ module ROS
 
 
     def post_init
-      Diag.log("TCPROSConnection#post_init")
+      Diag.log { "TCPROSConnection#post_init" }
       @buffer = ""
       @header = TCPROSHeader.new
-      Diag.log("TCPROSConnection#post_init end")
+      Diag.log { "TCPROSConnection#post_init end" }
     end
 
     def receive_data(data)
@@ -112,7 +114,7 @@ module ROS
         num_read = @header.parse(@buffer)
         @buffer = @buffer.byteslice(num_read, @buffer.bytesize - num_read)
         if @header.done
-          Diag.log("Received header #{@header.fields}")
+          Diag.log { "Received header #{@header.fields}" }
           on_header(@header)
         end
       else
@@ -137,24 +139,114 @@ module ROS
   end
 
   # Connection from a remote subscriber to a local publisher
+  #
+  # Messages are written to the socket buffer while it holds less than
+  # max_outbound bytes. Beyond that they wait in a queue of queue_size
+  # messages, flushed as the subscriber catches up. When the queue is full
+  # the overflow policy drops the newest or the oldest message, or
+  # disconnects the subscriber, so a slow subscriber never bloats the
+  # process nor delays other connections.
+  #
+  # EventMachine has no writable callback for server connections, so the
+  # queue is flushed by a timer. Its interval doubles while the socket
+  # buffer does not drain, up to FLUSH_INTERVAL_MAX, and returns to
+  # FLUSH_INTERVAL once messages are written. A stalled subscriber costs
+  # about 10 wakeups per second.
   class TCPROSPubSubInboundConnection < TCPROSConnection
+    OVERFLOW_POLICIES = [:drop_newest, :drop_oldest, :disconnect]
+    FLUSH_INTERVAL = 0.001
+    FLUSH_INTERVAL_MAX = 0.1
+
+    # @param [TopicManager, SharedServer] topic_manager looking up publications by topic
     def initialize(*args)
       super
-      @node_id = args.shift
       @topic_manager = args.shift
       @topic = nil
+      @callerid = nil
+      @send_mutex = Mutex.new
+      @send_queue = []
+      @max_outbound = nil
+      @queue_size = nil
+      @overflow = :drop_oldest
+      @num_dropped = 0
+      @flush_scheduled = false
+      @flush_interval = FLUSH_INTERVAL
+      @closing = false
+    end
+
+    attr_reader :callerid
+
+    # @param [Integer] max_outbound bytes in the socket buffer before queueing, nil for no limit
+    # @param [Integer] queue_size max number of queued messages
+    # @param [Symbol] overflow one of OVERFLOW_POLICIES
+    def set_flow_control(max_outbound, queue_size, overflow)
+      @send_mutex.synchronize do
+        @max_outbound = max_outbound
+        @queue_size = queue_size
+        @overflow = overflow
+      end
+    end
+
+    # @return [Integer] number of queued messages
+    def queue_depth
+      @send_mutex.synchronize { @send_queue.length }
+    end
+
+    # @return [Integer] number of dropped messages
+    def num_dropped
+      @send_mutex.synchronize { @num_dropped }
+    end
+
+    # Send a serialized message.
+    # @param [String] data serialized message without length
+    # @return [Boolean] false if the message is dropped
+    def send_message(data)
+      @send_mutex.synchronize do
+        return false if @closing
+        if @send_queue.empty? and writable?
+          write_message(data)
+          return true
+        end
+        if @send_queue.length >= @queue_size
+          case @overflow
+          when :drop_newest
+            @num_dropped += 1
+            return false
+          when :drop_oldest
+            @send_queue.shift
+            @num_dropped += 1
+          when :disconnect
+            Diag.log { "Subscriber #{@callerid} is too slow. disconnect." }
+            @num_dropped += @send_queue.length + 1
+            @send_queue.clear
+            @closing = true
+            EM.next_tick { close_connection }
+            return false
+          end
+        end
+        @send_queue.push(data)
+        schedule_flush
+        true
+      end
     end
 
     def on_header(header)
-      Diag.log("on header #{header}")
+      Diag.log { "on header #{header}" }
       fields = header.fields
       if fields.has_key? "topic"
         name = fields["topic"]
         topic = @topic_manager.lookup_publication(name)
-        if topic.type_match?(fields["type"], fields["md5sum"])
-          topic.add_connection(self)
+        if not topic
+          reply_fields = {}
+          reply_fields["error"] = "topic #{name} is not published."
+          send_data(TCPROSHeader.make_header(reply_fields))
+          close_connection_after_writing
+        elsif topic.type_match?(fields["type"], fields["md5sum"])
+          @callerid = fields["callerid"]
           send_publisher_reply(topic.msg_type::TYPE, topic.msg_type::MD5SUM,
-                               @node_id, topic.latching)
+                               topic.caller_id, topic.latching)
+          # after the reply, as a latched message may be sent at once
+          topic.add_connection(self)
           @topic = topic
         else
           reply_fields = {}
@@ -175,18 +267,60 @@ module ROS
     end
 
     def unbind
+      @send_mutex.synchronize do
+        @closing = true
+        @send_queue.clear
+      end
       @topic.remove_connection(self) if @topic
     end
 
     private
 
+    def writable?
+      @max_outbound.nil? or get_outbound_data_size < @max_outbound
+    end
+
+    def write_message(data)
+      send_data([data.bytesize].pack("V"))
+      send_data(data)
+    end
+
+    # Called with @send_mutex locked
+    def schedule_flush
+      return if @flush_scheduled
+      @flush_scheduled = true
+      interval = @flush_interval
+      EM.schedule do
+        EM.add_timer(interval) { flush }
+      end
+    end
+
+    # Called at event thread
+    def flush
+      @send_mutex.synchronize do
+        @flush_scheduled = false
+        return if @closing
+        written = false
+        while not @send_queue.empty? and writable?
+          write_message(@send_queue.shift)
+          written = true
+        end
+        if written
+          @flush_interval = FLUSH_INTERVAL
+        else
+          @flush_interval = [@flush_interval * 2, FLUSH_INTERVAL_MAX].min
+        end
+        schedule_flush unless @send_queue.empty?
+      end
+    end
+
     def send_publisher_reply(type_name, md5sum, callerid=nil, latching=false, msg_def=nil, error=nil)
       fields = {}
       fields["md5sum"] = md5sum
       fields["type"] = type_name
       fields["callerid"] = callerid if callerid
       fields["latching"] = latching if latching
-      Diag.log("Send header #{fields}")
+      Diag.log { "Send header #{fields}" }
       send_data(TCPROSHeader.make_header(fields))
     end
   end
@@ -209,12 +343,12 @@ module ROS
       fields["md5sum"] = @topic.msg_type::MD5SUM
       fields["type"] = @topic.msg_type::TYPE
       fields["tcp_nodelay"] = 1 if @tcp_nodelay
-      Diag.log("Send header #{fields}")
+      Diag.log { "Send header #{fields}" }
       send_data(TCPROSHeader.make_header(fields))
       Diag.log("header sent")
       @expected_size = 4
       @state = :message_length
-      Diag.log("TCPROSPubSubOutboundConnection#post_init done")
+      Diag.log { "TCPROSPubSubOutboundConnection#post_init done" }
     end
 
     attr_reader :peer
@@ -242,6 +376,7 @@ module ROS
 
     def on_body(data)
       #Diag.log("on_body data.bytesize=#{data.bytesize} expected_size=#{@expected_size}")
+      start = Trace.now if Trace::ENABLED
       num_read = 0
       while data.bytesize >= (num_read + @expected_size)
         case @state
@@ -250,7 +385,7 @@ module ROS
           num_read += 4
           #Diag.log(num_read)
           @state = :message_body
-          Diag.log("message length = #{@expected_size}")
+          Diag.log { "message length = #{@expected_size}" }
         when :message_body
           #Diag.log("message_body")
           message = data.byteslice(num_read, @expected_size)
@@ -259,7 +394,10 @@ module ROS
           @expected_size = 4
           @state = :message_length
           #Diag.log("received a message")
+          Trace.record(:receive, @topic.name, start) if Trace::ENABLED
           @topic.push_message(message)
+          # the next message is timed from here, not from the chunk
+          start = Trace.now if Trace::ENABLED
         end
       end
       #Diag.log("end on_body")
@@ -273,9 +411,9 @@ module ROS
 
   # Connection from a remote client to a local endpoint
   class TCPROSServiceInboundConnection < TCPROSConnection
+    # @param [ServiceManager, SharedServer] service_manager looking up endpoints by service
     def initialize(*args)
       super
-      @node_id = args.shift
       @service_manager = args.shift
       @resource = nil
       @state = :message_length
@@ -285,7 +423,7 @@ module ROS
 
     def on_header(header)
       fields = header.fields
-      Diag.log(fields)
+      Diag.log { fields }
       if fields.has_key?("service")
         name = fields["service"]
         endpoint = @service_manager.lookup_endpoint(name)
@@ -296,7 +434,7 @@ module ROS
           close_connection_after_writing
         elsif endpoint.type_match?(fields["type"], fields["md5sum"])
           endpoint.add_connection(self)
-          send_service_reply(@node_id, fields["type"], fields["md5sum"])
+          send_service_reply(endpoint.caller_id, fields["type"], fields["md5sum"])
           @endpoint = endpoint
         else
           fields = {}
@@ -313,24 +451,28 @@ module ROS
     end
 
     def on_body(data)
+      start = Trace.now if Trace::ENABLED
       num_read = 0
       while data.bytesize >= (num_read + @expected_size)
         case @state
         when :message_length
           @expected_size = data.byteslice(num_read, 4).unpack("V")[0]
           num_read += 4
-          Diag.log(num_read)
+          Diag.log { num_read }
           @state = :message_body
-          Diag.log("message length = #{@expected_size}")
+          Diag.log { "message length = #{@expected_size}" }
         when :message_body
           Diag.log("message_body")
           message = data.byteslice(num_read, @expected_size)
           num_read += @expected_size
-          Diag.log(num_read)
+          Diag.log { num_read }
           @expected_size = 4
           @state = :message_length
           Diag.log("received a message")
+          Trace.record(:receive, @endpoint.name, start) if Trace::ENABLED
           @endpoint.push_request(self, message)
+          # the next message is timed from here, not from the chunk
+          start = Trace.now if Trace::ENABLED
         end
       end
       #Diag.log("end on_body")
@@ -374,7 +516,7 @@ module ROS
       fields["type"] = @client.srv_type::TYPE
       fields["persistent"] = 1 if @persistent
       send_data(TCPROSHeader.make_header(fields))
-      Diag.log("send header #{fields}")
+      Diag.log { "send header #{fields}" }
     end
 
     def on_header(header)
@@ -390,7 +532,7 @@ module ROS
     end
 
     def on_body(data)
-      Diag.log("TCPROSServiceOutboundConnection#on_body")
+      Diag.log { "TCPROSServiceOutboundConnection#on_body" }
       num_read = 0
       while data.bytesize >= (@expected_size + num_read)
         case @state
@@ -398,7 +540,7 @@ module ROS
           ok_byte = data.byteslice(num_read, 1).unpack("C")[0]
           num_read += 1
           @expected_size = 4
-          Diag.log("ok_byte=#{ok_byte}")
+          Diag.log { "ok_byte=#{ok_byte}" }
           if ok_byte == 1
             @state = :message_length
           else
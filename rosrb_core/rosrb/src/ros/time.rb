@@ -1,63 +1,65 @@
 module ROS
+  # Base class of Time and Duration.
+  #
+  # A value is an immutable, frozen object holding a single integer
+  # nanosecond count. secs/nsecs are derived in canonical form
+  # (0 <= nsecs < 1e9), so arithmetic and comparison never normalize.
   class TemporalValue
-    private
+    include Comparable
 
-    def self.canon(secs, nsecs)
-      while nsecs >= 1000000000
-        secs += 1
-        nsecs -= 1000000000
-      end
-      while nsecs < 0
-        secs -= 1
-        nsecs += 1000000000
-      end
-      return secs, nsecs
-    end
+    NSEC_PER_SEC = 1000000000
 
-    public
+    def initialize(_secs=0, _nsecs=0)
+      @nsec = (_secs * NSEC_PER_SEC + _nsecs).round
+      freeze
+    end
 
-    def initialize(_secs, _nsecs)
-      @secs = _secs 
-      @nsecs = _nsecs
+    def secs
+      @nsec / NSEC_PER_SEC
     end
 
-    attr_accessor :secs, :nsecs
+    def nsecs
+      @nsec % NSEC_PER_SEC
+    end
 
     def zero?
-      @secs == 0 and @nsecs == 0
+      @nsec == 0
+    end
+
+    def to_sec
+      @nsec / 1e9
     end
 
-    def set!(_secs, _nsecs)
-      @secs = _secs
-      @nsecs = _nsecs
+    def to_nsec
+      @nsec
     end
 
-    def canon!
-      @secs, @nsecs = canon(@secs, @nsecs)
+    def <=> (other)
+      return nil unless other.class == self.class
+      @nsec <=> other.to_nsec
     end
 
-    def to_sec
-      @secs + @nsecs / 1e9
+    def eql?(other)
+      other.class == self.class and @nsec == other.to_nsec
     end
 
-    def to_nsec
-      (@secs * 1e9).to_i + @nsecs
+    def hash
+      @nsec.hash ^ self.class.hash
     end
   end
 
   class Time < TemporalValue
-    def initialize(_secs=0, _nsecs=0)
-      super(_secs, _nsecs)
-      #if @secs < 0
-      #  raise TypeError("")
+    def self.from_sec(float_secs)
+      ROS::Time.new(0, (float_secs * 1e9).round)
     end
 
-    def self.from_sec(float_secs)
+    def self.from_nsec(nsecs)
+      ROS::Time.new(0, nsecs)
     end
 
     def + (other)
       if Duration === other
-        ROS::Time.new(self.secs + other.secs, self.nsecs + other.nsecs)
+        ROS::Time.new(0, @nsec + other.to_nsec)
       else
         raise NotImplementedError
       end
@@ -65,85 +67,39 @@ module ROS
 
     def - (other)
       if ROS::Time === other
-        Duration.new(self.secs - other.secs, self.nsecs - other.nsecs)
+        Duration.new(0, @nsec - other.to_nsec)
       elsif Duration === other
-        ROS::Time.new(self.secs - other.secs, self.nsecs - other.nsecs)
+        ROS::Time.new(0, @nsec - other.to_nsec)
       else
         raise NotImplementedError
       end
     end
 
-    def <=> (other)
-      if not ROS::Time === other
-        return nil
-      end
-      nsec_diff = self.to_nsec() - other.to_nsec()
-      if nsec_diff == 0
-        return 0
-      elsif nsec_diff > 0
-        return 1
-      else
-        return -1
-      end
-    end
-
-    def < (other)
-      cmp = self <=> other
-      cmp < 0
-    end
-
-    def <= (other)
-      cmp = self <=> other
-      cmp <= 0
-    end
-
-    def > (other)
-      cmp = self <=> other
-      cmp > 0
-    end
-
-    def >= (other)
-      cmp = self <=> other
-      cmp >= 0
-    end
-
-    def == (other)
-      cmp = self <=> other
-      cmp == 0
-    end
-
-    def != (other)
-      cmp = self <=> other
-      cmp != 0
-    end
-
     def to_s
       "#<ROS::Time secs=#{self.secs} nsecs=#{self.nsecs}>"
     end
+
+    ZERO = ROS::Time.new
   end
 
   class Duration < TemporalValue
-
-    def initialize(_secs=0, _nsecs=0)
-      super(_secs, _nsecs)
+    def self.from_sec(float_secs)
+      Duration.new(0, (float_secs * 1e9).round)
     end
 
-    def self.from_sec(float_secs)
-      _secs = float_secs.floor
-      _nsecs = ((float_secs - _secs) * 1000000000).floor
-      Duration.new(_secs, _nsecs)
+    def self.from_nsec(nsecs)
+      Duration.new(0, nsecs)
     end
 
     def -@
-      @secs = -@secs
-      @nsecs = -@nsecs
+      Duration.new(0, -@nsec)
     end
 
     def + (other)
       if ROS::Time === other
-        return  other + self
-      elsif Duraiton === other
-        return Duration.new(self.secs + other.secs, self.nsecs + other.nsecs)
+        return other + self
+      elsif Duration === other
+        return Duration.new(0, @nsec + other.to_nsec)
       else
         raise NotImplementedError
       end
@@ -153,14 +109,14 @@ module ROS
       if not Duration === other
         raise NotImplementedError
       end
-      Duration.new(self.secs - other.secs, self.nsecs - other.nsecs)
+      Duration.new(0, @nsec - other.to_nsec)
     end
 
     def * (other)
       if Integer === other
-        Duration.new(self.secs * other, self.nsecs * other)
-      elsif Float === Float
-        Duration.from_sec(self.to_sec / other)
+        Duration.new(0, @nsec * other)
+      elsif Float === other
+        Duration.new(0, (@nsec * other).round)
       else
         raise NotImplementedError
       end
@@ -168,89 +124,52 @@ module ROS
 
     def / (other)
       if Integer === other
-        Duration.new(self.secs / other, self.nsecs / other)
+        Duration.new(0, @nsec / other)
       elsif Float === other
-        Duration.from_sec(self.to_sec / other)
+        Duration.new(0, (@nsec / other).round)
       else
         raise NotImplementedError
       end
     end
 
-    def <=> (other)
-      if not Duration === other
-        return nil
-      end
-      nsec_diff = self.to_nsec() - other.to_nsec()
-      if nsec_diff == 0
-        return 0
-      elsif nsec_diff > 0
-        return 1
-      else
-        return -1
-      end
-    end
-
-    def < (other)
-      cmp = self <=> other
-      cmp < 0
-    end
-
-    def <= (other)
-      cmp = self <=> other
-      cmp <= 0
-    end
-
-    def > (other)
-      cmp = self <=> other
-      cmp > 0
-    end
-
-    def >= (other)
-      cmp = self <=> other
-      cmp >= 0
-    end
-
-    def == (other)
-      cmp = self <=> other
-      cmp == 0
-    end
-
-    def != (other)
-      cmp = self <=> other
-      cmp != 0
-    end
-
     def to_s
       "#<ROS::Duration secs=#{self.secs} nsecs=#{self.nsecs}>"
     end
+
+    ZERO = Duration.new
   end
 
+  # Sleep at a fixed rate.
+  # Wake up times are multiples of the period, so the rate does not drift
+  # with the time spent between sleeps.
   class Rate
     def initialize(node, hz)
       @node = node
-      @last_time = ROS.get_rostime()
-      @sleep_dur = Duration.new(0, (1e9/hz).floor)
+      @period = (1e9 / hz).round
+      now = @node.get_rostime
+      @last_time = now && now.to_nsec
     end
 
     def sleep
-      curr_time = @node.get_rostime()
-      if @last_time > curr_time
-        @last_time = curr_time
-      end
-      elapsed = curr_time - @last_time
-      if elapsed > @sleep_dur
-        @last_time = curr_time
+      now = @node.get_rostime
+      now = now ? now.to_nsec : 0
+      @last_time ||= now
+      # time moved backwards (e.g. a looped bag file)
+      @last_time = now if @last_time > now
+      expected = @last_time + @period
+      if now >= expected + @period
+        # overrun by more than a period. skip missed ticks.
+        @last_time = now
       else
-        sleep_time = (@sleep_dur - elapsed).to_sec
-        ::Kernel.sleep(sleep_time)
-        @last_time = @last_time + @sleep_dur
+        @node.sleep_until(expected)
+        @last_time = expected
       end
     end
   end
 
   def self.get_walltime
     t = ::Time.now
-    return ROS::Time.new(t.sec, t.nsec)
+    return ROS::Time.new(t.tv_sec, t.tv_nsec)
   end
 
   def self.wall_sleep(secs)
@@ -1,53 +1,263 @@
+require 'thread'
 require 'ros/time'
 
 module ROS
+  # Timing information passed to timer callbacks.
   class TimeEvent
-    def initialize(period)
-      @last_expected = ROS.get_walltime() + period
-      @last_real = ROS.get_walltime()
-      @current_expected = nil
-      @current_real = nil
-      @last_duration = nil
+    # @param [ROS::Time] last_expected time the previous callback was expected to be called
+    # @param [ROS::Time] last_real time the previous callback was actually called
+    # @param [ROS::Time] current_expected time the current callback was expected to be called
+    # @param [ROS::Time] current_real time the current callback was actually called
+    # @param [ROS::Duration] last_duration duration of the previous callback
+    def initialize(last_expected, last_real, current_expected, current_real, last_duration)
+      @last_expected = last_expected
+      @last_real = last_real
+      @current_expected = current_expected
+      @current_real = current_real
+      @last_duration = last_duration
     end
 
     attr_accessor :last_expected, :last_real, :current_expected, :current_real, :last_duration
   end
 
   class Timer
-    # Periodic timer 
-    # @note Only support walltime currently
-    # @param [Numeric]
-    # @param [Hash] 
-    # @param [Proc] block timer callback
-    def initialize(period, options, &block)
-      oneshot = (options[:oneshot] or false)
-      @period = Duration.new(period)
-      @event = TimeEvent.new(@period)
-
-      operation = proc do
-        EM.defer do
-          @event.current_expected = @event.last_real + @period
-          @event.current_real = ROS.get_walltime()
-          start_time = ROS.get_walltime()
-          block.call(@event)
-          end_time = ROS.get_walltime()
-          @event.last_expected = @event.current_expected
-          @event.last_real = @event.current_real
-          @event.last_duration = end_time - start_time
-        end
+    # Periodic timer
+    # @param [TimerScheduler] scheduler scheduler running this timer
+    # @param [Numeric, ROS::Duration] period period in seconds
+    # @param [Hash] options
+    #   :oneshot  fire only once (default false)
+    #   :catch_up call missed ticks back to back after an overrun instead of
+    #             skipping them (default false)
+    # @param [Proc] block timer callback receiving a TimeEvent
+    def initialize(scheduler, period, options, block)
+      @scheduler = scheduler
+      if Duration === period
+        @period = period.to_nsec
+      else
+        @period = (period * 1000000000).round
+      end
+      raise ArgumentError.new("Timer period must be positive.") unless @period > 0
+      @oneshot = (options[:oneshot] or false)
+      @catch_up = (options[:catch_up] or false)
+      @block = block
+      @last_expected = nil
+      @last_real = nil
+      @last_duration = nil
+      @next_expected = nil
+      @cancelled = false
+    end
+
+    attr_reader :period, :next_expected
+
+    def oneshot?
+      @oneshot
+    end
+
+    def cancelled?
+      @cancelled
+    end
+
+    # Schedule the first tick one period after now.
+    def start(now)
+      @next_expected = now + @period
+      @scheduler.add(self)
+    end
+
+    def shutdown
+      @cancelled = true
+      @scheduler.remove(self)
+    end
+
+    # Called from the scheduler thread.
+    # @param [Integer] now current time in nanoseconds
+    def fire(now)
+      expected = @next_expected
+      event = TimeEvent.new(@last_expected && ROS::Time.from_nsec(@last_expected),
+                            @last_real && ROS::Time.from_nsec(@last_real),
+                            ROS::Time.from_nsec(expected),
+                            ROS::Time.from_nsec(now),
+                            @last_duration && Duration.from_nsec(@last_duration))
+      begin
+        @block.call(event)
+      rescue => e
+        $stderr.write("Exception in timer callback: #{e}\n")
       end
+      done = @scheduler.now_nsec || now
+      @last_expected = expected
+      @last_real = now
+      @last_duration = done - now
 
-      EM.next_tick do
-        if oneshot 
-          @timer = EM.add_timer(period, operation)
-        else
-          @timer = EM.add_periodic_timer(period, operation)
+      # Drift free: ticks are always multiples of the period from the start.
+      @next_expected = expected + @period
+      if not @catch_up and @next_expected <= done
+        missed = (done - @next_expected) / @period + 1
+        @next_expected += missed * @period
+      end
+    end
+  end
+
+  # Schedule timers of a node on a dedicated thread.
+  #
+  # Timers are kept in a binary heap ordered by their next expected time and
+  # fired in order, so callbacks of a node never run concurrently.
+  # With /use_simtime the scheduler is driven by /clock updates instead of
+  # the wall clock.
+  class TimerScheduler
+    def initialize(node)
+      @node = node
+      @mutex = Mutex.new
+      @cond = ConditionVariable.new
+      @heap = []
+      @seq = 0
+      @running = true
+      @thread = nil
+    end
+
+    # @return [Integer] current ROS time in nanoseconds, nil if sim time is not received yet
+    def now_nsec
+      time = @node.get_rostime
+      time && time.to_nsec
+    end
+
+    def add(timer)
+      @mutex.synchronize do
+        push(timer)
+        @thread ||= Thread.new { run }
+        @cond.broadcast
+      end
+    end
+
+    def remove(timer)
+      @mutex.synchronize do
+        @heap.delete_if { |entry| entry[2].equal?(timer) }
+        heapify
+        @cond.broadcast
+      end
+    end
+
+    # Notify that sim time is updated. Called from the event thread.
+    def clock_updated
+      @mutex.synchronize do
+        @cond.broadcast
+      end
+    end
+
+    # Block until ROS time reaches time.
+    # @param [Integer] time in nanoseconds
+    # @return [Boolean] false if the scheduler is shut down
+    def wait_until(time)
+      @mutex.synchronize do
+        while @running
+          now = now_nsec
+          return true if now and now >= time
+          wait(now && time - now)
         end
+        false
       end
     end
 
     def shutdown
-      @timer.cancel
+      thread = nil
+      @mutex.synchronize do
+        @running = false
+        @heap = []
+        @cond.broadcast
+        thread = @thread
+      end
+      thread.join if thread and thread != Thread.current
+    end
+
+    private
+
+    def run
+      loop do
+        timer, now = next_due
+        break unless timer
+        timer.fire(now)
+        @mutex.synchronize do
+          push(timer) unless timer.oneshot? or timer.cancelled? or not @running
+        end
+      end
+    end
+
+    # Wait for the earliest timer to be due and pop it.
+    # @return [Array] [timer, now] or nil on shutdown
+    def next_due
+      @mutex.synchronize do
+        while @running
+          if @heap.empty?
+            wait(nil)
+            next
+          end
+          deadline, seq, timer = @heap[0]
+          now = now_nsec
+          if now and now >= deadline
+            pop
+            return [timer, now]
+          end
+          wait(now && deadline - now)
+        end
+        nil
+      end
+    end
+
+    # Wall time waits with a timeout. Sim time waits for the next /clock.
+    def wait(timeout)
+      if timeout and not @node.use_simtime?
+        @cond.wait(@mutex, timeout / 1e9)
+      else
+        @cond.wait(@mutex)
+      end
+    end
+
+    def push(timer)
+      @seq += 1
+      @heap.push([timer.next_expected, @seq, timer])
+      sift_up(@heap.length - 1)
+    end
+
+    def pop
+      top = @heap[0]
+      last = @heap.pop
+      unless @heap.empty?
+        @heap[0] = last
+        sift_down(0)
+      end
+      top
+    end
+
+    def heapify
+      (@heap.length / 2 - 1).downto(0) { |i| sift_down(i) }
+    end
+
+    # Ties are broken by insertion order.
+    def less?(a, b)
+      x = @heap[a]
+      y = @heap[b]
+      x[0] < y[0] or (x[0] == y[0] and x[1] < y[1])
+    end
+
+    def sift_up(i)
+      while i > 0
+        parent = (i - 1) / 2
+        break unless less?(i, parent)
+        @heap[i], @heap[parent] = @heap[parent], @heap[i]
+        i = parent
+      end
+    end
+
+    def sift_down(i)
+      n = @heap.length
+      loop do
+        smallest = i
+        left = 2 * i + 1
+        right = left + 1
+        smallest = left if left < n and less?(left, smallest)
+        smallest = right if right < n and less?(right, smallest)
+        break if smallest == i
+        @heap[i], @heap[smallest] = @heap[smallest], @heap[i]
+        i = smallest
+      end
     end
   end
 end
@@ -0,0 +1,190 @@
+=begin
+ros/trace.rb
+
+Author:: Aki Ochiai
+License:: BSD License (2 clauses)
+
+=end
+require 'thread'
+
+module ROS
+
+  # Latency histogram with bounded relative error (HDR histogram like).
+  #
+  # Values are recorded as integer nanoseconds. Values below 2**bits are
+  # counted exactly, larger values fall into log-linear buckets: every power
+  # of two range is split into 2**(bits-1) linear sub buckets, so the relative
+  # error of reported percentiles is below 1/2**(bits-1).
+  class LatencyHistogram
+    # @param [Integer] bits precision of sub buckets
+    def initialize(bits=7)
+      @bits = bits
+      @half = 1 << (bits - 1)
+      @exact = 1 << bits
+      @mutex = Mutex.new
+      reset
+    end
+
+    attr_reader :count, :min, :max, :sum
+
+    def reset
+      @mutex.synchronize do
+        @counts = []
+        @count = 0
+        @min = nil
+        @max = nil
+        @sum = 0
+      end
+    end
+
+    # @param [Integer] value latency in nanoseconds
+    def record(value)
+      value = 0 if value < 0
+      index = bucket_index(value)
+      @mutex.synchronize do
+        @counts[index] = (@counts[index] or 0) + 1
+        @count += 1
+        @sum += value
+        @min = value if @min.nil? or value < @min
+        @max = value if @max.nil? or value > @max
+      end
+    end
+
+    # @return [Float] mean value in nanoseconds
+    def mean
+      return 0.0 if @count == 0
+      @sum.to_f / @count
+    end
+
+    # @param [Numeric] percent percentile in [0, 100]
+    # @return [Integer] highest value equivalent to the percentile in nanoseconds
+    def percentile(percent)
+      @mutex.synchronize do
+        return 0 if @count == 0
+        target = (@count * percent / 100.0).ceil
+        target = 1 if target < 1
+        seen = 0
+        @counts.each_with_index do |n, index|
+          next if n.nil?
+          seen += n
+          if seen >= target
+            value = bucket_highest(index)
+            return value > @max ? @max : value
+          end
+        end
+        @max
+      end
+    end
+
+    # @return [Hash] summary of recorded values (in seconds)
+    def summary
+      { :count => @count,
+        :min => (@min or 0) / 1e9,
+        :mean => mean / 1e9,
+        :p50 => percentile(50) / 1e9,
+        :p90 => percentile(90) / 1e9,
+        :p99 => percentile(99) / 1e9,
+        :p999 => percentile(99.9) / 1e9,
+        :max => (@max or 0) / 1e9 }
+    end
+
+    private
+
+    def bucket_index(value)
+      return value if value < @exact
+      shift = value.bit_length - @bits
+      (shift + 1) * @half + (value >> shift) - @half
+    end
+
+    def bucket_highest(index)
+      return index if index < @exact
+      shift = index / @half - 1
+      mantissa = index - shift * @half
+      ((mantissa + 1) << shift) - 1
+    end
+  end
+
+  # Low overhead tracepoints for the message pipeline.
+  #
+  # Tracing is enabled by setting ROSRB_TRACE environment variable before
+  # loading rosrb. Every tracepoint is guarded with Trace::ENABLED, so
+  # disabled tracing costs only a constant lookup.
+  #
+  # Stages:
+  # receive::     framing a message out of the socket buffer
+  # enqueue::     pushing a received message to the callback queue
+  # dequeue::     waiting in the callback queue
+  # deserialize:: deserializing a message
+  # callback::    user callback
+  # serialize::   serializing a message
+  # send::        writing a serialized message to connections
+  #
+  # Histograms are dumped to stderr on SIGUSR1 and served by the slave API
+  # method getLatencyStats.
+  module Trace
+    ENABLED = ENV.has_key?('ROSRB_TRACE')
+
+    STAGES = [:receive, :enqueue, :dequeue, :deserialize, :callback, :serialize, :send]
+
+    @@histograms = {}
+    @@mutex = Mutex.new
+
+    if Process.respond_to?(:clock_gettime)
+      # @return [Integer] monotonic clock in nanoseconds
+      def self.now
+        Process.clock_gettime(Process::CLOCK_MONOTONIC, :nanosecond)
+      end
+    else
+      def self.now
+        t = ::Time.now
+        t.tv_sec * 1000000000 + t.tv_nsec
+      end
+    end
+
+    # Record elapsed time of a stage.
+    # @param [Symbol] stage one of STAGES
+    # @param [String] name topic or service name
+    # @param [Integer] start start time given by Trace.now
+    # @param [Integer] stop stop time given by Trace.now
+    def self.record(stage, name, start, stop=now)
+      histogram(stage, name).record(stop - start)
+    end
+
+    # @return [LatencyHistogram] histogram for the stage of the topic
+    def self.histogram(stage, name)
+      key = [name, stage]
+      hist = @@histograms[key]
+      return hist if hist
+      @@mutex.synchronize do
+        @@histograms[key] ||= LatencyHistogram.new
+      end
+    end
+
+    # @return [Array] [name, stage, count, min, mean, p50, p90, p99, p999, max] rows
+    def self.report
+      histograms = @@mutex.synchronize { @@histograms.dup }
+      histograms.keys.sort_by { |name, stage| [name, STAGES.index(stage)] }.map do |key|
+        name, stage = key
+        s = histograms[key].summary
+        [name, stage.to_s, s[:count], s[:min], s[:mean],
+         s[:p50], s[:p90], s[:p99], s[:p999], s[:max]]
+      end
+    end
+
+    def self.dump(io=$stderr)
+      io.write("%-32s %-12s %10s %12s %12s %12s %12s %12s %12s\n" %
+               ['name', 'stage', 'count', 'mean[us]', 'p50[us]', 'p90[us]', 'p99[us]', 'p999[us]', 'max[us]'])
+      report.each do |name, stage, count, min, mean, p50, p90, p99, p999, max|
+        io.write("%-32s %-12s %10d %12.1f %12.1f %12.1f %12.1f %12.1f %12.1f\n" %
+                 [name, stage, count, mean * 1e6, p50 * 1e6, p90 * 1e6, p99 * 1e6, p999 * 1e6, max * 1e6])
+      end
+      io.flush
+    end
+
+    def self.reset
+      @@mutex.synchronize do
+        @@histograms.each_value { |hist| hist.reset }
+      end
+    end
+  end
+end
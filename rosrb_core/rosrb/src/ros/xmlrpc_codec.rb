@@ -0,0 +1,204 @@
+require 'strscan'
+require 'ros/exceptions'
+
+module ROS
+  # Single pass XMLRPC codec for the slave API.
+  #
+  # A methodCall is parsed directly into ruby values with a StringScanner,
+  # without building a DOM, and responses are encoded by string
+  # concatenation. Value types are the ones the ROS APIs use: int/i4,
+  # boolean, string (or untyped), double, base64, array and struct.
+  module XMLRPCCodec
+    TAG = /<(\/?)([A-Za-z0-9_.:-]+)\s*(\/?)>/
+    SPACE = /(?:\s+|<\?.*?\?>|<!--.*?-->)+/m
+    TEXT = /[^<]*/
+    ENTITY = /&(#x[0-9a-fA-F]+|#[0-9]+|lt|gt|amp|quot|apos);/
+    ENTITIES = { 'lt' => '<', 'gt' => '>', 'amp' => '&', 'quot' => '"', 'apos' => "'" }
+    ESCAPES = { '&' => '&amp;', '<' => '&lt;', '>' => '&gt;' }
+    INT_RANGE = -2**31..2**31 - 1
+
+    # @param [String] data XML document of a methodCall
+    # @return [Array] [method_name, params]
+    def self.parse_call(data)
+      s = StringScanner.new(data.dup.force_encoding(Encoding::UTF_8))
+      expect(s, :open, 'methodCall')
+      expect(s, :open, 'methodName')
+      name = unescape(s.scan(TEXT)).strip
+      expect(s, :close, 'methodName')
+      params = []
+      kind, tag = next_tag(s)
+      if kind == :open and tag == 'params'
+        loop do
+          kind, tag = next_tag(s)
+          break if kind == :close and tag == 'params'
+          raise ROSError.new("XMLRPC: <param> expected, got <#{tag}>.") unless kind == :open and tag == 'param'
+          expect(s, :open, 'value')
+          params.push(parse_value(s))
+          expect(s, :close, 'param')
+        end
+        kind, tag = next_tag(s)
+      elsif kind == :empty and tag == 'params'
+        kind, tag = next_tag(s)
+      end
+      raise ROSError.new("XMLRPC: </methodCall> expected.") unless kind == :close and tag == 'methodCall'
+      [name, params]
+    end
+
+    # @return [String] methodResponse document of a value
+    def self.encode_response(value)
+      out = "<?xml version=\"1.0\"?>\n<methodResponse><params><param>"
+      encode_value(value, out)
+      out << "</param></params></methodResponse>\n"
+    end
+
+    # @return [String] methodResponse document of a fault
+    def self.encode_fault(code, message)
+      out = "<?xml version=\"1.0\"?>\n<methodResponse><fault>"
+      encode_value({ 'faultCode' => code, 'faultString' => message }, out)
+      out << "</fault></methodResponse>\n"
+    end
+
+    def self.encode_value(value, out)
+      out << '<value>'
+      case value
+      when Integer
+        raise ROSError.new("XMLRPC: #{value} is out of int range.") unless INT_RANGE.include?(value)
+        out << '<i4>' << value.to_s << '</i4>'
+      when true
+        out << '<boolean>1</boolean>'
+      when false
+        out << '<boolean>0</boolean>'
+      when Float
+        out << '<double>' << value.to_s << '</double>'
+      when String, Symbol
+        out << '<string>' << escape(value.to_s) << '</string>'
+      when Array
+        out << '<array><data>'
+        value.each { |v| encode_value(v, out) }
+        out << '</data></array>'
+      when Hash
+        out << '<struct>'
+        value.each do |k, v|
+          out << '<member><name>' << escape(k.to_s) << '</name>'
+          encode_value(v, out)
+          out << '</member>'
+        end
+        out << '</struct>'
+      else
+        raise ROSError.new("XMLRPC: cannot encode #{value.class}.")
+      end
+      out << '</value>'
+    end
+
+    # Parse the content of <value> and its closing tag.
+    def self.parse_value(s)
+      text = s.scan(TEXT)
+      kind, tag = next_tag(s)
+      # untyped value is a string
+      return unescape(text) if kind == :close and tag == 'value'
+      raise ROSError.new("XMLRPC: unexpected </#{tag}>.") if kind == :close
+      if kind == :empty
+        value = case tag
+                when 'string' then ""
+                when 'array' then []
+                when 'struct' then {}
+                when 'nil' then nil
+                else raise ROSError.new("XMLRPC: empty <#{tag}/>.")
+                end
+      else
+        value = case tag
+                when 'int', 'i4', 'i8'
+                  Integer(s.scan(TEXT).strip, 10)
+                when 'boolean'
+                  s.scan(TEXT).strip == '1'
+                when 'double'
+                  Float(s.scan(TEXT).strip)
+                when 'string', 'dateTime.iso8601'
+                  unescape(s.scan(TEXT))
+                when 'base64'
+                  s.scan(TEXT).unpack('m')[0]
+                when 'nil'
+                  nil
+                when 'array'
+                  parse_array(s)
+                when 'struct'
+                  parse_struct(s)
+                else
+                  raise ROSError.new("XMLRPC: unknown type <#{tag}>.")
+                end
+        expect(s, :close, tag)
+      end
+      expect(s, :close, 'value')
+      value
+    end
+
+    def self.parse_array(s)
+      values = []
+      kind, tag = next_tag(s)
+      return values if kind == :empty and tag == 'data'
+      raise ROSError.new("XMLRPC: <data> expected.") unless kind == :open and tag == 'data'
+      loop do
+        kind, tag = next_tag(s)
+        break if kind == :close and tag == 'data'
+        raise ROSError.new("XMLRPC: <value> expected in <data>.") unless kind == :open and tag == 'value'
+        values.push(parse_value(s))
+      end
+      values
+    end
+
+    def self.parse_struct(s)
+      members = {}
+      loop do
+        kind, tag = next_tag(s)
+        if kind == :close and tag == 'struct'
+          s.unscan
+          break
+        end
+        raise ROSError.new("XMLRPC: <member> expected.") unless kind == :open and tag == 'member'
+        expect(s, :open, 'name')
+        key = unescape(s.scan(TEXT))
+        expect(s, :close, 'name')
+        expect(s, :open, 'value')
+        members[key] = parse_value(s)
+        expect(s, :close, 'member')
+      end
+      members
+    end
+
+    # @return [Array] [kind, name] of the next tag, kind is :open, :close or :empty
+    def self.next_tag(s)
+      s.skip(SPACE)
+      raise ROSError.new("XMLRPC: tag expected at #{s.pos}.") unless s.scan(TAG)
+      if s[1] == '/'
+        [:close, s[2]]
+      elsif s[3] == '/'
+        [:empty, s[2]]
+      else
+        [:open, s[2]]
+      end
+    end
+
+    def self.expect(s, kind, name)
+      actual_kind, actual_name = next_tag(s)
+      unless actual_kind == kind and actual_name == name
+        raise ROSError.new("XMLRPC: #{kind} #{name} expected, got #{actual_kind} #{actual_name}.")
+      end
+    end
+
+    def self.unescape(text)
+      return text unless text.include?('&')
+      text.gsub(ENTITY) do
+        entity = $1
+        if entity[0] == '#'
+          (entity[1] == 'x' ? entity[2..-1].to_i(16) : entity[1..-1].to_i).chr(Encoding::UTF_8)
+        else
+          ENTITIES[entity]
+        end
+      end
+    end
+
+    def self.escape(text)
+      text.gsub(/[&<>]/, ESCAPES)
+    end
+  end
+end
@@ -0,0 +1,148 @@
+#!/usr/bin/env ruby
+#
+# Size and load time of generated message classes with shared
+# serialize_into/deserialize_from methods, against the nested code inlined
+# into every outer class (msg_gen.py --inline-nested).
+#
+# Generate the messages of the types and their dependencies, including
+# rosgraph_msgs and std_msgs that rosrb itself requires, twice:
+#
+#   rosrun rosrb genmsg_rb.py --output-dir /tmp/rosrb_shared MSG_FILES
+#   rosrun rosrb genmsg_rb.py --generate-root --output-dir /tmp/rosrb_shared MSG_FILES
+#   rosrun rosrb genmsg_rb.py --inline-nested --output-dir /tmp/rosrb_inlined MSG_FILES
+#   rosrun rosrb genmsg_rb.py --inline-nested --generate-root --output-dir /tmp/rosrb_inlined MSG_FILES
+#   ruby bench/bench_codegen.rb /tmp/rosrb_inlined /tmp/rosrb_shared nav_msgs/Odometry
+#
+# For each tree this reports the bytes and lines of all generated files,
+# the bytes of the files of the types, the time to require them in a fresh
+# ruby process (best of --runs), and serialize/deserialize throughput of
+# default messages. A child process fails if a message is loaded from
+# outside its tree, e.g. from ~/.ros/rosrb_gen.
+#
+# Options:
+#   --runs N          ruby processes per tree to time loading (default 5)
+#   --min-time SEC    minimum seconds to time each serializer case (default 0.5)
+#   --output FILE     write results as YAML to FILE
+#
+require 'optparse'
+require 'yaml'
+require 'stringio'
+require 'rbconfig'
+
+DEFAULT_TYPES = ['nav_msgs/Odometry', 'visualization_msgs/MarkerArray']
+
+options = {:runs => 5, :min_time => 0.5, :output => nil, :child => false}
+OptionParser.new do |opts|
+  opts.banner = "Usage: bench_codegen.rb [options] INLINED_DIR SHARED_DIR [TYPE ...]"
+  opts.on("--runs N", Integer) { |v| options[:runs] = v }
+  opts.on("--min-time SEC", Float) { |v| options[:min_time] = v }
+  opts.on("--output FILE") { |v| options[:output] = v }
+  opts.on("--child") { options[:child] = true }
+end.parse!
+
+# 'sensor_msgs/LaserScan' => SensorMsgs::Msg::LaserScan
+def message_class(type)
+  pkg, name = type.split('/')
+  module_name = pkg.split('_').map { |w| w.capitalize }.join
+  Object.const_get(module_name).const_get(:Msg).const_get(name)
+end
+
+def measure(min_time)
+  n = 1
+  loop do
+    start = Time.now
+    n.times { yield }
+    elapsed = Time.now - start
+    return elapsed / n if elapsed >= min_time
+    n *= 2
+  end
+end
+
+# Run in a fresh process with a generated tree at the head of $LOAD_PATH.
+if options[:child]
+  dir = File.expand_path(ARGV.shift)
+  # before the messages required by ros, and again before ~/.ros/rosrb_gen
+  # which ros.rb puts at the head of $LOAD_PATH
+  $LOAD_PATH.unshift(dir)
+  require 'ros'
+  $LOAD_PATH.delete(dir)
+  $LOAD_PATH.unshift(dir)
+  result = {}
+  start = Time.now
+  ARGV.each { |type| require "#{type.split('/')[0]}/msg" }
+  result['load_sec'] = Time.now - start
+  stray = $LOADED_FEATURES.grep(%r{/msg/_[^/]+\.rb\z}).reject { |f| f.start_with?(dir + '/') }
+  abort("messages loaded from outside #{dir}: #{stray.join(' ')}") unless stray.empty?
+  unless options[:min_time] == 0
+    ARGV.each do |type|
+      cls = message_class(type)
+      msg = cls.new
+      sio = StringIO.new
+      msg.serialize(sio)
+      data = sio.string
+      result[type] = {
+        'serialize_sec' => measure(options[:min_time]) { msg.serialize(StringIO.new) },
+        'deserialize_sec' => measure(options[:min_time]) { cls.new.deserialize(data) },
+      }
+    end
+  end
+  print result.to_yaml
+  exit 0
+end
+
+inlined_dir = ARGV.shift or abort("directory of inlined messages is required.")
+shared_dir = ARGV.shift or abort("directory of shared messages is required.")
+types = ARGV.empty? ? DEFAULT_TYPES : ARGV
+
+# @return [Hash] bytes and lines of the tree and bytes of the files of types
+def source_size(dir, types)
+  files = Dir.glob(File.join(dir, '*', 'msg', '_*.rb'))
+  bytes = 0
+  lines = 0
+  files.each do |file|
+    data = File.open(file, 'rb') { |f| f.read }
+    bytes += data.bytesize
+    lines += data.count("\n")
+  end
+  type_files = types.map do |type|
+    pkg, name = type.split('/')
+    File.join(dir, pkg, 'msg', "_#{name}.rb")
+  end
+  type_bytes = type_files.map { |file| File.size(file) }.inject(0) { |a, b| a + b }
+  { 'files' => files.length, 'bytes' => bytes, 'lines' => lines, 'type_bytes' => type_bytes }
+end
+
+def run_child(dir, types, min_time)
+  cmd = [RbConfig.ruby, __FILE__, '--child', '--min-time', min_time.to_s, dir] + types
+  out = IO.popen(cmd) { |io| io.read }
+  raise "#{cmd.join(' ')} failed" unless $?.success?
+  YAML.load(out)
+end
+
+results = {}
+[['inlined', inlined_dir], ['shared', shared_dir]].each do |label, dir|
+  loads = (1..options[:runs]).map { run_child(dir, types, 0)['load_sec'] }
+  codec = run_child(dir, types, options[:min_time])
+  codec.delete('load_sec')
+  results[label] = source_size(dir, types).merge('load_sec' => loads.min, 'codec' => codec)
+end
+
+printf("%-8s %6s %10s %8s %12s %10s\n", "tree", "files", "bytes", "lines", "type bytes", "load[ms]")
+results.each do |label, r|
+  printf("%-8s %6d %10d %8d %12d %10.2f\n", label, r['files'], r['bytes'], r['lines'],
+         r['type_bytes'], r['load_sec'] * 1e3)
+end
+puts
+printf("%-32s %-8s %12s %12s\n", "type", "tree", "ser[msg/s]", "deser[msg/s]")
+types.each do |type|
+  results.each do |label, r|
+    c = r['codec'][type]
+    printf("%-32s %-8s %12.1f %12.1f\n", type, label, 1 / c['serialize_sec'], 1 / c['deserialize_sec'])
+  end
+end
+
+report = { 'ruby' => "#{RUBY_VERSION}p#{RUBY_PATCHLEVEL}",
+           'date' => Time.now.utc.strftime('%Y-%m-%dT%H:%M:%SZ'),
+           'types' => types,
+           'results' => results }
+File.open(options[:output], 'w') { |f| f.write(report.to_yaml) } if options[:output]
@@ -0,0 +1,151 @@
+#!/usr/bin/env ruby
+#
+# Serializer benchmark and conformance check of generated message classes.
+#
+# Generate the corpus with rospy first:
+#
+#   python test/dump_fixture.py --corpus /tmp/rosrb_corpus
+#   ruby bench/bench_serializer.rb /tmp/rosrb_corpus
+#
+# For every corpus case this checks that deserialize + serialize reproduces
+# the bytes written by rospy, then measures serialize/deserialize throughput,
+# allocations per message and GC runs. Results are compared with
+# serializer_baseline.yaml; a case slower than the tolerance or allocating
+# more objects than the baseline is reported as a regression and the script
+# exits with status 1. Without a baseline, or with a case missing from it,
+# the script fails as well; record one on the benchmark machine with
+# --save-baseline.
+#
+# Options:
+#   --save-baseline    overwrite serializer_baseline.yaml with this run
+#   --output FILE      write results of this run to FILE
+#   --tolerance RATIO  allowed slowdown against the baseline (default 0.2)
+#   --min-time SEC     minimum seconds to time each case (default 0.5)
+#
+require 'optparse'
+require 'yaml'
+require 'stringio'
+require 'ros'
+
+BENCH_DIR = File.expand_path(File.dirname(__FILE__))
+BASELINE = File.join(BENCH_DIR, 'serializer_baseline.yaml')
+
+options = {:tolerance => 0.2, :min_time => 0.5, :save_baseline => false, :output => nil}
+OptionParser.new do |opts|
+  opts.banner = "Usage: bench_serializer.rb [options] CORPUS_DIR"
+  opts.on("--save-baseline") { options[:save_baseline] = true }
+  opts.on("--output FILE") { |v| options[:output] = v }
+  opts.on("--tolerance RATIO", Float) { |v| options[:tolerance] = v }
+  opts.on("--min-time SEC", Float) { |v| options[:min_time] = v }
+end.parse!
+corpus_dir = ARGV.shift or abort("corpus directory is required.")
+
+# 'sensor_msgs/LaserScan' => SensorMsgs::Msg::LaserScan
+def message_class(type)
+  pkg, name = type.split('/')
+  require "#{pkg}/msg"
+  module_name = pkg.split('_').map { |w| w.capitalize }.join
+  Object.const_get(module_name).const_get(:Msg).const_get(name)
+end
+
+def allocations
+  GC.stat[:total_allocated_objects] or 0
+end
+
+# @return [Hash] seconds, allocations and GC runs per call
+def measure(min_time)
+  n = 1
+  loop do
+    GC.start
+    allocs = allocations
+    gc_count = GC.count
+    start = Time.now
+    n.times { yield }
+    elapsed = Time.now - start
+    if elapsed >= min_time
+      return { 'sec' => elapsed / n,
+               'allocs' => (allocations - allocs).to_f / n,
+               'gc' => (GC.count - gc_count).to_f / n }
+    end
+    n *= 2
+  end
+end
+
+corpus = YAML.load_file(File.join(corpus_dir, 'corpus.yaml'))
+if not File.exist?(BASELINE) and not options[:save_baseline]
+  abort("#{BASELINE} is missing. run with --save-baseline to record it.")
+end
+baseline = File.exist?(BASELINE) ? YAML.load_file(BASELINE) : {}
+baseline_cases = (baseline['cases'] or {})
+
+results = {}
+failures = []
+printf("%-20s %10s %12s %12s %10s %10s %8s %8s %8s %8s\n", "case", "bytes", "ser[msg/s]",
+       "deser[msg/s]", "ser alloc", "des alloc", "ser/py", "des/py", "ser/base", "des/base")
+corpus['cases'].each do |c|
+  name = c['name']
+  data = File.open(File.join(corpus_dir, c['file']), 'rb') { |f| f.read }
+  cls = message_class(c['type'])
+
+  msg = cls.new
+  msg.deserialize(data)
+  sio = StringIO.new
+  msg.serialize(sio)
+  unless sio.string.bytes.to_a == data.bytes.to_a
+    failures.push("#{name}: serialized bytes differ from rospy")
+  end
+
+  deser = measure(options[:min_time]) { cls.new.deserialize(data) }
+  ser = measure(options[:min_time]) { msg.serialize(StringIO.new) }
+  result = {
+    'type' => c['type'],
+    'bytes' => data.bytesize,
+    'serialize_sec' => ser['sec'],
+    'deserialize_sec' => deser['sec'],
+    'serialize_allocs' => ser['allocs'],
+    'deserialize_allocs' => deser['allocs'],
+    'serialize_gc' => ser['gc'],
+    'deserialize_gc' => deser['gc'],
+  }
+  results[name] = result
+
+  rospy = c['rospy']
+  ser_vs_py = rospy['serialize_sec'] / ser['sec']
+  deser_vs_py = rospy['deserialize_sec'] / deser['sec']
+  base = baseline_cases[name]
+  if base.nil?
+    failures.push("#{name}: no baseline") unless options[:save_baseline]
+  else
+    ser_vs_base = "%.2fx" % (base['serialize_sec'] / ser['sec'])
+    deser_vs_base = "%.2fx" % (base['deserialize_sec'] / deser['sec'])
+    [['serialize_sec', 'serialize'], ['deserialize_sec', 'deserialize']].each do |key, label|
+      if result[key] > base[key] * (1 + options[:tolerance])
+        failures.push("#{name}: #{label} #{'%.1f' % (result[key] / base[key] * 100)}% of baseline time")
+      end
+    end
+    ['serialize_allocs', 'deserialize_allocs'].each do |key|
+      if result[key] > base[key].ceil
+        failures.push("#{name}: #{key} #{result[key].round} > #{base[key].round}")
+      end
+    end
+  end
+  printf("%-20s %10d %12.1f %12.1f %10.1f %10.1f %7.2fx %7.2fx %8s %8s\n", name, data.bytesize,
+         1 / ser['sec'], 1 / deser['sec'], ser['allocs'], deser['allocs'],
+         ser_vs_py, deser_vs_py, base ? ser_vs_base : "-", base ? deser_vs_base : "-")
+end
+
+report = { 'ruby' => "#{RUBY_VERSION}p#{RUBY_PATCHLEVEL}",
+           'date' => Time.now.utc.strftime('%Y-%m-%dT%H:%M:%SZ'),
+           'cases' => results }
+File.open(options[:output], 'w') { |f| f.write(report.to_yaml) } if options[:output]
+if options[:save_baseline]
+  File.open(BASELINE, 'w') { |f| f.write(report.to_yaml) }
+  puts "baseline saved to #{BASELINE}"
+end
+
+unless failures.empty?
+  puts
+  puts "REGRESSIONS:"
+  failures.each { |f| puts "  #{f}" }
+  exit 1
+end
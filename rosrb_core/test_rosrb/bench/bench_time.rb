@@ -0,0 +1,96 @@
+#!/usr/bin/env ruby
+#
+# Benchmark ROS::Time/ROS::Duration against the previous secs/nsecs pair
+# implementation.
+#
+#   ruby -I $(rospack find rosrb)/src bench_time.rb [iterations]
+#
+require 'benchmark'
+require 'ros/time'
+
+# Previous implementation (separate secs/nsecs, float to_nsec).
+module Legacy
+  class TemporalValue
+    def initialize(_secs, _nsecs)
+      @secs = _secs
+      @nsecs = _nsecs
+    end
+
+    attr_accessor :secs, :nsecs
+
+    def to_nsec
+      (@secs * 1e9).to_i + @nsecs
+    end
+  end
+
+  class Time < TemporalValue
+    def initialize(_secs=0, _nsecs=0)
+      super(_secs, _nsecs)
+    end
+
+    def + (other)
+      Legacy::Time.new(self.secs + other.secs, self.nsecs + other.nsecs)
+    end
+
+    def - (other)
+      if Legacy::Time === other
+        Duration.new(self.secs - other.secs, self.nsecs - other.nsecs)
+      else
+        Legacy::Time.new(self.secs - other.secs, self.nsecs - other.nsecs)
+      end
+    end
+
+    def <=> (other)
+      nsec_diff = self.to_nsec() - other.to_nsec()
+      if nsec_diff == 0
+        return 0
+      elsif nsec_diff > 0
+        return 1
+      else
+        return -1
+      end
+    end
+
+    def < (other)
+      cmp = self <=> other
+      cmp < 0
+    end
+  end
+
+  class Duration < TemporalValue
+    def initialize(_secs=0, _nsecs=0)
+      super(_secs, _nsecs)
+    end
+  end
+end
+
+def allocations
+  return 0 unless GC.respond_to?(:stat)
+  GC.stat[:total_allocated_objects] or 0
+end
+
+def measure(label, n)
+  GC.start
+  before = allocations
+  time = Benchmark.realtime { yield }
+  allocs = allocations - before
+  printf("%-28s %10.1f ns/op %8.2f allocs/op\n", label, time * 1e9 / n, allocs.to_f / n)
+end
+
+n = (ARGV[0] or 1000000).to_i
+
+[[Legacy::Time, Legacy::Duration, "legacy"], [ROS::Time, ROS::Duration, "int64"]].each do |time_class, duration_class, name|
+  t = time_class.new(1350000000, 123456789)
+  u = time_class.new(1350000000, 987654321)
+  d = duration_class.new(0, 1000000)
+  pair = [1350000000, 123456789]
+
+  measure("#{name} new(secs, nsecs)", n) { n.times { time_class.new(*pair) } }
+  measure("#{name} time + duration", n) { n.times { t + d } }
+  measure("#{name} time - time", n) { n.times { u - t } }
+  measure("#{name} time < time", n) { n.times { t < u } }
+  measure("#{name} sort 1000 stamps", 1000) do
+    stamps = (0...1000).map { |i| time_class.new(1350000000 + i % 7, i * 997 % 1000000000) }
+    stamps.sort { |a, b| a <=> b }
+  end
+end
@@ -0,0 +1,272 @@
+#!/usr/bin/env ruby
+#
+# End-to-end pub/sub and service benchmark over TCPROS.
+#
+# All nodes run in this process. Unless --master is given, an in-process
+# master (local_master.rb) is started, so no roscore is needed:
+#
+#   ruby bench/bench_transport.rb --output /tmp/transport.yaml
+#
+# Pub/sub cases publish std_msgs/Header messages whose frame_id is padded
+# to the message size, from one publisher node to FANOUT subscriber nodes.
+# Each case has two phases:
+#
+# throughput:: publish as fast as the slowest subscriber keeps up (at most
+#              a window of messages in flight) and count delivered msgs/bytes.
+# latency::    publish at a fixed rate; the latency of a message is the wall
+#              time between publish and the subscriber callback.
+#
+# Service cases call test_rosrb/AddTwoInts back to back with persistent and
+# non-persistent connections and measure calls/sec and call latency.
+#
+# Options:
+#   --master URI         use a running master instead of the in-process one
+#   --output FILE        write results as YAML to FILE
+#   --duration SEC       seconds of each phase (default 2.0)
+#   --sizes LIST         message sizes in bytes (default 16,1024,65536,1048576)
+#   --fanout LIST        numbers of subscriber nodes (default 1,4)
+#   --rate HZ            publish rate of the latency phase (default 1000)
+#   --window N           max messages in flight in the throughput phase (default 64)
+#   --inline             run subscriber callbacks on the event thread
+#   --pool N             recycle up to N messages per subscription (default 0)
+#   --spin-interval SEC  sleep between spin_once of subscriber nodes (default 0.001)
+#   --shared-servers     create nodes with the :shared_servers option
+#
+require 'optparse'
+require 'yaml'
+require 'ros'
+ROS.load_manifest('test_rosrb')
+
+require 'std_msgs/msg'
+require 'test_rosrb/srv'
+require File.join(File.dirname(__FILE__), 'local_master')
+
+options = { :master => nil, :output => nil, :duration => 2.0,
+            :sizes => [16, 1024, 65536, 1048576], :fanout => [1, 4],
+            :rate => 1000.0, :window => 64, :inline => false, :pool => 0,
+            :spin_interval => 0.001, :shared_servers => false }
+OptionParser.new do |opts|
+  opts.banner = "Usage: bench_transport.rb [options]"
+  opts.on("--master URI") { |v| options[:master] = v }
+  opts.on("--output FILE") { |v| options[:output] = v }
+  opts.on("--duration SEC", Float) { |v| options[:duration] = v }
+  opts.on("--sizes LIST", Array) { |v| options[:sizes] = v.map { |x| Integer(x) } }
+  opts.on("--fanout LIST", Array) { |v| options[:fanout] = v.map { |x| Integer(x) } }
+  opts.on("--rate HZ", Float) { |v| options[:rate] = v }
+  opts.on("--window N", Integer) { |v| options[:window] = v }
+  opts.on("--inline") { options[:inline] = true }
+  opts.on("--pool N", Integer) { |v| options[:pool] = v }
+  opts.on("--spin-interval SEC", Float) { |v| options[:spin_interval] = v }
+  opts.on("--shared-servers") { options[:shared_servers] = true }
+end.parse!
+
+SHARED_SERVERS = options[:shared_servers]
+master = nil
+if options[:master]
+  ENV['ROS_MASTER_URI'] = options[:master]
+else
+  master = ROS::LocalMaster.new.start
+  ENV['ROS_MASTER_URI'] = master.uri
+end
+
+NSEC_PER_SEC = 1000000000
+TIMEOUT = 10.0
+
+def create_node(name)
+  ROS::Node.new(ROS::Resolver.new(name, nil, [], true),
+                {:log_level => ROS::Logger::Level::WARN, :shared_servers => SHARED_SERVERS})
+end
+
+# Spin a node on its own thread, as a separate process would.
+def start_spinner(node, interval)
+  Thread.new do
+    while node.ok?
+      node.spin_once
+      ROS.wall_sleep(interval)
+    end
+  end
+end
+
+def wait_for(timeout=TIMEOUT)
+  deadline = ROS::Trace.now + (timeout * NSEC_PER_SEC).to_i
+  until yield
+    raise "timed out" if ROS::Trace.now > deadline
+    ROS.wall_sleep(0.01)
+  end
+end
+
+def now_nsec
+  ROS.get_walltime.to_nsec
+end
+
+def latency_result(hist)
+  s = hist.summary
+  { 'count' => s[:count], 'mean' => s[:mean], 'p50' => s[:p50], 'p90' => s[:p90],
+    'p99' => s[:p99], 'p999' => s[:p999], 'max' => s[:max] }
+end
+
+# Subscriber side of a pub/sub case.
+class BenchSubscriber
+  def initialize(node, topic, options, hist)
+    @received = 0
+    @bytes = 0
+    @hist = hist
+    @recording = false
+    @node = node
+    sub_options = {:inline => options[:inline], :pool => options[:pool]}
+    node.subscribe(topic, StdMsgs::Msg::Header, sub_options) do |msg|
+      @hist.record(now_nsec - msg.stamp.to_nsec) if @recording
+      @received += 1
+      @bytes += msg.frame_id.bytesize
+    end
+  end
+
+  attr_reader :node, :received, :bytes
+  attr_accessor :recording
+end
+
+def run_pubsub(size, fanout, options)
+  topic = "/bench_transport_#{size}_#{fanout}"
+  pub_node = create_node("bench_pub")
+  sub_nodes = (1..fanout).map { create_node("bench_sub") }
+  hist = ROS::LatencyHistogram.new
+  subs = sub_nodes.map { |node| BenchSubscriber.new(node, topic, options, hist) }
+  spinners = options[:inline] ? [] : sub_nodes.map { |node| start_spinner(node, options[:spin_interval]) }
+  pub = pub_node.advertise(topic, StdMsgs::Msg::Header, {})
+  wait_for { pub.num_subscribers == fanout }
+
+  msg = StdMsgs::Msg::Header.new
+  msg.frame_id = 'x' * size
+  # message overhead: seq, stamp and string length
+  msg_bytes = size + 16
+  window = options[:window]
+  duration = (options[:duration] * NSEC_PER_SEC).to_i
+
+  # warm up connections
+  published = 0
+  lowest = proc { subs.map { |s| s.received }.min }
+  while published < 10
+    msg.stamp = ROS.get_walltime
+    pub.publish(msg)
+    published += 1
+  end
+  wait_for { lowest.call >= published }
+
+  # throughput
+  start_count = subs.map { |s| s.received }.inject(0) { |a, b| a + b }
+  start = ROS::Trace.now
+  deadline = start + duration
+  while ROS::Trace.now < deadline
+    if published - lowest.call < window
+      msg.stamp = ROS.get_walltime
+      pub.publish(msg)
+      published += 1
+    else
+      Thread.pass
+    end
+  end
+  wait_for { lowest.call >= published }
+  elapsed = (ROS::Trace.now - start) / 1e9
+  delivered = subs.map { |s| s.received }.inject(0) { |a, b| a + b } - start_count
+  throughput = { 'msgs_per_sec' => delivered / elapsed,
+                 'bytes_per_sec' => delivered * msg_bytes / elapsed,
+                 'publish_per_sec' => delivered / fanout / elapsed,
+                 'delivered' => delivered }
+
+  # latency at a fixed rate
+  subs.each { |s| s.recording = true }
+  period = (NSEC_PER_SEC / options[:rate]).to_i
+  next_time = ROS::Trace.now
+  deadline = next_time + duration
+  sent = 0
+  while next_time < deadline
+    wait = next_time - ROS::Trace.now
+    ROS.wall_sleep(wait / 1e9) if wait > 0
+    if published - lowest.call < window
+      msg.stamp = ROS.get_walltime
+      pub.publish(msg)
+      published += 1
+      sent += 1
+    end
+    next_time += period
+  end
+  wait_for { lowest.call >= published }
+  latency = latency_result(hist)
+  latency['rate'] = sent / options[:duration]
+
+  ([pub_node] + sub_nodes).each { |node| node.signal_shutdown }
+  spinners.each { |t| t.join }
+  { 'size' => size, 'bytes' => msg_bytes, 'fanout' => fanout, 'inline' => options[:inline],
+    'pool' => options[:pool],
+    'throughput' => throughput, 'latency' => latency }
+end
+
+def run_service(persistent, options)
+  service = "/bench_transport_add_two_ints"
+  server_node = create_node("bench_server")
+  client_node = create_node("bench_client")
+  server_node.advertise_service(service, TestRosrb::Srv::AddTwoInts, {}) do |req|
+    TestRosrb::Srv::AddTwoInts::Response.new(req.a + req.b)
+  end
+  spinner = start_spinner(server_node, options[:spin_interval])
+  client_node.wait_for_service(service)
+  proxy = client_node.service_proxy(service, TestRosrb::Srv::AddTwoInts,
+                                    {:persistent => persistent})
+  10.times { |i| proxy.call(i, 1) }
+
+  hist = ROS::LatencyHistogram.new
+  calls = 0
+  start = ROS::Trace.now
+  deadline = start + (options[:duration] * NSEC_PER_SEC).to_i
+  while (t = ROS::Trace.now) < deadline
+    sum = proxy.call(calls, 1)
+    hist.record(ROS::Trace.now - t)
+    raise "wrong response #{sum}" unless sum == calls + 1
+    calls += 1
+  end
+  elapsed = (ROS::Trace.now - start) / 1e9
+  proxy.close if persistent
+
+  [server_node, client_node].each { |node| node.signal_shutdown }
+  spinner.join
+  { 'persistent' => persistent, 'calls_per_sec' => calls / elapsed,
+    'latency' => latency_result(hist) }
+end
+
+pubsub = []
+printf("%-10s %6s %12s %14s %10s %10s %10s %10s\n", "size", "fanout", "msg/s", "MB/s",
+       "rate[Hz]", "p50[us]", "p99[us]", "p999[us]")
+options[:sizes].each do |size|
+  options[:fanout].each do |fanout|
+    r = run_pubsub(size, fanout, options)
+    pubsub.push(r)
+    t = r['throughput']
+    l = r['latency']
+    printf("%-10d %6d %12.1f %14.2f %10.1f %10.1f %10.1f %10.1f\n", size, fanout,
+           t['msgs_per_sec'], t['bytes_per_sec'] / 1e6, l['rate'],
+           l['p50'] * 1e6, l['p99'] * 1e6, l['p999'] * 1e6)
+  end
+end
+
+puts
+services = []
+printf("%-10s %12s %10s %10s %10s\n", "service", "call/s", "p50[us]", "p99[us]", "p999[us]")
+[true, false].each do |persistent|
+  r = run_service(persistent, options)
+  services.push(r)
+  l = r['latency']
+  printf("%-10s %12.1f %10.1f %10.1f %10.1f\n", persistent ? "persistent" : "transient",
+         r['calls_per_sec'], l['p50'] * 1e6, l['p99'] * 1e6, l['p999'] * 1e6)
+end
+
+report = { 'ruby' => "#{RUBY_VERSION}p#{RUBY_PATCHLEVEL}",
+           'date' => Time.now.utc.strftime('%Y-%m-%dT%H:%M:%SZ'),
+           'master' => options[:master] ? options[:master] : 'in-process',
+           'duration' => options[:duration],
+           'shared_servers' => options[:shared_servers],
+           'pubsub' => pubsub,
+           'services' => services }
+File.open(options[:output], 'w') { |f| f.write(report.to_yaml) } if options[:output]
+
+ROS::EventLoop.instance.shutdown
+master.shutdown if master
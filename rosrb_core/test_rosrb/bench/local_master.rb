@@ -0,0 +1,246 @@
+require 'webrick'
+require 'xmlrpc/server'
+require 'xmlrpc/client'
+require 'uri'
+require 'thread'
+require 'ros/utils'
+
+module ROS
+  # Minimal in-process ROS master for benchmarks and tests.
+  #
+  # Implements registration, lookup and parameter APIs of the ROS master
+  # with WEBrick on its own thread. publisherUpdate is sent to subscribers
+  # from a background thread like rosmaster does.
+  class LocalMaster
+    IGNORED = 0
+
+    def initialize(host='127.0.0.1', port=nil)
+      @host = host
+      @port = (port or ROS.get_local_port())
+      @mutex = Mutex.new
+      @publishers = Hash.new { |h, k| h[k] = {} }   # topic => {caller_id => api}
+      @subscribers = Hash.new { |h, k| h[k] = {} }  # topic => {caller_id => api}
+      @topic_types = {}
+      @services = {}                                # service => [caller_id, service_api]
+      @nodes = {}                                   # caller_id => api
+      @params = {}
+      @thread = nil
+      @server = nil
+    end
+
+    attr_reader :port
+
+    def uri
+      "http://#{@host}:#{@port}/"
+    end
+
+    def start
+      servlet = XMLRPC::WEBrickServlet.new
+      add_handlers(servlet)
+      log = WEBrick::Log.new(nil, WEBrick::Log::ERROR)
+      @server = WEBrick::HTTPServer.new(:Port => @port, :BindAddress => @host,
+                                        :Logger => log, :AccessLog => [])
+      @server.mount("/", servlet)
+      @thread = Thread.new { @server.start }
+      self
+    end
+
+    def shutdown
+      @server.shutdown if @server
+      @thread.join if @thread
+    end
+
+    private
+
+    def add_handlers(servlet)
+      servlet.add_handler("getUri") { |caller_id| [1, "", uri] }
+
+      servlet.add_handler("getPid") { |caller_id| [1, "", $$] }
+
+      servlet.add_handler("lookupNode") do |caller_id, node_name|
+        api = @mutex.synchronize { @nodes[node_name] }
+        api ? [1, "", api] : [-1, "unknown node #{node_name}", ""]
+      end
+
+      servlet.add_handler("registerPublisher") do |caller_id, topic, topic_type, caller_api|
+        subscribers = nil
+        publishers = nil
+        @mutex.synchronize do
+          @nodes[caller_id] = caller_api
+          @topic_types[topic] ||= topic_type
+          @publishers[topic][caller_id] = caller_api
+          subscribers = @subscribers[topic].values
+          publishers = @publishers[topic].values
+        end
+        publisher_update(topic, subscribers, publishers)
+        [1, "", subscribers]
+      end
+
+      servlet.add_handler("unregisterPublisher") do |caller_id, topic, caller_api|
+        removed = nil
+        subscribers = nil
+        publishers = nil
+        @mutex.synchronize do
+          removed = @publishers[topic].delete(caller_id) ? 1 : 0
+          subscribers = @subscribers[topic].values
+          publishers = @publishers[topic].values
+        end
+        publisher_update(topic, subscribers, publishers) if removed == 1
+        [1, "", removed]
+      end
+
+      servlet.add_handler("registerSubscriber") do |caller_id, topic, topic_type, caller_api|
+        @mutex.synchronize do
+          @nodes[caller_id] = caller_api
+          @topic_types[topic] ||= topic_type
+          @subscribers[topic][caller_id] = caller_api
+          [1, "", @publishers[topic].values]
+        end
+      end
+
+      servlet.add_handler("unregisterSubscriber") do |caller_id, topic, caller_api|
+        @mutex.synchronize do
+          [1, "", @subscribers[topic].delete(caller_id) ? 1 : 0]
+        end
+      end
+
+      servlet.add_handler("registerService") do |caller_id, service, service_api, caller_api|
+        @mutex.synchronize do
+          @nodes[caller_id] = caller_api
+          @services[service] = [caller_id, service_api]
+        end
+        [1, "", IGNORED]
+      end
+
+      servlet.add_handler("unregisterService") do |caller_id, service, service_api|
+        @mutex.synchronize do
+          entry = @services[service]
+          if entry and entry[1] == service_api
+            @services.delete(service)
+            [1, "", 1]
+          else
+            [1, "", 0]
+          end
+        end
+      end
+
+      servlet.add_handler("lookupService") do |caller_id, service|
+        entry = @mutex.synchronize { @services[service] }
+        entry ? [1, "", entry[1]] : [-1, "no provider", ""]
+      end
+
+      servlet.add_handler("getPublishedTopics") do |caller_id, subgraph|
+        @mutex.synchronize do
+          topics = @publishers.select { |topic, pubs| not pubs.empty? }.map do |topic, pubs|
+            [topic, @topic_types[topic]]
+          end
+          [1, "", topics]
+        end
+      end
+
+      servlet.add_handler("getSystemState") do |caller_id|
+        @mutex.synchronize do
+          pubs = @publishers.map { |topic, nodes| [topic, nodes.keys] }
+          subs = @subscribers.map { |topic, nodes| [topic, nodes.keys] }
+          srvs = @services.map { |service, entry| [service, [entry[0]]] }
+          [1, "", [pubs, subs, srvs]]
+        end
+      end
+
+      servlet.add_handler("setParam") do |caller_id, key, value|
+        @mutex.synchronize do
+          delete_tree(key)
+          flatten(key, value) { |k, v| @params[k] = v }
+        end
+        [1, "", IGNORED]
+      end
+
+      servlet.add_handler("getParam") do |caller_id, key|
+        @mutex.synchronize do
+          value = lookup(key)
+          value.nil? ? [-1, "Parameter [#{key}] is not set", IGNORED] : [1, "", value]
+        end
+      end
+
+      servlet.add_handler("hasParam") do |caller_id, key|
+        @mutex.synchronize { [1, "", (not lookup(key).nil?)] }
+      end
+
+      servlet.add_handler("deleteParam") do |caller_id, key|
+        @mutex.synchronize do
+          lookup(key).nil? ? [-1, "Parameter [#{key}] is not set", IGNORED] : (delete_tree(key); [1, "", IGNORED])
+        end
+      end
+
+      servlet.add_handler("searchParam") do |caller_id, key|
+        @mutex.synchronize do
+          ns = caller_id.split('/')[0..-2]
+          found = nil
+          while found.nil?
+            candidate = (ns + [key]).join('/')
+            candidate = "/#{candidate}" unless candidate.start_with?('/')
+            found = candidate unless lookup(candidate).nil?
+            break if ns.empty?
+            ns.pop
+          end
+          found ? [1, "", found] : [-1, "", IGNORED]
+        end
+      end
+
+      servlet.add_handler("getParamNames") do |caller_id|
+        @mutex.synchronize { [1, "", @params.keys] }
+      end
+    end
+
+    def publisher_update(topic, subscribers, publishers)
+      return if subscribers.empty?
+      Thread.new do
+        subscribers.each do |api|
+          begin
+            uri = URI(api)
+            path = uri.path.empty? ? "/" : uri.path
+            client = XMLRPC::Client.new(uri.host, path, uri.port)
+            client.call("publisherUpdate", "/master", topic, publishers)
+          rescue StandardError, Timeout::Error
+            # dead subscribers are ignored
+          end
+        end
+      end
+    end
+
+    def normalize(key)
+      key = "/#{key}" unless key.start_with?('/')
+      key.chomp('/')
+    end
+
+    def flatten(key, value, &block)
+      key = normalize(key)
+      if Hash === value
+        value.each { |k, v| flatten("#{key}/#{k}", v, &block) }
+      else
+        yield key, value
+      end
+    end
+
+    def lookup(key)
+      key = normalize(key)
+      return @params[key] if @params.has_key?(key)
+      prefix = "#{key}/"
+      tree = nil
+      @params.each do |k, v|
+        next unless k.start_with?(prefix)
+        tree ||= {}
+        node = tree
+        names = k[prefix.length..-1].split('/')
+        names[0..-2].each { |name| node = (node[name] ||= {}) }
+        node[names[-1]] = v
+      end
+      tree
+    end
+
+    def delete_tree(key)
+      key = normalize(key)
+      @params.delete_if { |k, v| k == key or k.start_with?("#{key}/") }
+    end
+  end
+end
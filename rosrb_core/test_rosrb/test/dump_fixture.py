@@ -1,11 +1,42 @@
+# Dump serialized messages written by rospy.
+#
+# Without options, writes the fixtures used by spec_genmsg.rb into the
+# current directory.
+#
+# With --corpus DIR, writes the benchmark corpus used by
+# ../bench/bench_serializer.rb: one .data file per case and corpus.yaml
+# listing the cases with rospy serialize/deserialize timings as baseline.
+
 import roslib
 roslib.load_manifest("test_rosrb")
 import rospy
 
+import os
+import sys
+import time
+import optparse
+import yaml
+
+try:
+    import cStringIO as stringio
+except:
+    import StringIO as stringio
+
 from test_rosrb.msg import Builtins
 from test_rosrb.msg import WithHeader
 from test_rosrb.msg import Arrays
 from test_rosrb.msg import Nest2
+from std_msgs.msg import String
+from geometry_msgs.msg import Pose
+from geometry_msgs.msg import PoseArray
+from sensor_msgs.msg import Image
+from sensor_msgs.msg import LaserScan
+from sensor_msgs.msg import PointCloud2
+from sensor_msgs.msg import PointField
+from visualization_msgs.msg import Marker
+from visualization_msgs.msg import MarkerArray
+from geometry_msgs.msg import Point
+from std_msgs.msg import ColorRGBA
 
 def make_builtin_sample():
     msg = Builtins()
@@ -38,12 +69,12 @@ def generate_with_header():
   msg = WithHeader()
   msg.header.seq = 0x01234567
   msg.header.stamp.secs = 0x89ABCDEF
-  msg.header.stamp.nsecs = 0x76543210 
+  msg.header.stamp.nsecs = 0x12345678
   msg.header.frame_id = "I'm WithHeader"
   msg.i = 0x01234567
   msg.h.seq = 0x89ABCDEF
   msg.h.stamp.secs = 0x76543210 
-  msg.h.stamp.nsecs = 0xFEDCBA98
+  msg.h.stamp.nsecs = 0x0EDCBA98
   with open('WithHeader.data', 'wb') as f:
       msg.serialize(f)
 
@@ -52,7 +83,7 @@ def make_nest2_sample():
   msg.builtin = make_builtin_sample()
   msg.nest1.header.seq = 0xCAFEBABE
   msg.nest1.header.stamp.secs = 0xDEADBEEF
-  msg.nest1.header.stamp.nsecs = 0xFACEFEED
+  msg.nest1.header.stamp.nsecs = 0x0ACEFEED
   msg.nest1.header.frame_id = "This is Nest2"
   msg.nest1.builtin = make_builtin_sample()
   return msg 
@@ -87,11 +118,173 @@ def generate_arrays():
     msg.serialize(f)
 
 
-if __name__ == '__main__':
+#-- benchmark corpus ---------------------------------------------
+
+def make_arrays(n, n_strs, n_nests):
+  msg = Arrays()
+  msg.bs.extend(bool(x % 2) for x in range(n))
+  msg.cs.extend(i % 128 for i in range(n))
+  msg.i8s.extend(i % 128 for i in range(n))
+  msg.u8s = ''.join(chr(i % 256) for i in range(n))
+  msg.i16s.extend(i % 32768 for i in range(n))
+  msg.u16s.extend(i % 65536 for i in range(n))
+  msg.i32s.extend(i for i in range(n))
+  msg.u32s.extend(i for i in range(n))
+  msg.i64s.extend(i for i in range(n))
+  msg.u64s.extend(i for i in range(n))
+  msg.f32s.extend(i * 0.5 for i in range(n))
+  msg.f64s.extend(i * 0.25 for i in range(n))
+  msg.strs.extend("Hello %d" % i for i in range(n_strs))
+  msg.ts.extend(rospy.Time(i, i) for i in range(n))
+  msg.ds.extend(rospy.Duration(i, i) for i in range(n))
+  msg.n2s.extend(make_nest2_sample() for i in range(n_nests))
+  return msg
+
+def make_string(length):
+  return String(data='x' * length)
+
+def make_laser_scan(n):
+  msg = LaserScan()
+  msg.header.stamp = rospy.Time(1350000000, 123456789)
+  msg.header.frame_id = "laser"
+  msg.angle_min = -2.35619
+  msg.angle_max = 2.35619
+  msg.angle_increment = (msg.angle_max - msg.angle_min) / n
+  msg.range_min = 0.02
+  msg.range_max = 30.0
+  msg.ranges = [1.0 + (i % 100) * 0.01 for i in range(n)]
+  msg.intensities = [float(i % 256) for i in range(n)]
+  return msg
+
+def make_image(width, height):
+  msg = Image()
+  msg.header.stamp = rospy.Time(1350000000, 123456789)
+  msg.header.frame_id = "camera"
+  msg.height = height
+  msg.width = width
+  msg.encoding = "rgb8"
+  msg.step = width * 3
+  msg.data = ''.join(chr(i % 256) for i in range(width * height * 3))
+  return msg
+
+def make_point_cloud2(width, height):
+  msg = PointCloud2()
+  msg.header.stamp = rospy.Time(1350000000, 123456789)
+  msg.header.frame_id = "camera"
+  msg.height = height
+  msg.width = width
+  msg.fields = [PointField(name, offset, PointField.FLOAT32, 1)
+                for name, offset in [('x', 0), ('y', 4), ('z', 8)]]
+  msg.point_step = 12
+  msg.row_step = width * 12
+  msg.data = ''.join(chr(i % 256) for i in range(width * height * 12))
+  msg.is_dense = True
+  return msg
+
+def make_pose_array(n):
+  msg = PoseArray()
+  msg.header.stamp = rospy.Time(1350000000, 123456789)
+  msg.header.frame_id = "map"
+  for i in range(n):
+    pose = Pose()
+    pose.position.x = i * 0.1
+    pose.orientation.w = 1.0
+    msg.poses.append(pose)
+  return msg
+
+def make_marker_array(n_markers, n_points):
+  msg = MarkerArray()
+  for i in range(n_markers):
+    marker = Marker()
+    marker.header.stamp = rospy.Time(1350000000, 123456789)
+    marker.header.frame_id = "map"
+    marker.ns = "bench"
+    marker.id = i
+    marker.type = Marker.LINE_STRIP
+    marker.pose.orientation.w = 1.0
+    marker.scale.x = 0.1
+    marker.color.a = 1.0
+    marker.points = [Point(j * 0.1, i * 0.1, 0.0) for j in range(n_points)]
+    marker.colors = [ColorRGBA(1.0, 0.0, 0.0, 1.0) for j in range(n_points)]
+    msg.markers.append(marker)
+  return msg
+
+# (name, factory) of corpus cases.
+# small cases are realistic sizes, the others stress one dimension each.
+CORPUS = [
+  ('builtins', make_builtin_sample),
+  ('nest2', make_nest2_sample),
+  ('arrays_small', lambda: make_arrays(10, 10, 10)),
+  ('arrays_large', lambda: make_arrays(10000, 1000, 10)),
+  ('arrays_many_nests', lambda: make_arrays(0, 0, 1000)),
+  ('string_short', lambda: make_string(16)),
+  ('string_long', lambda: make_string(1024 * 1024)),
+  ('laser_scan', lambda: make_laser_scan(1081)),
+  ('pose_array', lambda: make_pose_array(1000)),
+  # arrays of messages nested in arrays of messages, four levels deep
+  ('marker_array_deep', lambda: make_marker_array(100, 10)),
+  ('image_vga', lambda: make_image(640, 480)),
+  ('point_cloud2_vga', lambda: make_point_cloud2(640, 480)),
+]
+
+def measure(func, min_time=0.5):
+  """@return: seconds per call"""
+  n = 1
+  while True:
+    start = time.time()
+    for i in range(n):
+      func()
+    elapsed = time.time() - start
+    if elapsed >= min_time:
+      return elapsed / n
+    n *= 2
+
+def generate_corpus(output_dir, min_time):
+  if not os.path.exists(output_dir):
+    os.makedirs(output_dir)
+  cases = []
+  for name, factory in CORPUS:
+    msg = factory()
+    buff = stringio.StringIO()
+    msg.serialize(buff)
+    data = buff.getvalue()
+    with open(os.path.join(output_dir, '%s.data' % name), 'wb') as f:
+      f.write(data)
+
+    def serialize():
+      msg.serialize(stringio.StringIO())
+    def deserialize():
+      msg.__class__().deserialize(data)
+    case = {
+      'name': name,
+      'type': msg._type,
+      'file': '%s.data' % name,
+      'bytes': len(data),
+      'rospy': {
+        'serialize_sec': measure(serialize, min_time),
+        'deserialize_sec': measure(deserialize, min_time),
+      },
+    }
+    print "%-20s %10d bytes" % (name, len(data))
+    cases.append(case)
+  with open(os.path.join(output_dir, 'corpus.yaml'), 'w') as f:
+    yaml.safe_dump({'python': sys.version.split()[0], 'cases': cases}, f,
+                   default_flow_style=False)
+
+def generate_fixtures():
   generate_builtins()
   generate_with_header()
   generate_arrays()
   generate_nest()
 
-
-
+if __name__ == '__main__':
+  parser = optparse.OptionParser()
+  parser.add_option("--corpus", action="store", type="string", dest="corpus",
+                    help="write benchmark corpus to the directory")
+  parser.add_option("--min-time", action="store", type="float", dest="min_time",
+                    default=0.5, help="minimum seconds to time each rospy case")
+  options, args = parser.parse_args()
+  if options.corpus:
+    generate_corpus(options.corpus, options.min_time)
+  else:
+    generate_fixtures()
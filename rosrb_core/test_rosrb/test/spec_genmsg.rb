@@ -38,10 +38,8 @@ describe TestRosrb::Msg::Builtins, "#serialize" do
     msg.f32 = 3.14
     msg.f64 = 2.78
     msg.str = "Hello, world!"
-    msg.t.secs = 12
-    msg.t.nsecs = 34
-    msg.d.secs = 56
-    msg.d.nsecs = 78
+    msg.t = ROS::Time.new(12, 34)
+    msg.d = ROS::Duration.new(56, 78)
     sio = StringIO.new('wb')
     msg.serialize(sio)
     sio.close
@@ -104,13 +102,11 @@ describe TestRosrb::Msg::WithHeader, "#serialize" do
   it "should" do
     msg = TestRosrb::Msg::WithHeader.new
     msg.header.seq = 0x01234567
-    msg.header.stamp.secs = 0x89ABCDEF
-    msg.header.stamp.nsecs = 0x76543210
+    msg.header.stamp = ROS::Time.new(0x89ABCDEF, 0x12345678)
     msg.header.frame_id = "I'm WithHeader"
     msg.i = 0x01234567
     msg.h.seq = 0x89ABCDEF
-    msg.h.stamp.secs = 0x76543210
-    msg.h.stamp.nsecs = 0xFEDCBA98
+    msg.h.stamp = ROS::Time.new(0x76543210, 0x0EDCBA98)
 
     sio = StringIO.new('wb')
     msg.serialize(sio)
@@ -140,11 +136,11 @@ describe TestRosrb::Msg::WithHeader, "#deserialize" do
     msg.deserialize(data)
     msg.header.seq.should eq(0x01234567)
     msg.header.stamp.secs.should eq(0x89ABCDEF)
-    msg.header.stamp.nsecs.should eq(0x76543210)
+    msg.header.stamp.nsecs.should eq(0x12345678)
     msg.i.should eq(0x01234567)
     msg.h.seq.should eq(0x89ABCDEF)
     msg.h.stamp.secs.should eq(0x76543210)
-    msg.h.stamp.nsecs.should eq(0xFEDCBA98)
+    msg.h.stamp.nsecs.should eq(0x0EDCBA98)
   end
 end
 
@@ -205,8 +201,7 @@ describe TestRosrb::Msg::Nest2, "#serialize" do
     msg.builtin.t = ROS::Time.new(12, 34)
     msg.builtin.d = ROS::Duration.new(56, 78)
     msg.nest1.header.seq = 0xCAFEBABE
-    msg.nest1.header.stamp.secs = 0xDEADBEEF
-    msg.nest1.header.stamp.nsecs = 0xFACEFEED
+    msg.nest1.header.stamp = ROS::Time.new(0xDEADBEEF, 0x0ACEFEED)
     msg.nest1.header.frame_id = "This is Nest2"
     msg.nest1.builtin.b = true
     msg.nest1.builtin.c = 0x01
@@ -267,7 +262,7 @@ describe TestRosrb::Msg::Nest2, "#deserialize" do
     msg.builtin.d.should eq(ROS::Duration.new(56, 78))
     msg.nest1.header.seq.should eq(0xCAFEBABE)
     msg.nest1.header.stamp.secs.should eq(0xDEADBEEF)
-    msg.nest1.header.stamp.nsecs.should eq(0xFACEFEED)
+    msg.nest1.header.stamp.nsecs.should eq(0x0ACEFEED)
     msg.nest1.header.frame_id.should eq("This is Nest2")
     msg.nest1.builtin.b.should be_true
     msg.nest1.builtin.c.should eq(0x01)
@@ -0,0 +1,71 @@
+require 'eventmachine'
+require 'ros/tcpros'
+
+# Inbound connection with a fake socket buffer
+def slow_connection(max_outbound, queue_size, overflow)
+  conn = ROS::TCPROSPubSubInboundConnection.new(nil, nil)
+  conn.instance_variable_set(:@outbound, [])
+  class << conn
+    attr_accessor :outbound
+    def send_data(data)
+      @outbound.push(data)
+    end
+    def get_outbound_data_size
+      @outbound.inject(0) { |sum, data| sum + data.bytesize }
+    end
+    def close_connection
+    end
+  end
+  conn.set_flow_control(max_outbound, queue_size, overflow)
+  conn
+end
+
+describe ROS::TCPROSPubSubInboundConnection, "#send_message" do
+  it "should write messages while the socket buffer is below the limit" do
+    conn = slow_connection(nil, 2, :drop_newest)
+    10.times { conn.send_message("x" * 100).should be_true }
+    conn.outbound.length.should eq(20)
+    conn.queue_depth.should eq(0)
+  end
+
+  it "should drop the newest message on overflow" do
+    conn = slow_connection(8, 2, :drop_newest)
+    conn.send_message("a" * 8).should be_true
+    conn.send_message("b").should be_true
+    conn.send_message("c").should be_true
+    conn.send_message("d").should be_false
+    conn.queue_depth.should eq(2)
+    conn.num_dropped.should eq(1)
+  end
+
+  it "should drop the oldest message on overflow" do
+    conn = slow_connection(8, 2, :drop_oldest)
+    ["a" * 8, "b", "c", "d"].each { |data| conn.send_message(data).should be_true }
+    conn.queue_depth.should eq(2)
+    conn.num_dropped.should eq(1)
+    conn.outbound.clear
+    conn.send(:flush)
+    conn.outbound.values_at(1, 3).should eq(["c", "d"])
+  end
+
+  it "should back off flushing while the subscriber is stalled" do
+    conn = slow_connection(8, 10, :drop_oldest)
+    ["a" * 8, "b"].each { |data| conn.send_message(data) }
+    3.times { conn.send(:flush) }
+    conn.instance_variable_get(:@flush_interval).should eq(0.008)
+    conn.outbound.clear
+    conn.send(:flush)
+    conn.instance_variable_get(:@flush_interval).should eq(ROS::TCPROSPubSubInboundConnection::FLUSH_INTERVAL)
+    conn.queue_depth.should eq(0)
+  end
+
+  it "should stop sending after disconnecting a slow subscriber" do
+    conn = slow_connection(8, 1, :disconnect)
+    conn.send_message("a" * 8).should be_true
+    conn.send_message("b").should be_true
+    conn.send_message("c").should be_false
+    conn.send_message("d").should be_false
+    conn.queue_depth.should eq(0)
+    conn.num_dropped.should eq(2)
+  end
+end
@@ -0,0 +1,93 @@
+require 'ros/message_filters'
+
+class StampedMessage
+  TYPE = 'test_rosrb/Stamped'
+  HAS_HEADER = true
+  attr_accessor :seq, :stamp
+
+  def self.serialize(seq, secs, nsecs=0)
+    [seq, secs, nsecs].pack('VVV')
+  end
+
+  def deserialize(str)
+    @seq, secs, nsecs = str.unpack('VVV')
+    @stamp = ROS::Time.new(secs, nsecs)
+  end
+end
+
+describe ROS::Cache do
+  before do
+    @cache = ROS::Cache.new(StampedMessage, 4)
+  end
+
+  it "should read the stamp from the header" do
+    ROS::Cache.header_stamp(StampedMessage.serialize(7, 2, 5)).should eq(2000000005)
+  end
+
+  it "should keep messages ordered by stamp" do
+    [3, 1, 2].each { |secs| @cache.add(StampedMessage.serialize(secs, secs)) }
+    @cache.length.should eq(3)
+    @cache.get_oldest_time.should eq(ROS::Time.new(1))
+    @cache.get_latest_time.should eq(ROS::Time.new(3))
+    @cache.get_interval(ROS::Time.new(0), ROS::Time.new(9)).map { |m| m.seq }.should eq([1, 2, 3])
+  end
+
+  it "should drop the oldest message when full" do
+    (1..6).each { |secs| @cache.add(StampedMessage.serialize(secs, secs)) }
+    @cache.length.should eq(4)
+    @cache.get_oldest_time.should eq(ROS::Time.new(3))
+    @cache.add(StampedMessage.serialize(1, 1)).should be_nil
+  end
+
+  it "should find messages around a time" do
+    [2, 4, 6, 8].each { |secs| @cache.add(StampedMessage.serialize(secs, secs)) }
+    @cache.get_elem_after_time(ROS::Time.new(5)).seq.should eq(6)
+    @cache.get_elem_before_time(ROS::Time.new(5)).seq.should eq(4)
+    @cache.get_elem_after_time(ROS::Time.new(9)).should be_nil
+    @cache.get_interval(ROS::Time.new(3), ROS::Time.new(6)).map { |m| m.seq }.should eq([4, 6])
+    @cache.get_surrounding_interval(ROS::Time.new(3), ROS::Time.new(5)).map { |m| m.seq }.should eq([2, 4, 6])
+  end
+end
+
+describe ROS::TimeSynchronizer do
+  it "should match exact stamps" do
+    sets = []
+    sync = ROS::TimeSynchronizer.new([StampedMessage, StampedMessage], 10) do |a, b|
+      sets.push([a.seq, b.seq])
+    end
+    sync.add(0, StampedMessage.serialize(1, 1))
+    sync.add(0, StampedMessage.serialize(2, 2))
+    sync.add(1, StampedMessage.serialize(12, 2))
+    sync.add(1, StampedMessage.serialize(11, 1))
+    sets.should eq([[2, 12]])
+    sync.caches[0].length.should eq(0)
+  end
+
+  it "should match stamps within slop" do
+    sets = []
+    policy = ROS::ApproximateTime.new(0.1)
+    sync = ROS::TimeSynchronizer.new([StampedMessage, StampedMessage], 10, policy) do |a, b|
+      sets.push([a.seq, b.seq])
+    end
+    sync.add(0, StampedMessage.serialize(1, 1, 0))
+    sync.add(1, StampedMessage.serialize(11, 1, 200000000))
+    sync.add(0, StampedMessage.serialize(2, 1, 250000000))
+    sets.should eq([[2, 11]])
+  end
+
+  it "should keep a set of three topics within slop" do
+    sets = []
+    policy = ROS::ApproximateTime.new(0.1)
+    types = [StampedMessage, StampedMessage, StampedMessage]
+    sync = ROS::TimeSynchronizer.new(types, 10, policy) do |a, b, c|
+      sets.push([a.seq, b.seq, c.seq])
+    end
+    sync.add(0, StampedMessage.serialize(1, 0, 920000000))
+    sync.add(2, StampedMessage.serialize(31, 1, 80000000))
+    # within slop of both, but 1.08 - 0.92 > slop
+    sync.add(1, StampedMessage.serialize(21, 1, 0))
+    sets.should eq([])
+    sync.add(2, StampedMessage.serialize(32, 0, 990000000))
+    sets.should eq([[1, 21, 32]])
+  end
+end
@@ -0,0 +1,31 @@
+require 'ros/message_pool'
+
+class PooledMessage
+  attr_accessor :data
+
+  def deserialize(str)
+    @data = str
+  end
+end
+
+describe ROS::MessagePool do
+  it "should reuse released instances" do
+    pool = ROS::MessagePool.new(PooledMessage, 2)
+    msg = pool.deserialize("a")
+    msg.data.should eq("a")
+    pool.release(msg)
+    pool.available.should eq(1)
+    pool.deserialize("b").should equal(msg)
+    msg.data.should eq("b")
+  end
+
+  it "should keep at most size instances" do
+    pool = ROS::MessagePool.new(PooledMessage, 1)
+    a = pool.acquire
+    b = pool.acquire
+    a.should_not equal(b)
+    pool.release(a)
+    pool.release(b)
+    pool.available.should eq(1)
+  end
+end
@@ -0,0 +1,71 @@
+require 'ros'
+require 'test_rosrb/msg'
+require 'stringio'
+require 'tmpdir'
+require 'fileutils'
+
+# Classes generated with and without --inline-nested nest in each other:
+# an outer class calls serialize_into/deserialize_from of a nested class
+# of either mode.
+describe "nested classes of msg_gen.py" do
+  before(:all) do
+    test_dir = File.expand_path(File.dirname(__FILE__))
+    genmsg = File.join(`rospack find rosrb`.strip, 'scripts', 'genmsg_rb.py')
+    msg_files = %w(Builtins Nest1 Nest2).map { |name| File.join(test_dir, '..', 'msg', "#{name}.msg") }
+    @tmp = Dir.mktmpdir
+    @sources = {}
+    [['shared', []], ['inlined', ['--inline-nested']]].each do |mode, flags|
+      dir = File.join(@tmp, mode)
+      system(genmsg, *(flags + ['--output-dir', dir] + msg_files)).should be_true
+      @sources[mode] = {}
+      %w(Builtins Nest1 Nest2).each do |name|
+        @sources[mode][name] = File.read(File.join(dir, 'test_rosrb', 'msg', "_#{name}.rb"))
+      end
+    end
+    @data = File.open(File.join(test_dir, 'Nest2.data'), 'rb') { |f| f.read }
+  end
+
+  after(:all) do
+    FileUtils.remove_entry(@tmp)
+  end
+
+  # Load classes into an anonymous module, so that they do not replace
+  # TestRosrb::Msg of the build.
+  # @param [Hash] modes name => mode of the class
+  # @return [Class] Nest2 of the module
+  def load_classes(modes)
+    namespace = Module.new
+    %w(Builtins Nest1 Nest2).each do |name|
+      namespace.module_eval(@sources[modes[name]][name])
+    end
+    namespace.const_get(:TestRosrb).const_get(:Msg).const_get(:Nest2)
+  end
+
+  def round_trip(cls)
+    msg = cls.new
+    msg.deserialize(@data)
+    msg.nest1.header.frame_id.should eq("This is Nest2")
+    sio = StringIO.new
+    msg.serialize(sio)
+    sio.string.bytes.to_a.should eq(@data.bytes.to_a)
+  end
+
+  it "should define serialize_into and deserialize_from in both modes" do
+    %w(shared inlined).each do |mode|
+      nest2 = load_classes(Hash.new(mode))
+      [nest2, nest2.new.nest1.class, nest2.new.builtin.class].each do |cls|
+        cls.should respond_to(:serialize_into)
+        cls.should respond_to(:deserialize_from)
+      end
+    end
+  end
+
+  it "should nest an inlined class in shared classes" do
+    round_trip(load_classes('Builtins' => 'shared', 'Nest1' => 'inlined', 'Nest2' => 'shared'))
+    round_trip(load_classes('Builtins' => 'inlined', 'Nest1' => 'shared', 'Nest2' => 'shared'))
+  end
+
+  it "should nest shared classes in an inlined class" do
+    round_trip(load_classes('Builtins' => 'shared', 'Nest1' => 'shared', 'Nest2' => 'inlined'))
+  end
+end
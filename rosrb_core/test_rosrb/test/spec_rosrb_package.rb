@@ -0,0 +1,101 @@
+require 'ros/package'
+require 'tmpdir'
+require 'fileutils'
+
+def write_manifest(dir, depends=[])
+  FileUtils.mkdir_p(dir)
+  File.open(File.join(dir, 'manifest.xml'), 'w') do |f|
+    f.write("<package>\n")
+    depends.each { |pkg| f.write("  <depend package=\"#{pkg}\"/>\n") }
+    f.write("</package>\n")
+  end
+end
+
+# Move the mtime of a file or directory forward, so that the change is
+# seen even on file systems with coarse timestamps.
+def bump_mtime(path)
+  t = File.mtime(path) + 10
+  File.utime(t, t, path)
+end
+
+describe ROS::PackageIndex, "load_paths" do
+  it "should resolve dependencies and reuse the persistent index" do
+    Dir.mktmpdir do |tmp|
+      ws = File.join(tmp, 'ws')
+      cache = File.join(tmp, 'index')
+      write_manifest(File.join(ws, 'stack', 'foo'), ['bar'])
+      write_manifest(File.join(ws, 'bar'))
+
+      index = ROS::PackageIndex.new([ws], cache)
+      index.load_paths('foo').should == [File.join(ws, 'stack', 'foo', 'src'),
+                                         File.join(ws, 'stack', 'foo', 'lib'),
+                                         File.join(ws, 'bar', 'src'),
+                                         File.join(ws, 'bar', 'lib')]
+      index.save
+      File.exist?(cache).should be_true
+
+      index = ROS::PackageIndex.new([ws], cache)
+      index.find('bar').should == File.join(ws, 'bar')
+      lambda { index.load_paths('baz') }.should raise_error(ROS::ROSError)
+    end
+  end
+
+  describe "with a saved index" do
+    before do
+      @tmp = Dir.mktmpdir
+      @ws = File.join(@tmp, 'ws')
+      @cache = File.join(@tmp, 'index')
+      write_manifest(File.join(@ws, 'stack', 'foo'), ['bar'])
+      write_manifest(File.join(@ws, 'bar'))
+      write_manifest(File.join(@ws, 'baz'))
+      index = ROS::PackageIndex.new([@ws], @cache)
+      index.load_paths('foo')
+      index.save
+    end
+
+    after do
+      FileUtils.remove_entry(@tmp)
+    end
+
+    it "should keep the load paths of a touched manifest" do
+      bump_mtime(File.join(@ws, 'stack', 'foo', 'manifest.xml'))
+      index = ROS::PackageIndex.new([@ws], @cache)
+      index.load_paths('foo').should == [File.join(@ws, 'stack', 'foo', 'src'),
+                                         File.join(@ws, 'stack', 'foo', 'lib'),
+                                         File.join(@ws, 'bar', 'src'),
+                                         File.join(@ws, 'bar', 'lib')]
+    end
+
+    it "should re-read the depends of a changed manifest" do
+      write_manifest(File.join(@ws, 'stack', 'foo'), ['baz'])
+      bump_mtime(File.join(@ws, 'stack', 'foo', 'manifest.xml'))
+      index = ROS::PackageIndex.new([@ws], @cache)
+      File.exist?(@cache).should be_true
+      index.load_paths('foo').should == [File.join(@ws, 'stack', 'foo', 'src'),
+                                         File.join(@ws, 'stack', 'foo', 'lib'),
+                                         File.join(@ws, 'baz', 'src'),
+                                         File.join(@ws, 'baz', 'lib')]
+    end
+
+    it "should find a package added under a crawled directory" do
+      write_manifest(File.join(@ws, 'stack', 'qux'), ['foo'])
+      bump_mtime(File.join(@ws, 'stack'))
+      index = ROS::PackageIndex.new([@ws], @cache)
+      index.find('qux').should == File.join(@ws, 'stack', 'qux')
+      index.load_paths('qux').should == [File.join(@ws, 'stack', 'qux', 'src'),
+                                         File.join(@ws, 'stack', 'qux', 'lib'),
+                                         File.join(@ws, 'stack', 'foo', 'src'),
+                                         File.join(@ws, 'stack', 'foo', 'lib'),
+                                         File.join(@ws, 'bar', 'src'),
+                                         File.join(@ws, 'bar', 'lib')]
+    end
+
+    it "should forget a removed package" do
+      FileUtils.rm_rf(File.join(@ws, 'bar'))
+      bump_mtime(@ws)
+      index = ROS::PackageIndex.new([@ws], @cache)
+      index.find('bar').should be_nil
+      lambda { index.load_paths('foo') }.should raise_error(ROS::ROSError)
+    end
+  end
+end
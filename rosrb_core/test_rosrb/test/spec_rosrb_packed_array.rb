@@ -0,0 +1,48 @@
+require 'ros/packed_array'
+
+describe ROS::PackedArray do
+  it "should read elements from little endian bytes" do
+    array = ROS::PackedArray.new('int16', [1, -2, 300].pack('s<*'))
+    array.length.should eq(3)
+    array[1].should eq(-2)
+    array[-1].should eq(300)
+    array[3].should be_nil
+    array.to_a.should eq([1, -2, 300])
+  end
+
+  it "should pack pushed and assigned elements" do
+    array = ROS::PackedArray.new('float64')
+    array.push(1.5, 2.5) << 4.0
+    array[0] = 0.5
+    array.should eq([0.5, 2.5, 4.0])
+    array.data.should eq([0.5, 2.5, 4.0].pack('E*'))
+    array.map { |x| x * 2 }.should eq([1.0, 5.0, 8.0])
+  end
+
+  it "should dump fields without conversion" do
+    data = [1.0, 2.0].pack('e*')
+    ROS::PackedArray.dump('float32', ROS::PackedArray.new('float32', data)).should equal(data)
+    ROS::PackedArray.dump('float32', [1.0, 2.0]).should eq(data)
+    ROS::PackedArray.dump('float32', ROS::PackedArray.wrap('float32', data)).should eq(data)
+  end
+
+  it "should convert elements of another type on dump" do
+    float64s = ROS::PackedArray.new('float64', [1.5, -2.0].pack('E*'))
+    ROS::PackedArray.dump('float32', float64s).should eq([1.5, -2.0].pack('e*'))
+    chars = ROS::PackedArray.new('char', [1, -1].pack('c*'))
+    ROS::PackedArray.dump('int8', chars).should equal(chars.data)
+    if ROS::PackedArray::NUMO
+      dfloat = Numo::DFloat[1.5, -2.0]
+      ROS::PackedArray.dump('float32', dfloat).should eq([1.5, -2.0].pack('e*'))
+    end
+  end
+
+  it "should pack other enumerables and reject non arrays on dump" do
+    ROS::PackedArray.dump('int16', (1..3)).should eq([1, 2, 3].pack('s<*'))
+    lambda { ROS::PackedArray.dump('int16', 5) }.should raise_error(ArgumentError)
+  end
+
+  it "should reject non numeric types" do
+    lambda { ROS::PackedArray.new('string') }.should raise_error(ArgumentError)
+  end
+end
@@ -0,0 +1,80 @@
+require 'ros'
+require 'test_rosrb/msg'
+require 'stringio'
+require 'tmpdir'
+require 'fileutils'
+
+# Classes generated with --packed-arrays hold numeric array fields as
+# ROS::PackedArray (Numo::NArray with NUMO) and write the same bytes as
+# classes of the build.
+describe "packed classes of msg_gen.py" do
+  numeric_fields = [:cs, :i8s, :u8s, :i16s, :u16s, :i32s, :u32s, :i64s, :u64s, :f32s, :f64s]
+
+  before(:all) do
+    test_dir = File.expand_path(File.dirname(__FILE__))
+    genmsg = File.join(`rospack find rosrb`.strip, 'scripts', 'genmsg_rb.py')
+    names = %w(Builtins Nest1 Nest2 Arrays)
+    msg_files = names.map { |name| File.join(test_dir, '..', 'msg', "#{name}.msg") }
+    @tmp = Dir.mktmpdir
+    system(genmsg, '--packed-arrays', '--output-dir', @tmp, *msg_files).should be_true
+    # in an anonymous module, so that they do not replace TestRosrb::Msg of
+    # the build
+    namespace = Module.new
+    names.each do |name|
+      namespace.module_eval(File.read(File.join(@tmp, 'test_rosrb', 'msg', "_#{name}.rb")))
+    end
+    @arrays = namespace.const_get(:TestRosrb).const_get(:Msg).const_get(:Arrays)
+    @data = File.open(File.join(test_dir, 'Arrays.data'), 'rb') { |f| f.read }
+  end
+
+  after(:all) do
+    FileUtils.remove_entry(@tmp)
+  end
+
+  def serialize(msg)
+    sio = StringIO.new
+    msg.serialize(sio)
+    sio.string
+  end
+
+  # @return [TestRosrb::Msg::Arrays] msg read back by the class of the build
+  def read_back(msg)
+    plain = TestRosrb::Msg::Arrays.new
+    plain.deserialize(serialize(msg))
+    plain
+  end
+
+  it "should hold numeric arrays packed" do
+    msg = @arrays.new
+    msg.deserialize(@data)
+    packed_class = ROS::PackedArray::NUMO ? Numo::NArray : ROS::PackedArray
+    numeric_fields.each do |field|
+      msg.__send__(field).should be_kind_of(packed_class)
+    end
+    msg.bs.should be_kind_of(::Array)
+    msg.strs.should be_kind_of(::Array)
+  end
+
+  it "should serialize the bytes it deserialized" do
+    msg = @arrays.new
+    msg.deserialize(@data)
+    serialize(msg).bytes.to_a.should eq(@data.bytes.to_a)
+  end
+
+  it "should serialize plain arrays given to the constructor" do
+    msg = @arrays.new(:f32s => [1.5, 2.5], :i16s => [1, -2, 300])
+    plain = read_back(msg)
+    plain.f32s.to_a.should eq([1.5, 2.5])
+    plain.i16s.to_a.should eq([1, -2, 300])
+    plain.u8s.to_a.should eq([])
+  end
+
+  it "should serialize fields of another element type" do
+    msg = @arrays.new
+    msg.f32s = ROS::PackedArray.new('float64', [1.5, -2.0, 4.0].pack('E*'))
+    msg.i64s = ROS::PackedArray.new('int8', [1, -1].pack('c*'))
+    plain = read_back(msg)
+    plain.f32s.to_a.should eq([1.5, -2.0, 4.0])
+    plain.i64s.to_a.should eq([1, -1])
+  end
+end
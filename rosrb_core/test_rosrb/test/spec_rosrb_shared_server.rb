@@ -0,0 +1,54 @@
+require 'ros/shared_server'
+
+class FakeManager
+  def initialize(items)
+    @items = items
+  end
+
+  def lookup_publication(name)
+    @items[name]
+  end
+
+  def lookup_endpoint(name)
+    @items[name]
+  end
+
+  def lookup_handler(path, name)
+    @items[name]
+  end
+end
+
+describe ROS::SharedServer do
+  before do
+    @server = ROS::SharedServer.new("127.0.0.1")
+  end
+
+  it "should route topics to the first publishing node" do
+    a = FakeManager.new("/chatter" => :topic_a)
+    b = FakeManager.new("/chatter" => :topic_b)
+    @server.add_publication("/chatter", a).should be_true
+    @server.add_publication("/chatter", b).should be_false
+    @server.lookup_publication("/chatter").should eq(:topic_a)
+    @server.remove_publication("/chatter", b)
+    @server.lookup_publication("/chatter").should eq(:topic_a)
+    @server.remove_publication("/chatter", a)
+    @server.lookup_publication("/chatter").should be_nil
+  end
+
+  it "should route services to the last advertising node" do
+    a = FakeManager.new("/add" => :endpoint_a)
+    b = FakeManager.new("/add" => :endpoint_b)
+    @server.add_endpoint("/add", a)
+    @server.add_endpoint("/add", b)
+    @server.lookup_endpoint("/add").should eq(:endpoint_b)
+  end
+
+  it "should route slave calls by path" do
+    @server.add_slave("/talker", FakeManager.new("getPid" => :talker))
+    @server.lookup_handler("/talker/", "getPid").should eq(:talker)
+    @server.lookup_handler("/", "getPid").should eq(:talker)
+    @server.add_slave("/listener", FakeManager.new("getPid" => :listener))
+    @server.lookup_handler("/listener", "getPid").should eq(:listener)
+    @server.lookup_handler("/", "getPid").should be_nil
+  end
+end
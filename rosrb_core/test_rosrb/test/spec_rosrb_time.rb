@@ -0,0 +1,41 @@
+require 'ros/time'
+
+describe ROS::Time, "#initialize" do
+  it "should be canonical and frozen" do
+    t = ROS::Time.new(1, 1500000000)
+    t.secs.should eq(2)
+    t.nsecs.should eq(500000000)
+    t.to_nsec.should eq(2500000000)
+    t.frozen?.should be_true
+  end
+end
+
+describe ROS::Time, "arithmetic" do
+  it "should add and subtract durations" do
+    t = ROS::Time.new(10, 900000000) + ROS::Duration.new(0, 200000000)
+    t.should == ROS::Time.new(11, 100000000)
+    (t - ROS::Time.new(11, 0)).should == ROS::Duration.new(0, 100000000)
+    (t - ROS::Duration.new(1, 0)).should == ROS::Time.new(10, 100000000)
+  end
+
+  it "should compare and hash by value" do
+    a = ROS::Time.new(1, 2)
+    b = ROS::Time.new(1, 2)
+    (a <=> b).should eq(0)
+    a.should < ROS::Time.new(1, 3)
+    a.eql?(b).should be_true
+    {a => 1}[b].should eq(1)
+    a.should_not == ROS::Duration.new(1, 2)
+  end
+end
+
+describe ROS::Duration, "arithmetic" do
+  it "should keep negative durations canonical" do
+    d = -ROS::Duration.from_sec(1.5)
+    d.secs.should eq(-2)
+    d.nsecs.should eq(500000000)
+    d.to_sec.should eq(-1.5)
+    (d * 2).should == ROS::Duration.new(-3, 0)
+    (ROS::Duration.new(3, 0) / 2).should == ROS::Duration.new(1, 500000000)
+  end
+end
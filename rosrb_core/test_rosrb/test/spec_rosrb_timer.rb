@@ -0,0 +1,62 @@
+require 'ros/timer'
+
+class WallClockNode
+  def get_rostime
+    ROS.get_walltime
+  end
+
+  def use_simtime?
+    false
+  end
+end
+
+class SimClockNode
+  def initialize
+    @time = ROS::Time.new(100, 0)
+  end
+
+  attr_accessor :time
+
+  def get_rostime
+    @time
+  end
+
+  def use_simtime?
+    true
+  end
+end
+
+describe ROS::Timer, "with wall time" do
+  it "should schedule ticks at multiples of the period" do
+    scheduler = ROS::TimerScheduler.new(WallClockNode.new)
+    events = []
+    timer = ROS::Timer.new(scheduler, 0.005, {}, proc { |e| events << e })
+    timer.start(scheduler.now_nsec)
+    sleep(0.1)
+    timer.shutdown
+    scheduler.shutdown
+    events.length.should > 1
+    events.each_cons(2) do |a, b|
+      ((b.current_expected.to_nsec - a.current_expected.to_nsec) % 5000000).should eq(0)
+      b.last_expected.should == a.current_expected
+    end
+  end
+end
+
+describe ROS::Timer, "with sim time" do
+  it "should fire only when the clock is updated" do
+    node = SimClockNode.new
+    scheduler = ROS::TimerScheduler.new(node)
+    events = []
+    timer = ROS::Timer.new(scheduler, 1, {}, proc { |e| events << e })
+    timer.start(scheduler.now_nsec)
+    sleep(0.05)
+    events.length.should eq(0)
+    node.time = ROS::Time.new(101, 500000000)
+    scheduler.clock_updated
+    sleep(0.05)
+    events.length.should eq(1)
+    events[0].current_expected.should == ROS::Time.new(101, 0)
+    scheduler.shutdown
+  end
+end
@@ -0,0 +1,38 @@
+require 'ros/trace'
+
+describe ROS::LatencyHistogram, "#record" do
+  it "should count small values exactly" do
+    hist = ROS::LatencyHistogram.new
+    [3, 1, 2, 2].each { |v| hist.record(v) }
+    hist.count.should eq(4)
+    hist.min.should eq(1)
+    hist.max.should eq(3)
+    hist.percentile(50).should eq(2)
+    hist.percentile(100).should eq(3)
+  end
+
+  it "should keep relative error of percentiles bounded" do
+    hist = ROS::LatencyHistogram.new
+    values = (1..10000).map { |i| i * 1000 }
+    values.each { |v| hist.record(v) }
+    hist.percentile(50).should be_within(5000000 / 64).of(5000000)
+    hist.percentile(99).should be_within(9900000 / 64).of(9900000)
+    hist.percentile(100).should eq(10000000)
+  end
+
+  it "should return 0 without values" do
+    hist = ROS::LatencyHistogram.new
+    hist.percentile(99).should eq(0)
+    hist.mean.should eq(0.0)
+  end
+end
+
+describe ROS::Trace, "report" do
+  it "should report recorded stages per name" do
+    ROS::Trace.record(:callback, "/trace_test", 0, 2000)
+    ROS::Trace.record(:dequeue, "/trace_test", 0, 1000)
+    rows = ROS::Trace.report.select { |row| row[0] == "/trace_test" }
+    rows.map { |row| row[1] }.should == ["dequeue", "callback"]
+    rows[1][2].should eq(1)
+  end
+end
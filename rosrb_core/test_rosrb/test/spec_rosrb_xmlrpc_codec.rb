@@ -0,0 +1,55 @@
+require 'ros/xmlrpc_codec'
+
+describe ROS::XMLRPCCodec, ".parse_call" do
+  it "should parse a publisherUpdate call" do
+    data = <<-EOS
+<?xml version='1.0'?>
+<methodCall>
+<methodName>publisherUpdate</methodName>
+<params>
+<param>
+<value><string>/master</string></value>
+</param>
+<param>
+<value>/chatter</value>
+</param>
+<param>
+<value><array><data>
+<value><string>http://host:1234/</string></value>
+</data></array></value>
+</param>
+</params>
+</methodCall>
+    EOS
+    method, params = ROS::XMLRPCCodec.parse_call(data)
+    method.should eq("publisherUpdate")
+    params.should eq(["/master", "/chatter", ["http://host:1234/"]])
+  end
+
+  it "should parse typed values" do
+    data = "<methodCall><methodName>m</methodName><params>" +
+      "<param><value><i4>-3</i4></value></param>" +
+      "<param><value><boolean>1</boolean></value></param>" +
+      "<param><value><double>0.5</double></value></param>" +
+      "<param><value><string>a &lt;&amp;&gt; b</string></value></param>" +
+      "<param><value><struct><member><name>k</name><value><int>1</int></value></member></struct></value></param>" +
+      "<param><value><array><data/></array></value></param>" +
+      "</params></methodCall>"
+    method, params = ROS::XMLRPCCodec.parse_call(data)
+    params.should eq([-3, true, 0.5, "a <&> b", {"k" => 1}, []])
+  end
+
+  it "should raise ROSError on broken documents" do
+    lambda { ROS::XMLRPCCodec.parse_call("<methodCall><methodName>m") }.should raise_error(ROS::ROSError)
+  end
+end
+
+describe ROS::XMLRPCCodec, ".encode_response" do
+  it "should be parsed back" do
+    value = [1, "a<b", ["TCPROS", "host", 1234], {"x" => 1.5}, false]
+    data = ROS::XMLRPCCodec.encode_response(value)
+    call = data.sub("methodResponse", "methodCall").sub("<params>", "<methodName>r</methodName><params>").
+      sub("</methodResponse>", "</methodCall>")
+    ROS::XMLRPCCodec.parse_call(call)[1].should eq([value])
+  end
+end